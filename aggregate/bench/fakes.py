@@ -0,0 +1,107 @@
+import random
+import threading
+import time
+
+FAKE_MODULE_TYPE = 'fake'
+FAKE_PROPERTIES = ('volume', 'power', 'input', 'title')
+FAKE_METHODS = ('press_key', 'launch_app')
+
+
+class FakeModuleError(Exception):
+    pass
+
+
+class FakeNode(object):
+    """Node table entry
+    """
+    def __init__(self, name, address, modules):
+        self.name = name
+        self.address = address
+        self.modules = modules
+
+    def get_serializable_dict(self, simple=True):
+        ret = {'node_element': self.name,
+               'node_address': self.address}
+        if not simple:
+            ret['modules'] = list(self.modules)
+        return ret
+
+
+class FakeDriverManager(object):
+    """Stand-in for the viscum module manager driving fake devices
+
+       Every property access and method call sleeps for latency
+       seconds plus up to jitter seconds, like a network device would.
+    """
+    def __init__(self, module_count=8, latency=0.005, jitter=0.0,
+                 seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.modules = {}
+        for index in range(module_count):
+            module_name = '{}-{}'.format(FAKE_MODULE_TYPE, index)
+            self.modules[module_name] = {'volume': -40.0,
+                                         'power': True,
+                                         'input': 'HDMI1',
+                                         'title': 'track {}'.format(index)}
+
+    def _device_delay(self):
+        if self.jitter:
+            with self._lock:
+                delay = self.latency + self._random.uniform(0, self.jitter)
+        else:
+            delay = self.latency
+        if delay > 0:
+            time.sleep(delay)
+
+    def _get_module(self, module_name):
+        if module_name not in self.modules:
+            raise FakeModuleError('unknown module: "{}"'.format(module_name))
+        return self.modules[module_name]
+
+    def list_loaded_modules(self):
+        return sorted(self.modules)
+
+    def get_module_info(self, module_name):
+        self._get_module(module_name)
+        return {'module_type': FAKE_MODULE_TYPE,
+                'instance_name': module_name,
+                'description': 'fake device for load testing'}
+
+    def get_module_property_list(self, module_name):
+        self._get_module(module_name)
+        return dict([(name, {'property_desc': name,
+                             'permissions': 'RW'})
+                     for name in FAKE_PROPERTIES])
+
+    def get_module_method_list(self, module_name):
+        self._get_module(module_name)
+        return dict([(name, {'method_desc': name,
+                             'method_args': {}})
+                     for name in FAKE_METHODS])
+
+    def get_module_property(self, module_name, property_name):
+        # unknown properties read as None so that captures taken on a
+        # real installation replay cleanly
+        module = self._get_module(module_name)
+        self._device_delay()
+        return module.get(property_name)
+
+    def set_module_property(self, module_name, property_name, value):
+        module = self._get_module(module_name)
+        self._device_delay()
+        module[property_name] = value
+        return True
+
+    def call_module_method(self, module_name, method_name, **kwargs):
+        self._get_module(module_name)
+        self._device_delay()
+        return True
+
+    def call_custom_method(self, method_name, *args, **kwargs):
+        return None
+
+    def external_interrupt(self, interrupt_key, **kwargs):
+        return None
@@ -0,0 +1,308 @@
+import http.client
+import itertools
+import json
+import math
+import random
+import threading
+import time
+from aggregate.bench.fakes import (FAKE_METHODS,
+                                   FAKE_MODULE_TYPE,
+                                   FAKE_PROPERTIES)
+
+DEFAULT_MIX = {'list_nodes': 1,
+               'module_get_property': 6,
+               'module_set_property': 2,
+               'module_call_method': 1}
+REPORT_PERCENTILES = (50, 90, 95, 99)
+
+
+def parse_mix(mix_string):
+    """Parse "rpc=weight,..." into a dictionary
+    """
+    mix = {}
+    for item in mix_string.split(','):
+        name, sep, weight = item.partition('=')
+        if not sep or name not in DEFAULT_MIX:
+            raise ValueError('invalid mix entry: "{}"'.format(item))
+        mix[name] = float(weight)
+
+    return mix
+
+
+def percentile(values, p):
+    """Nearest rank percentile of a sorted list
+    """
+    if not values:
+        return None
+
+    rank = max(int(math.ceil(p / 100.0 * len(values))) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def load_capture(path):
+    """Read a request capture written by aggsrv --capture-rpc, returns
+       a list of (offset, request) sorted by offset
+    """
+    entries = []
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            entries.append((float(entry['t']), entry['request']))
+
+    entries.sort(key=lambda entry: entry[0])
+    return entries
+
+
+def remap_modules(entries, module_count):
+    """Map the module names of captured module_* requests onto fake
+       instances, in order of first appearance
+    """
+    mapping = {}
+
+    def _fake_name(module_name):
+        if module_name not in mapping:
+            mapping[module_name] = '{}-{}'.format(FAKE_MODULE_TYPE,
+                                                  len(mapping) % module_count)
+        return mapping[module_name]
+
+    def _remap(request):
+        if not isinstance(request, dict) or\
+           not str(request.get('method', '')).startswith('module_'):
+            return request
+
+        params = request.get('params')
+        if isinstance(params, list) and params and\
+           isinstance(params[0], str):
+            params = [_fake_name(params[0])] + params[1:]
+        elif isinstance(params, dict) and\
+                isinstance(params.get('module_name'), str):
+            params = dict(params, module_name=_fake_name(params['module_name']))
+        return dict(request, params=params)
+
+    ret = []
+    for offset, request in entries:
+        if isinstance(request, list):
+            request = [_remap(item) for item in request]
+        else:
+            request = _remap(request)
+        ret.append((offset, request))
+
+    return ret
+
+
+class RequestFactory(object):
+    """Random requests against the fake drivers following a weighted mix
+    """
+    def __init__(self, module_count=8, mix=None, seed=None):
+        self.modules = ['{}-{}'.format(FAKE_MODULE_TYPE, index)
+                        for index in range(module_count)]
+        mix = mix or DEFAULT_MIX
+        self.methods = sorted(mix)
+        self.weights = [mix[name] for name in self.methods]
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def make(self):
+        with self._lock:
+            method = self._random.choices(self.methods, self.weights)[0]
+            module_name = self._random.choice(self.modules)
+            property_name = self._random.choice(FAKE_PROPERTIES)
+            value = round(self._random.uniform(-60, -20), 1)
+            method_name = self._random.choice(FAKE_METHODS)
+
+        if method == 'list_nodes':
+            params = []
+        elif method == 'module_get_property':
+            params = [module_name, property_name]
+        elif method == 'module_set_property':
+            params = [module_name, 'volume', value]
+        else:
+            params = [module_name, method_name]
+
+        return {'jsonrpc': '2.0', 'method': method, 'params': params,
+                'id': 1}
+
+
+class LatencyStats(object):
+    """Latencies and outcomes per RPC name
+    """
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def add(self, method, latency, ok=True, rejected=False):
+        with self._lock:
+            self.latencies.setdefault(method, []).append(latency)
+            if rejected:
+                self.rejected += 1
+            if not ok:
+                self.errors[method] = self.errors.get(method, 0) + 1
+
+    @staticmethod
+    def _summarize(values):
+        values = sorted(values)
+        ret = {'count': len(values),
+               'mean': sum(values) / len(values) if values else None,
+               'max': values[-1] if values else None}
+        for p in REPORT_PERCENTILES:
+            ret['p{}'.format(p)] = percentile(values, p)
+        return ret
+
+    def summary(self, elapsed):
+        with self._lock:
+            every = list(itertools.chain(*self.latencies.values()))
+            methods = dict([(method, dict(self._summarize(values),
+                                          errors=self.errors.get(method, 0)))
+                            for method, values in self.latencies.items()])
+            errors = sum(self.errors.values())
+
+        return {'requests': len(every),
+                'errors': errors,
+                'rejected': self.rejected,
+                'elapsed': elapsed,
+                'throughput': len(every) / elapsed if elapsed else None,
+                'latency': self._summarize(every),
+                'methods': methods}
+
+
+class _Client(object):
+    """Keep-alive JSON-RPC client, reconnects after failures
+    """
+    def __init__(self, host, port, timeout):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.connection = None
+
+    def call(self, request):
+        """Returns (status, decoded response or None)
+        """
+        if self.connection is None:
+            self.connection = http.client.HTTPConnection(self.host,
+                                                         self.port,
+                                                         timeout=self.timeout)
+        try:
+            self.connection.request('POST', '/', json.dumps(request),
+                                    {'Content-Type': 'application/json'})
+            response = self.connection.getresponse()
+            data = response.read()
+            if response.getheader('Connection', '').lower() == 'close':
+                self.close()
+        except (OSError, http.client.HTTPException):
+            self.close()
+            raise
+
+        try:
+            return response.status, json.loads(data.decode('utf-8'))
+        except ValueError:
+            return response.status, None
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+def _response_ok(status, response):
+    if status == 204:
+        return True
+    if status != 200 or response is None:
+        return False
+    if isinstance(response, list):
+        return all(['error' not in item for item in response])
+    return 'error' not in response
+
+
+class LoadGenerator(object):
+    """Drives a JSON-RPC server with a fixed number of client threads
+
+       In rate and replay modes requests have a due time and latency
+       is measured from it, so a slow server is not hidden by clients
+       that fall behind.
+    """
+    def __init__(self, host='localhost', port=8080, concurrency=8,
+                 timeout=10):
+        self.host = host
+        self.port = port
+        self.concurrency = concurrency
+        self.timeout = timeout
+
+    def _run(self, schedule, deadline=None):
+        stats = LatencyStats()
+        schedule = iter(schedule)
+        lock = threading.Lock()
+        start = time.perf_counter()
+
+        def _worker():
+            client = _Client(self.host, self.port, self.timeout)
+            try:
+                while True:
+                    with lock:
+                        item = next(schedule, None)
+                    if item is None:
+                        return
+
+                    due, request = item
+                    if due is not None:
+                        due += start
+                        delay = due - time.perf_counter()
+                        if delay > 0:
+                            time.sleep(delay)
+
+                    sent = time.perf_counter()
+                    if deadline is not None and sent - start > deadline:
+                        return
+
+                    if isinstance(request, dict):
+                        method = str(request.get('method'))
+                    else:
+                        method = 'batch'
+
+                    try:
+                        status, response = client.call(request)
+                        ok = _response_ok(status, response)
+                    except (OSError, http.client.HTTPException):
+                        status, ok = None, False
+
+                    done = time.perf_counter()
+                    stats.add(method, done - (due if due is not None
+                                              else sent),
+                              ok, rejected=status == 503)
+            finally:
+                client.close()
+
+        workers = [threading.Thread(target=_worker)
+                   for _ in range(self.concurrency)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        return stats.summary(time.perf_counter() - start)
+
+    def run_closed(self, factory, duration):
+        """Every client sends back to back for duration seconds
+        """
+        def _schedule():
+            while True:
+                yield None, factory.make()
+
+        return self._run(_schedule(), deadline=duration)
+
+    def run_rate(self, factory, rate, duration):
+        """Send rate requests per second for duration seconds
+        """
+        count = int(rate * duration)
+        return self._run(((index / float(rate), factory.make())
+                          for index in range(count)))
+
+    def run_replay(self, entries, speed=1.0):
+        """Replay a capture, speed > 1 compresses the original timing
+        """
+        return self._run(((offset / speed, request)
+                          for offset, request in entries))
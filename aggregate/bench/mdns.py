@@ -0,0 +1,110 @@
+import select
+import socket
+import threading
+import time
+from aggregate.discover.mdns import NativeMDNSDiscovery
+from aggregate.util.thread import StoppableThread
+
+STANDIN_HOST = '127.0.0.1'
+
+
+class LoopbackGroup(StoppableThread):
+    """Stand-in for the mDNS multicast group on the loopback interface
+
+       Every datagram received is relayed to every other member seen
+       so far; members join by sending anything. Relayed datagrams come
+       from the group address, like multicast traffic to port 5353.
+    """
+    def __init__(self, host=STANDIN_HOST, port=0, loss=None):
+        super(LoopbackGroup, self).__init__()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, port))
+        self.address = self.sock.getsockname()
+        # optional callable (data, addr) -> True to drop a datagram
+        self.loss = loss
+        self.members = set()
+        self.relayed = 0
+        self.dropped = 0
+
+    def run(self):
+        try:
+            while not self.is_stopped():
+                readable, _, _ = select.select([self.sock], [], [], 0.1)
+                if not readable:
+                    continue
+                data, addr = self.sock.recvfrom(9000)
+                self.members.add(addr)
+                if self.loss is not None and self.loss(data, addr):
+                    self.dropped += 1
+                    continue
+                for member in list(self.members):
+                    if member != addr:
+                        self.sock.sendto(data, member)
+                        self.relayed += 1
+        finally:
+            self.sock.close()
+
+
+def _wait_for(condition, timeout):
+    start = time.monotonic()
+    while time.monotonic() - start < timeout:
+        if condition():
+            return time.monotonic() - start
+        time.sleep(0.01)
+    return None
+
+
+def run_discovery(services=8, timeout=10.0):
+    """Publish services on a responder and browse them from a querier
+       over a loopback group, returns discovery and removal latencies
+    """
+    group = LoopbackGroup()
+    group.start()
+
+    resolved = {}
+    removed = set()
+    lock = threading.Lock()
+
+    def _resolved(**kwargs):
+        with lock:
+            resolved[kwargs['name']] = time.monotonic()
+
+    def _removed(**kwargs):
+        with lock:
+            removed.add(kwargs['name'])
+
+    responder = NativeMDNSDiscovery('ppbench', group=group.address,
+                                    hostname='ppbench-responder')
+    querier = NativeMDNSDiscovery('ppbench',
+                                  service_resolved_cb=_resolved,
+                                  service_removed_cb=_removed,
+                                  type_filter=set(['_http._tcp']),
+                                  group=group.address)
+    names = ['bench service {}'.format(i) for i in range(services)]
+    try:
+        responder.start()
+        querier.start()
+        start = time.monotonic()
+        for index, name in enumerate(names):
+            responder.publish(name, '_http._tcp', 8000 + index,
+                              ['index={}'.format(index)])
+
+        discovery = _wait_for(lambda: len(resolved) == services, timeout)
+        for name in names:
+            responder.unpublish(name, '_http._tcp')
+        removal = _wait_for(lambda: len(removed) == services, timeout)
+    finally:
+        for component in (responder, querier, group):
+            component.stop()
+            component.join()
+
+    return {'services': services,
+            'resolved': len(resolved),
+            'removed': len(removed),
+            'discovery_s': discovery,
+            'slowest_resolve_s': (max(resolved.values()) - start
+                                  if resolved else None),
+            'removal_s': removal,
+            'querier': dict(querier.stats),
+            'responder': dict(responder.stats),
+            'relayed': group.relayed}
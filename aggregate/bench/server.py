@@ -0,0 +1,146 @@
+import asyncio
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from aggregate.bench.fakes import (FakeDriverManager,
+                                   FakeNode,
+                                   FAKE_MODULE_TYPE,
+                                   FAKE_PROPERTIES)
+from aggregate.events import EventHub
+from aggregate.jsonsrv import PeriodicPiAggController, make_json_rpc
+from aggregate.jsonsrv.aio import AsyncJsonRpcServer
+from aggregate.jsonsrv.cache import PropertyCache
+from aggregate.jsonsrv.cmdqueue import DeviceCommandQueues
+from aggregate.jsonsrv.dispatch import JsonRpcDispatcher
+from aggregate.jsonsrv.introspect import IntrospectionCache
+from aggregate.jsonsrv.metrics import RpcMetrics
+from aggregate.jsonsrv.pool import PooledJsonRpcServer
+from aggregate.util.nodes import NodeTable
+
+BENCH_SERVERS = ('pool', 'asyncio', 'threading')
+
+
+class BenchServer(object):
+    """The aggregator JSON-RPC stack (cache, command queues, metrics,
+       events) serving fake drivers, started in-process
+    """
+    def __init__(self, server='pool', port=18080, workers=8, queue_size=64,
+                 module_count=8, node_count=4, latency=0.005, jitter=0.0,
+                 cache_ttl=None):
+        if server not in BENCH_SERVERS:
+            raise ValueError('invalid server: "{}"'.format(server))
+
+        self.server = server
+        self.port = port
+        self.workers = workers
+        self.queue_size = queue_size
+
+        self.drvman = FakeDriverManager(module_count, latency, jitter)
+        self.nodes = NodeTable()
+        modules = self.drvman.list_loaded_modules()
+        for index in range(node_count):
+            name = 'node{}'.format(index)
+            self.nodes.add(name, FakeNode(name, '10.0.0.{}'.format(index+1),
+                                          modules[index::node_count]))
+
+        policies = {}
+        if cache_ttl:
+            policies[FAKE_MODULE_TYPE] =\
+                {'properties': dict([(name, cache_ttl)
+                                     for name in FAKE_PROPERTIES]),
+                 'methods': {}}
+
+        self.property_cache = PropertyCache(policies)
+        self.metrics = RpcMetrics()
+        self.command_queues = DeviceCommandQueues(metrics=self.metrics)
+        self.introspection = IntrospectionCache()
+        self.events = EventHub(root_logger='aggbench')
+
+        self.json_server = None
+        self.loop = None
+        self._loop_thread = None
+        self._executors = []
+
+    def _make_dispatcher(self):
+        rpc_methods = make_json_rpc(self.drvman, self.nodes,
+                                    property_cache=self.property_cache,
+                                    event_hub=self.events,
+                                    command_queues=self.command_queues,
+                                    rpc_metrics=self.metrics,
+                                    introspection_cache=self.introspection,
+                                    preencoded=True)()
+        batch_executor = ThreadPoolExecutor(max_workers=self.workers)
+        self._executors.append(batch_executor)
+        return JsonRpcDispatcher(rpc_methods, root_logger='aggbench',
+                                 batch_executor=batch_executor,
+                                 metrics=self.metrics)
+
+    def start(self, timeout=5):
+        if self.server == 'pool':
+            self.json_server = PooledJsonRpcServer(self._make_dispatcher(),
+                                                   port=self.port,
+                                                   workers=self.workers,
+                                                   queue_size=self.queue_size,
+                                                   event_hub=self.events,
+                                                   root_logger='aggbench')
+            self.json_server.start()
+        elif self.server == 'asyncio':
+            executor = ThreadPoolExecutor(max_workers=self.workers)
+            self._executors.append(executor)
+            self.loop = asyncio.new_event_loop()
+            self.json_server = AsyncJsonRpcServer(self.loop,
+                                                  self._make_dispatcher(),
+                                                  port=self.port,
+                                                  executor=executor,
+                                                  root_logger='aggbench',
+                                                  event_hub=self.events)
+            self.json_server.start()
+            self._loop_thread = threading.Thread(target=self.loop.run_forever)
+            self._loop_thread.start()
+        else:
+            self.json_server = PeriodicPiAggController(self.drvman,
+                                                       self.nodes,
+                                                       self.property_cache,
+                                                       self.events,
+                                                       self.command_queues,
+                                                       self.metrics,
+                                                       self.introspection,
+                                                       port=self.port)
+            self.json_server.start()
+
+        self._wait_ready(timeout)
+
+    def _wait_ready(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                socket.create_connection(('localhost', self.port),
+                                         timeout=1).close()
+                return
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+
+    def stop(self):
+        if self.json_server is None:
+            return
+
+        self.json_server.stop()
+        if self.server == 'asyncio':
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._loop_thread.join()
+        else:
+            self.json_server.join()
+
+        for executor in self._executors:
+            executor.shutdown(wait=False)
+        self.json_server = None
+
+    def get_stats(self):
+        """Server side view of the run
+        """
+        return {'rpc': self.metrics.get_stats(),
+                'cache': self.property_cache.get_stats(),
+                'queue': self.command_queues.get_stats()}
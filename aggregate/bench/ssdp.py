@@ -0,0 +1,217 @@
+import random
+import re
+import time
+from aggregate.util.ssdp import (parse_ssdp_message,
+                                 SSDP_NOTIFY,
+                                 SSDP_RESPONSE,
+                                 SSDP_SEARCH)
+
+# datagrams seen from devices the plugins drive plus broken variants
+SSDP_CORPUS = (
+    b'HTTP/1.1 200 OK\r\n'
+    b'Cache-Control: max-age=3600\r\n'
+    b'ST: roku:ecp\r\n'
+    b'USN: uuid:roku:ecp:YN00AB123456\r\n'
+    b'Ext: \r\n'
+    b'Server: Roku UPnP/1.0 Roku/9.1.0\r\n'
+    b'LOCATION: http://192.168.1.20:8060/\r\n'
+    b'device-group.roku.com: 7A3C1F\r\n'
+    b'\r\n',
+    b'HTTP/1.1 200 OK\r\n'
+    b'CACHE-CONTROL: max-age=1800\r\n'
+    b'EXT:\r\n'
+    b'LOCATION: http://192.168.1.21:52323/dmr.xml\r\n'
+    b'SERVER: Linux/2.6 UPnP/1.0 BDP-S/1.0\r\n'
+    b'ST: urn:schemas-upnp-org:device:MediaRenderer:1\r\n'
+    b'USN: uuid:00000000-0000-1010-8000-bdp150::'
+    b'urn:schemas-upnp-org:device:MediaRenderer:1\r\n'
+    b'X-AV-Physical-Unit-Info: pa="BDP-S1500";\r\n'
+    b'\r\n',
+    b'NOTIFY * HTTP/1.1\r\n'
+    b'HOST: 239.255.255.250:1900\r\n'
+    b'CACHE-CONTROL: max-age=1800\r\n'
+    b'LOCATION: http://192.168.1.22:49154/MediaRenderer/desc.xml\r\n'
+    b'NT: urn:schemas-upnp-org:device:MediaRenderer:1\r\n'
+    b'NTS: ssdp:alive\r\n'
+    b'SERVER: Network_Module/1.0 (RX-V677) UPnP/1.0\r\n'
+    b'USN: uuid:5f9ec1b3-ed59-1900-4530-00a0dea3::'
+    b'urn:schemas-upnp-org:device:MediaRenderer:1\r\n'
+    b'BOOTID.UPNP.ORG: 12\r\n'
+    b'\r\n',
+    b'NOTIFY * HTTP/1.1\r\n'
+    b'HOST: 239.255.255.250:1900\r\n'
+    b'NT: roku:ecp\r\n'
+    b'NTS: ssdp:byebye\r\n'
+    b'USN: uuid:roku:ecp:YN00AB123456\r\n'
+    b'\r\n',
+    b'M-SEARCH * HTTP/1.1\r\n'
+    b'HOST: 239.255.255.250:1900\r\n'
+    b'MAN: "ssdp:discover"\r\n'
+    b'MX: 3\r\n'
+    b'ST: ssdp:all\r\n'
+    b'\r\n',
+    # bare LF, no trailing blank line
+    b'HTTP/1.1 200 OK\nST: roku:ecp\nUSN: uuid:lf-only\nLOCATION: http://x/',
+    # mixed line endings, odd spacing and case
+    b'HTTP/1.0 200 OK\r\nst:roku:ecp\nusn :  uuid:mixed  \r\n\n',
+    # header lines that are not headers
+    b'HTTP/1.1 200 OK\r\nST: roku:ecp\r\ngarbage\r\n: novalue\r\n'
+    b'Bad Name: 1\r\nUSN: uuid:bad-lines\r\n\r\n',
+    # non UTF-8 value
+    b'HTTP/1.1 200 OK\r\nST: roku:ecp\r\nSERVER: \xff\xfe\r\n'
+    b'USN: uuid:latin\r\n\r\n',
+    b'HTTP/1.1 2',
+    b'HTTP/1.1\r\n\r\n',
+    b'\r\n\r\n',
+    b'',
+    b'\x00' * 64,
+)
+
+# expected (kind, ST, USN) of the seed corpus
+SSDP_CORPUS_EXPECTED = (
+    (SSDP_RESPONSE, 'roku:ecp', 'uuid:roku:ecp:YN00AB123456'),
+    (SSDP_RESPONSE, 'urn:schemas-upnp-org:device:MediaRenderer:1',
+     'uuid:00000000-0000-1010-8000-bdp150::'
+     'urn:schemas-upnp-org:device:MediaRenderer:1'),
+    (SSDP_NOTIFY, None, 'uuid:5f9ec1b3-ed59-1900-4530-00a0dea3::'
+     'urn:schemas-upnp-org:device:MediaRenderer:1'),
+    (SSDP_NOTIFY, None, 'uuid:roku:ecp:YN00AB123456'),
+    (SSDP_SEARCH, 'ssdp:all', None),
+    (SSDP_RESPONSE, 'roku:ecp', 'uuid:lf-only'),
+    (SSDP_RESPONSE, 'roku:ecp', 'uuid:mixed'),
+    (SSDP_RESPONSE, 'roku:ecp', 'uuid:bad-lines'),
+    (SSDP_RESPONSE, 'roku:ecp', 'uuid:latin'),
+    (None, None, None),
+    (None, None, None),
+    (None, None, None),
+    (None, None, None),
+    (None, None, None),
+)
+
+_MUTATION_BYTES = (b'\r', b'\n', b':', b' ', b'\r\n', b'\x00', b'\xff')
+
+
+def legacy_parse(data):
+    """The decode, split and regex parser discovery used to run, kept
+       as a baseline for the benchmark
+    """
+    lines = data.decode().split('\n')[:-2]
+    m = re.match(r'^HTTP/([0-9\.]+) ([0-9]+) (.*)', lines[0])
+    if m is None:
+        return None
+
+    ret_val = {}
+    for line in lines[1::]:
+        m = re.match(r'([a-zA-Z_\-]+):\s*(.*)$', line)
+        ret_val[m.group(1).upper()] = m.group(2).strip()
+
+    return ret_val
+
+
+def mutate(data, rng):
+    """Random truncation, byte flips and insertions of line breaks
+       and separators
+    """
+    data = bytearray(data)
+    for _ in range(rng.randint(1, 4)):
+        choice = rng.random()
+        pos = rng.randint(0, len(data))
+        if choice < 0.25:
+            del data[pos:]
+        elif choice < 0.5 and data:
+            data[min(pos, len(data)-1)] = rng.randint(0, 255)
+        elif choice < 0.75:
+            data[pos:pos] = rng.choice(_MUTATION_BYTES)
+        else:
+            end = min(pos + rng.randint(1, 32), len(data))
+            data[pos:pos] = data[pos:end]
+
+    return bytes(data)
+
+
+def check_corpus():
+    """Verify the parser against the seed corpus, returns the failures
+    """
+    failures = []
+    for data, (kind, st, usn) in zip(SSDP_CORPUS, SSDP_CORPUS_EXPECTED):
+        got_kind, headers = parse_ssdp_message(data)
+        headers = headers or {}
+        if (got_kind, headers.get('ST'), headers.get('USN')) !=\
+           (kind, st, usn):
+            failures.append({'data': data.decode('latin-1'),
+                             'kind': got_kind,
+                             'headers': headers})
+
+    return failures
+
+
+def run_fuzz(iterations=100000, seed=0):
+    """Feed mutated corpus datagrams to the parser, both as bytes and
+       through a reused receive buffer, and check results agree
+    """
+    rng = random.Random(seed)
+    buf = bytearray(2048)
+    failures = []
+    for _ in range(iterations):
+        data = mutate(rng.choice(SSDP_CORPUS), rng)[:len(buf)]
+        try:
+            result = parse_ssdp_message(data)
+            buf[:len(data)] = data
+            if parse_ssdp_message(buf, len(data)) != result:
+                raise ValueError('buffer and bytes results differ')
+            kind, headers = result
+            if kind is not None and\
+               not all([isinstance(value, str)
+                        for value in headers.values()]):
+                raise ValueError('non string header value')
+        except Exception as e:
+            failures.append({'data': data.decode('latin-1'),
+                             'error': repr(e)})
+
+    return {'iterations': iterations,
+            'seed': seed,
+            'failures': failures[:20],
+            'failure_count': len(failures)}
+
+
+def _legacy_parses(data):
+    try:
+        return legacy_parse(data) is not None
+    except Exception:
+        return False
+
+
+def _time_parser(parse, calls, iterations):
+    # every variant is called the same way so that only parsing differs
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for args in calls:
+            parse(*args)
+    elapsed = time.perf_counter() - start
+    count = iterations * len(calls)
+    return {'messages': count,
+            'elapsed': elapsed,
+            'per_message_us': elapsed / count * 1e6}
+
+
+def run_benchmark(iterations=20000):
+    """Time the parser against the legacy parser on the responses both
+       handle, and on a reused receive buffer
+
+       Parsing a buffer costs the same as parsing bytes, what the buffer
+       saves is the per datagram allocation of recvfrom, which is not
+       measured here.
+    """
+    datagrams = [(data,) for data in SSDP_CORPUS if _legacy_parses(data)]
+    # receive buffers as filled by recvfrom_into
+    buffers = []
+    for data, in datagrams:
+        buf = bytearray(2048)
+        buf[:len(data)] = data
+        buffers.append((buf, len(data)))
+
+    return {'parser': _time_parser(parse_ssdp_message, datagrams,
+                                   iterations),
+            'parser_buffer': _time_parser(parse_ssdp_message, buffers,
+                                          iterations),
+            'legacy': _time_parser(legacy_parse, datagrams, iterations)}
@@ -1,129 +1,45 @@
-import dbus
-from gi.repository import GObject as gobject
-import avahi
-from dbus.mainloop.glib import DBusGMainLoop
+import heapq
+from aggregate.util.ssdp import (parse_ssdp_message,
+                                 SSDP_NOTIFY,
+                                 SSDP_RESPONSE)
 from aggregate.util.thread import StoppableThread
 import logging
+import select
 import socket
+import threading
 import time
 import re
 
+SSDP_RECV_BUFFER_SIZE = 65536
+SSDP_MULTICAST_TTL = 2
+SSDP_MULTICAST_ADDR = '239.255.255.250'
+SSDP_PORT = 1900
+# lifetime of passively tracked services that announce no max-age
+SSDP_DEFAULT_MAX_AGE = 1800
 
-def get_service_text_list(byte_array):
-    """Convert DBUS text list to a python list
-    """
-    if byte_array.signature != 'ay':
-        return []
-
-    text_list = []
-    for element in byte_array:
-        # really stupid redundant check, but whatever
-        if element.signature != 'y':
-            continue
-
-        text_list.append(''.join([chr(x) for x in element]))
-
-    return text_list
-
-
-class AvahiDiscoverLoop(StoppableThread):
-    """Discovery loop with Avahi
-    """
-    def __init__(self, root_logger, service_resolved_cb=None,
-                 service_removed_cb=None, type_filter=None):
-        super(AvahiDiscoverLoop, self).__init__()
-        self.resolve_cb = service_resolved_cb
-        self.remove_cb = service_removed_cb
-        self.main_loop = None
+MAX_AGE_REGEX = re.compile(r'max-age\s*=\s*([0-9]+)', re.IGNORECASE)
 
-        self.type_filter = type_filter
-        self.logger = logging.getLogger('{}.discoverLoop'.format(root_logger))
 
-        # make sure that gobject is OK with threads
-        gobject.threads_init()
-
-    def stop(self):
-        super(AvahiDiscoverLoop, self).stop()
-        self.main_loop.quit()
-
-    def run(self):
-        def _item_resolved_cb(*args):
-            if self.resolve_cb is not None:
-                # call everything as named arguments,
-                # discard DBus types!
-                self.resolve_cb(iface=int(args[0]),
-                                proto=int(args[1]),
-                                kind=str(args[3]),
-                                name=str(args[2]),
-                                host=str(args[5]),
-                                address=str(args[7]),
-                                port=int(args[8]),
-                                text=get_service_text_list(args[9]))
-
-        def _error_cb(*args):
-            self.logger.error('error resolving service: {}'.format(args))
-
-        def _item_remove_event(interface, protocol,
-                               name, stype, domain, flags):
-            if flags & avahi.LOOKUP_RESULT_LOCAL:
-                # local service, skip
-                return
-
-            if self.remove_cb is not None:
-                self.remove_cb(iface=int(interface),
-                               proto=int(protocol),
-                               kind=str(stype),
-                               name=str(name))
-
-        def _item_new_event(interface, protocol, name, stype, domain, flags):
-            server.ResolveService(interface, protocol, name, stype,
-                                  domain, avahi.PROTO_UNSPEC, dbus.UInt32(0),
-                                  reply_handler=_item_resolved_cb,
-                                  error_handler=_error_cb)
-
-        loop = DBusGMainLoop()
-        bus = dbus.SystemBus(mainloop=loop)
-        server = dbus.Interface(bus.get_object(avahi.DBUS_NAME, '/'),
-                                'org.freedesktop.Avahi.Server')
-
-        # register several kinds of service
-        for service_type in self.type_filter:
-            self.logger.debug('registering callbacks for service type "{}"'
-                              .format(service_type))
-            sbrowser = dbus.Interface(bus.get_object(avahi.DBUS_NAME,
-                                                     server.ServiceBrowserNew(avahi.IF_UNSPEC,
-                                                                              avahi.PROTO_UNSPEC,
-                                                                              service_type,
-                                                                              'local',
-                                                                              dbus.UInt32(0))),
-                                      avahi.DBUS_INTERFACE_SERVICE_BROWSER)
-
-            # connect new item signal
-            sbrowser.connect_to_signal("ItemNew", _item_new_event)
-            # connect item remove signal
-            sbrowser.connect_to_signal("ItemRemove", _item_remove_event)
-
-        self.main_loop = gobject.MainLoop()
-
-        # run main loop
-        self.main_loop.run()
-
-        # finish thread execution
-        if self.is_stopped():
-            exit(0)
-
-
-class SimpleSSDPDiscovery(StoppableThread):
-    """Discovery using SSDP
+class SSDPDiscoveryBase(object):
+    """SSDP search state shared by the threaded and asyncio discovery
     """
     def __init__(self, root_logger, interval, removal_interval,
-                 service_discovered_cb=None, service_removed_cb=None):
-        super(SimpleSSDPDiscovery, self).__init__()
+                 service_discovered_cb=None, service_removed_cb=None, mx=3,
+                 passive=True, clock=time.monotonic):
+        super(SSDPDiscoveryBase, self).__init__()
         self.logger = logging.getLogger('{}.ssdp'.format(root_logger))
         self.intval = interval
         self.rem_intval_units = removal_interval
+        # seconds devices may wait before answering a search
+        self.mx = mx
         self.queries = {}
 
+        # passive mode follows NOTIFY announcements and only searches
+        # on startup and on demand; it falls back to periodic searches
+        # when the multicast group cannot be joined
+        self.passive = passive
+        self.listening = False
+
         # callbacks
         self.discover_cb = service_discovered_cb
         self.remove_cb = service_removed_cb
@@ -131,6 +47,12 @@ class SimpleSSDPDiscovery(StoppableThread):
         # keep a dictionary of known services and generate events from that
         self.known_services = {}
 
+        # expiry deadline per USN and a min-heap of (deadline, USN);
+        # sightings push a new entry and outdated ones are skipped
+        self.clock = clock
+        self._expiry = {}
+        self._expiry_heap = []
+
     def add_discovery_type(self, host_addr, host_port, service_type):
         self.queries[service_type] = [host_addr, host_port]
 
@@ -138,73 +60,285 @@ class SimpleSSDPDiscovery(StoppableThread):
         if service_type in self.queries:
             del self.queries[service_type]
 
-    def _parse_ssdp_return(self, data, search_all=False):
-        # remove blank line at the end!
-        lines = data.decode().split('\n')[:-2]
-
-        # check response
-        m = re.match(r'^HTTP/([0-9\.]+) ([0-9]+) (.*)', lines[0])
-        if m is None:
+    def restore_services(self, services):
+        """Seed known services, call before starting discovery
+        """
+        for service in services:
+            service = dict(service)
+            service['last_seen'] = time.time()
+            self.known_services[service['USN']] = service
+            self._schedule_expiry(service['USN'], service)
+
+    def _parse_ssdp_return(self, data, length=None):
+        kind, headers = parse_ssdp_message(data, length)
+        if kind != SSDP_RESPONSE:
             # garbage
             return None
 
-        # build a dictionary with the data retrieved
-        ret_val = {}
-        for line in lines[1::]:
-            m = re.match(r'([a-zA-Z_\-]+):\s*(.*)$', line)
-            ret_val[m.group(1).upper()] = m.group(2).strip()
+        return headers
+
+    def _service_lifetime(self, service):
+        """Seconds a service stays known without being seen again
+        """
+        m = MAX_AGE_REGEX.search(service.get('CACHE-CONTROL', ''))
+        if m is not None:
+            return int(m.group(1))
+
+        if self.listening:
+            return SSDP_DEFAULT_MAX_AGE
+
+        return self.intval*self.rem_intval_units
+
+    def _open_notify_socket(self):
+        """Socket joined to the SSDP multicast group or None
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if hasattr(socket, 'SO_REUSEPORT'):
+                # other SSDP stacks on this host listen as well
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            sock.bind(('', SSDP_PORT))
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                            socket.inet_aton(SSDP_MULTICAST_ADDR) +
+                            socket.inet_aton('0.0.0.0'))
+        except OSError as e:
+            self.logger.warning('cannot listen to SSDP announcements, '
+                                'falling back to periodic searches: {}'
+                                .format(e))
+            sock.close()
+            return None
 
-        return ret_val
+        sock.setblocking(False)
+        return sock
+
+    def _response_received(self, data, addr, length=None):
+        self._service_seen(self._parse_ssdp_return(data, length))
+
+    def _notify_received(self, data, addr, length=None):
+        kind, notify = parse_ssdp_message(data, length)
+        if kind != SSDP_NOTIFY:
+            # searches from other control points, garbage
+            return
+
+        if 'USN' not in notify or 'NT' not in notify:
+            return
+
+        nts = notify.pop('NTS', '')
+        # announcements carry the type as NT, searches answer with ST
+        notify['ST'] = notify.pop('NT')
+        if nts == 'ssdp:byebye':
+            self._service_gone(notify['USN'])
+        elif nts in ('ssdp:alive', 'ssdp:update'):
+            self._service_seen(notify)
+
+    def _service_gone(self, usn):
+        self._expiry.pop(usn, None)
+        service = self.known_services.pop(usn, None)
+        if service is not None and self.remove_cb:
+            self.remove_cb(**service)
+
+    def _build_search_request(self, st, addr):
+        ssdpRequest = "M-SEARCH * HTTP/1.1\r\n" + \
+                      "HOST: {}:{}\r\n".format(*addr) + \
+                      "MAN: \"ssdp:discover\"\r\n" + \
+                      "MX: {}\r\n".format(self.mx) + \
+                      "ST: {}\r\n".format(st) + "\r\n"
+        return ssdpRequest.encode()
+
+    def _response_wanted(self, service):
+        """Responses of every search share one socket, keep those
+           answering a search type we are looking for
+        """
+        if 'ssdp:all' in self.queries:
+            return True
+
+        return service.get('ST') in self.queries
+
+    def _service_seen(self, service):
+        if service is None or 'USN' not in service:
+            # garbage or incomplete response
+            return
+
+        if not self._response_wanted(service):
+            return
+
+        if service['USN'] in self.known_services:
+            # already accounted for, but update last seen
+            a_service = self.known_services[service['USN']]
+            a_service['last_seen'] = time.time()
+            if 'CACHE-CONTROL' in service:
+                a_service['CACHE-CONTROL'] = service['CACHE-CONTROL']
+            self._schedule_expiry(service['USN'], a_service)
+            return
+
+        # else
+        if self.discover_cb:
+            # put last seen in
+            service['last_seen'] = time.time()
+            self.known_services[service['USN']] = service
+            self._schedule_expiry(service['USN'], service)
+            self.discover_cb(**service)
+
+    def _schedule_expiry(self, usn, service):
+        deadline = self.clock() + self._service_lifetime(service)
+        self._expiry[usn] = deadline
+        heapq.heappush(self._expiry_heap, (deadline, usn))
+
+        # drop outdated entries once they dominate the heap
+        if len(self._expiry_heap) > 4*len(self._expiry) + 64:
+            self._expiry_heap = [(d, u) for u, d in self._expiry.items()]
+            heapq.heapify(self._expiry_heap)
+
+        self._expiry_scheduled(deadline)
+
+    def _expiry_scheduled(self, deadline):
+        """Called with every new deadline, for loops that sleep until
+           the next expiry
+        """
+        pass
+
+    def next_expiry(self):
+        """Earliest monotonic deadline or None when nothing is known
+        """
+        heap = self._expiry_heap
+        while heap and self._expiry.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+
+        return heap[0][0] if heap else None
+
+    def _expire_services(self):
+        # remove services not seen in a while
+        now = self.clock()
+        heap = self._expiry_heap
+        while heap and heap[0][0] <= now:
+            deadline, usn = heapq.heappop(heap)
+            if self._expiry.get(usn) != deadline:
+                # seen again since
+                continue
+
+            del self._expiry[usn]
+            service = self.known_services.pop(usn, None)
+            if service is not None and self.remove_cb:
+                self.remove_cb(**service)
+
+        return self.next_expiry()
+
+
+class SimpleSSDPDiscovery(SSDPDiscoveryBase, StoppableThread):
+    """Discovery using SSDP
 
-    def run(self):
+       One long-lived socket sends every search at once and collects
+       all responses; a second one follows NOTIFY announcements.
+    """
+    def __init__(self, *args, **kwargs):
+        super(SimpleSSDPDiscovery, self).__init__(*args, **kwargs)
+        self._sock = None
+        self._notify_sock = None
+        self._buffer = bytearray(SSDP_RECV_BUFFER_SIZE)
+        self._search_requested = threading.Event()
+        # wakes the loop up for stop() and searches
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._wakeup_recv.setblocking(False)
 
+    def add_discovery_type(self, host_addr, host_port, service_type):
+        super(SimpleSSDPDiscovery, self).add_discovery_type(host_addr,
+                                                            host_port,
+                                                            service_type)
+        self.search()
+
+    def search(self):
+        """Send every search on the next loop iteration
+        """
+        self._search_requested.set()
+        self._wakeup()
+
+    def stop(self):
+        super(SimpleSSDPDiscovery, self).stop()
+        self._wakeup()
+
+    def _wakeup(self):
+        try:
+            self._wakeup_send.send(b'\0')
+        except OSError:
+            pass
+
+    def _drain_wakeup(self, data, addr, length=None):
+        # the flags are checked by the loop, drop the bytes
+        pass
+
+    def _open_socket(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL,
+                        SSDP_MULTICAST_TTL)
+        sock.bind(('', 0))
+        sock.setblocking(False)
+        return sock
+
+    def _send_searches(self):
+        for st, addr in list(self.queries.items()):
+            try:
+                self._sock.sendto(self._build_search_request(st, addr),
+                                  tuple(addr))
+            except OSError as e:
+                self.logger.warning('could not send search for "{}": {}'
+                                    .format(st, e))
+
+    def _receive_pending(self, sock, handle):
+        """Drain every datagram queued on a socket
+        """
         while True:
+            try:
+                size, addr = sock.recvfrom_into(self._buffer)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                self.logger.warning('SSDP receive error: {}'.format(e))
+                return
+
+            # parsed in place, the buffer is reused for the next one
+            handle(self._buffer, addr, size)
 
-            if self.is_stopped():
-                exit(0)
-
-            for st, addr in self.queries.items():
-                ssdpRequest = "M-SEARCH * HTTP/1.1\r\n" + \
-                              "HOST: {}:{}\r\n".format(*addr) + \
-                              "MAN: \"ssdp:discover\"\r\n" + \
-                              "MX: 3\r\n" + \
-                              "ST: {}\r\n".format(st) + "\r\n"
-
-                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-                sock.settimeout(3)
-                sock.sendto(ssdpRequest.encode(), tuple(addr))
-                try:
-                    status = sock.recv(1000)
-                    service = self._parse_ssdp_return(status,
-                                                      (st == 'ssdp:all'))
-                    if service['USN'] in self.known_services:
-                        # already accounted for, but update last seen
-                        a_service = self.known_services[service['USN']]
-                        a_service['last_seen'] = time.time()
-                        continue
-
-                    # else
-                    if self.discover_cb:
-                        # put last seen in
-                        service['last_seen'] = time.time()
-                        self.known_services[service['USN']] = service
-                        self.discover_cb(**service)
-
-                except socket.timeout:
-                    # not found!
-                    #print 'NOT FOUND: {}'.format(st)
-                    pass
-
-            # remove services not seen in a while
-            services_to_remove = []
-            for usn, service in self.known_services.items():
-                if time.time() - service['last_seen'] > self.intval*self.rem_intval_units:
-                    # remove
-                    if self.remove_cb:
-                        self.remove_cb(**service)
-                        services_to_remove.append(usn)
-
-            for usn in services_to_remove:
-                del self.known_services[usn]
-
-            time.sleep(self.intval)
+    def run(self):
+        self._sock = self._open_socket()
+        sockets = {self._sock: self._response_received,
+                   self._wakeup_recv: self._drain_wakeup}
+        if self.passive:
+            self._notify_sock = self._open_notify_socket()
+            if self._notify_sock is not None:
+                sockets[self._notify_sock] = self._notify_received
+                self.listening = True
+
+        next_search = self.clock()
+        try:
+            while not self.is_stopped():
+                now = self.clock()
+                # without announcements presence relies on searching
+                if not self.listening and now >= next_search:
+                    self._search_requested.set()
+
+                if self._search_requested.is_set():
+                    self._search_requested.clear()
+                    self._send_searches()
+                    next_search = now + self.intval
+
+                # sleep until the next expiry or periodic search, stop()
+                # and search() wake the loop up
+                deadlines = [self._expire_services()]
+                if not self.listening:
+                    deadlines.append(next_search)
+                deadlines = [d for d in deadlines if d is not None]
+                timeout = None
+                if deadlines:
+                    timeout = max(min(deadlines) - self.clock(), 0)
+
+                readable, _, _ = select.select(list(sockets), [], [], timeout)
+                for sock in readable:
+                    self._receive_pending(sock, sockets[sock])
+        finally:
+            for sock in sockets:
+                sock.close()
+            self._wakeup_send.close()
+            self._sock = None
+            self._notify_sock = None
+            self.listening = False
@@ -0,0 +1,200 @@
+import asyncio
+import socket
+import threading
+import time
+from aggregate.discover import SSDPDiscoveryBase, SSDP_MULTICAST_TTL
+
+
+class _SSDPProtocol(asyncio.DatagramProtocol):
+    """Datagram endpoint feeding SSDP messages to the discovery object
+    """
+    def __init__(self, discovery, handler):
+        self.discovery = discovery
+        self.handler = handler
+
+    def datagram_received(self, data, addr):
+        self.handler(data, addr)
+
+    def error_received(self, exc):
+        self.discovery.logger.warning('SSDP socket error: {}'.format(exc))
+
+
+class AsyncSSDPDiscovery(SSDPDiscoveryBase):
+    """SSDP discovery running on an asyncio event loop
+
+       A single datagram endpoint is used for all searches; responses
+       are handled as they arrive instead of blocking on each target.
+       A second endpoint follows NOTIFY announcements when passive.
+    """
+    def __init__(self, loop, root_logger, interval, removal_interval,
+                 service_discovered_cb=None, service_removed_cb=None,
+                 passive=True, clock=time.monotonic):
+        super(AsyncSSDPDiscovery, self).__init__(root_logger,
+                                                 interval,
+                                                 removal_interval,
+                                                 service_discovered_cb,
+                                                 service_removed_cb,
+                                                 passive=passive,
+                                                 clock=clock)
+        self.loop = loop
+        self.transport = None
+        self.notify_transport = None
+        self._search_handle = None
+        self._expire_handle = None
+        self._expire_deadline = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        self.loop.call_soon_threadsafe(self._start)
+
+    def _start(self):
+        self.loop.create_task(self._open_endpoint())
+
+    async def _open_endpoint(self):
+        # same multicast scope as the threaded backend's searches
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL,
+                        SSDP_MULTICAST_TTL)
+        sock.bind(('0.0.0.0', 0))
+        sock.setblocking(False)
+        self.transport, _ =\
+            await self.loop.create_datagram_endpoint(
+                lambda: _SSDPProtocol(self, self._response_received),
+                sock=sock)
+
+        notify_sock = self._open_notify_socket() if self.passive else None
+        if notify_sock is not None:
+            self.notify_transport, _ =\
+                await self.loop.create_datagram_endpoint(
+                    lambda: _SSDPProtocol(self, self._notify_received),
+                    sock=notify_sock)
+            self.listening = True
+
+        if self._stopped.is_set():
+            self._stop()
+            return
+
+        self._search()
+        self._expire()
+
+    def add_discovery_type(self, host_addr, host_port, service_type):
+        super(AsyncSSDPDiscovery, self).add_discovery_type(host_addr,
+                                                           host_port,
+                                                           service_type)
+        self.search()
+
+    def search(self):
+        """Send every search now, safe to call from any thread
+        """
+        self.loop.call_soon_threadsafe(self._search_now)
+
+    def _search_now(self):
+        # not started yet, startup searches for every type anyway
+        if self.transport is None:
+            return
+
+        if self._search_handle is not None:
+            self._search_handle.cancel()
+            self._search_handle = None
+        self._search()
+
+    def _search(self):
+        self._search_handle = None
+        for st, addr in list(self.queries.items()):
+            self.transport.sendto(self._build_search_request(st, addr),
+                                  tuple(addr))
+
+        # without announcements presence relies on searching
+        if not self.listening:
+            self._search_handle = self.loop.call_later(self.intval,
+                                                       self._search)
+
+    def _expire(self):
+        self._expire_handle = None
+        self._expire_deadline = None
+        next_expiry = self._expire_services()
+        if next_expiry is not None:
+            self._expiry_scheduled(next_expiry)
+
+    def _expiry_scheduled(self, deadline):
+        # sightings happen on the loop thread, only wake up earlier
+        if self.transport is None or self._stopped.is_set():
+            return
+        if self._expire_deadline is not None and\
+           self._expire_deadline <= deadline:
+            return
+
+        if self._expire_handle is not None:
+            self._expire_handle.cancel()
+        self._expire_deadline = deadline
+        self._expire_handle =\
+            self.loop.call_later(max(deadline - self.clock(), 0),
+                                 self._expire)
+
+    def stop(self):
+        self._stopped.set()
+        self.loop.call_soon_threadsafe(self._stop)
+
+    def _stop(self):
+        for handle in (self._search_handle, self._expire_handle):
+            if handle is not None:
+                handle.cancel()
+        self._search_handle = None
+        self._expire_handle = None
+        self._expire_deadline = None
+
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+
+        if self.notify_transport is not None:
+            self.notify_transport.close()
+            self.notify_transport = None
+        self.listening = False
+
+
+class AsyncMDNSDiscovery(object):
+    """mDNS discovery delivering events on an asyncio event loop
+
+       Backends browse on a thread of their own (dbus-python only
+       integrates with the GLib main loop), but every resolve and
+       remove event is handed over to the asyncio loop so that
+       consumers only ever run on the loop thread.
+    """
+    def __init__(self, loop, backend_cls, root_logger,
+                 service_resolved_cb=None, service_removed_cb=None,
+                 type_filter=None, **kwargs):
+        self.loop = loop
+        self.resolve_cb = service_resolved_cb
+        self.remove_cb = service_removed_cb
+        self.backend = backend_cls(root_logger=root_logger,
+                                   service_resolved_cb=self._resolved,
+                                   service_removed_cb=self._removed,
+                                   type_filter=type_filter,
+                                   **kwargs)
+
+    def _resolved(self, **kwargs):
+        if self.resolve_cb is not None:
+            self.loop.call_soon_threadsafe(lambda: self.resolve_cb(**kwargs))
+
+    def _removed(self, **kwargs):
+        if self.remove_cb is not None:
+            self.loop.call_soon_threadsafe(lambda: self.remove_cb(**kwargs))
+
+    def start(self):
+        self.backend.start()
+
+    def stop(self):
+        self.backend.stop()
+
+    def join(self):
+        self.backend.join()
+
+    def publish(self, name, kind, port, text=None):
+        self.backend.publish(name, kind, port, text)
+
+    def unpublish(self, name, kind):
+        self.backend.unpublish(name, kind)
+
+    def get_stats(self):
+        return self.backend.get_stats()
@@ -0,0 +1,250 @@
+import dbus
+from gi.repository import GObject as gobject
+import avahi
+from dbus.mainloop.glib import DBusGMainLoop
+from aggregate.discover.backend import MDNSBackend, txt_dict
+from aggregate.util.lazy import lazy_import
+from aggregate.util.thread import StoppableThread
+import logging
+import time
+
+zeroconf = lazy_import('periodicpy.zeroconf')
+
+# seconds a resolved mDNS service is reused without asking avahi again
+AVAHI_RESOLVE_TTL = 60
+AVAHI_RESOLVE_CACHE_SIZE = 256
+
+
+def decode_service_text(byte_array):
+    """Decode a DBUS TXT record array once, returns the list of
+       strings and a dictionary of its key=value entries
+    """
+    text_list = []
+    if byte_array.signature != 'ay':
+        return text_list, {}
+
+    for element in byte_array:
+        if element.signature != 'y':
+            continue
+
+        text_list.append(bytes(bytearray(element)).decode('utf-8',
+                                                          'replace'))
+
+    return text_list, txt_dict(text_list)
+
+
+class AvahiDiscoverLoop(StoppableThread, MDNSBackend):
+    """Discovery loop with Avahi
+    """
+    def __init__(self, root_logger, service_resolved_cb=None,
+                 service_removed_cb=None, type_filter=None,
+                 protocol=avahi.PROTO_INET, iface=None,
+                 resolve_ttl=AVAHI_RESOLVE_TTL):
+        super(AvahiDiscoverLoop, self).__init__()
+        self.resolve_cb = service_resolved_cb
+        self.remove_cb = service_removed_cb
+        self.main_loop = None
+
+        self.type_filter = type_filter
+        # only browse and resolve services on this protocol and interface
+        self.protocol = avahi.PROTO_UNSPEC if protocol is None else protocol
+        self.iface = avahi.IF_UNSPEC if iface is None else iface
+
+        # a service is resolved once no matter how many interfaces and
+        # protocols announce it; (name, type, domain) -> announcing
+        # (interface, protocol) pairs
+        self.resolve_ttl = resolve_ttl
+        self._announced = {}
+        self._resolving = set()
+        self._resolved = {}
+        self.stats = {'resolves': 0, 'cache_hits': 0, 'duplicates': 0,
+                      'filtered': 0}
+
+        # published services, (name, kind) -> ZeroconfService
+        self._published = {}
+        self.logger = logging.getLogger('{}.discoverLoop'.format(root_logger))
+
+        # make sure that gobject is OK with threads
+        gobject.threads_init()
+
+    def stop(self):
+        super(AvahiDiscoverLoop, self).stop()
+        self.main_loop.quit()
+
+    def publish(self, name, kind, port, text=None):
+        extra = {} if text is None else {'text': text}
+        service = zeroconf.ZeroconfService(name=name, port=port, stype=kind,
+                                           **extra)
+        service.publish()
+        self._published[(name, kind)] = service
+
+    def unpublish(self, name, kind):
+        service = self._published.pop((name, kind), None)
+        if service is not None:
+            service.unpublish()
+
+    def _wanted(self, interface, protocol):
+        if self.protocol != avahi.PROTO_UNSPEC and\
+           int(protocol) != self.protocol:
+            return False
+
+        if self.iface != avahi.IF_UNSPEC and int(interface) != self.iface:
+            return False
+
+        return True
+
+    def _cached_service(self, key):
+        entry = self._resolved.get(key)
+        if entry is None:
+            return None
+
+        expires, service = entry
+        if time.monotonic() > expires:
+            del self._resolved[key]
+            return None
+
+        return service
+
+    def _cache_service(self, key, service):
+        if len(self._resolved) >= AVAHI_RESOLVE_CACHE_SIZE:
+            now = time.monotonic()
+            for old_key, (expires, _) in list(self._resolved.items()):
+                if now > expires:
+                    del self._resolved[old_key]
+
+        if len(self._resolved) < AVAHI_RESOLVE_CACHE_SIZE:
+            self._resolved[key] = (time.monotonic() + self.resolve_ttl,
+                                   service)
+
+    def run(self):
+        def _item_resolved_cb(*args):
+            key = (str(args[2]), str(args[3]), str(args[4]))
+            self._resolving.discard(key)
+            if key not in self._announced:
+                # removed while resolving
+                return
+
+            text_list, text_dict = decode_service_text(args[9])
+            # call everything as named arguments,
+            # discard DBus types!
+            service = dict(iface=int(args[0]),
+                           proto=int(args[1]),
+                           kind=str(args[3]),
+                           name=str(args[2]),
+                           host=str(args[5]),
+                           address=str(args[7]),
+                           port=int(args[8]),
+                           text=text_list,
+                           txt=text_dict)
+            self._cache_service(key, service)
+            if self.resolve_cb is not None:
+                self.resolve_cb(**service)
+
+        def _error_cb(key, announcer):
+            def _error(*args):
+                self._resolving.discard(key)
+                self.logger.error('error resolving service: {}'.format(args))
+                announced = self._announced.get(key)
+                if announced is None:
+                    # removed while resolving
+                    return
+
+                announced.discard(announcer)
+                if not announced:
+                    # resolved again when it is announced next
+                    del self._announced[key]
+                    return
+
+                # try through another interface still announcing it
+                _resolve(key, sorted(announced)[0])
+            return _error
+
+        def _resolve(key, announcer):
+            self.stats['resolves'] += 1
+            self._resolving.add(key)
+            name, stype, domain = key
+            interface, protocol = announcer
+            server.ResolveService(interface, protocol, name, stype,
+                                  domain, self.protocol, dbus.UInt32(0),
+                                  reply_handler=_item_resolved_cb,
+                                  error_handler=_error_cb(key, announcer))
+
+        def _item_remove_event(interface, protocol,
+                               name, stype, domain, flags):
+            if flags & avahi.LOOKUP_RESULT_LOCAL:
+                # local service, skip
+                return
+
+            if not self._wanted(interface, protocol):
+                return
+
+            key = (str(name), str(stype), str(domain))
+            announced = self._announced.get(key)
+            if announced is None:
+                return
+
+            announced.discard((int(interface), int(protocol)))
+            if announced:
+                # still announced elsewhere
+                return
+
+            del self._announced[key]
+            if self.remove_cb is not None:
+                self.remove_cb(iface=int(interface),
+                               proto=int(protocol),
+                               kind=str(stype),
+                               name=str(name))
+
+        def _item_new_event(interface, protocol, name, stype, domain, flags):
+            if not self._wanted(interface, protocol):
+                self.stats['filtered'] += 1
+                return
+
+            key = (str(name), str(stype), str(domain))
+            announced = self._announced.setdefault(key, set())
+            first = not announced
+            announcer = (int(interface), int(protocol))
+            announced.add(announcer)
+            if not first or key in self._resolving:
+                self.stats['duplicates'] += 1
+                return
+
+            service = self._cached_service(key)
+            if service is not None:
+                self.stats['cache_hits'] += 1
+                if self.resolve_cb is not None:
+                    self.resolve_cb(**service)
+                return
+
+            _resolve(key, announcer)
+
+        loop = DBusGMainLoop()
+        bus = dbus.SystemBus(mainloop=loop)
+        server = dbus.Interface(bus.get_object(avahi.DBUS_NAME, '/'),
+                                'org.freedesktop.Avahi.Server')
+
+        # register several kinds of service
+        for service_type in self.type_filter:
+            self.logger.debug('registering callbacks for service type "{}"'
+                              .format(service_type))
+            sbrowser = dbus.Interface(bus.get_object(avahi.DBUS_NAME,
+                                                     server.ServiceBrowserNew(self.iface,
+                                                                              self.protocol,
+                                                                              service_type,
+                                                                              'local',
+                                                                              dbus.UInt32(0))),
+                                      avahi.DBUS_INTERFACE_SERVICE_BROWSER)
+
+            # connect new item signal
+            sbrowser.connect_to_signal("ItemNew", _item_new_event)
+            # connect item remove signal
+            sbrowser.connect_to_signal("ItemRemove", _item_remove_event)
+
+        self.main_loop = gobject.MainLoop()
+
+        # run main loop
+        self.main_loop.run()
+
+        # finish thread execution
+        if self.is_stopped():
+            exit(0)
@@ -0,0 +1,72 @@
+import importlib
+
+# avahi's protocol and interface numbering, used by every backend
+PROTO_UNSPEC = -1
+PROTO_INET = 0
+PROTO_INET6 = 1
+IF_UNSPEC = -1
+
+# backend name -> (module, class), imported on use so that a backend's
+# dependencies are only needed when it is selected
+MDNS_BACKENDS = {'avahi': ('aggregate.discover.avahi_loop',
+                           'AvahiDiscoverLoop'),
+                 'native': ('aggregate.discover.mdns',
+                            'NativeMDNSDiscovery')}
+
+
+def get_mdns_backend(name):
+    """Returns the discovery class of an mDNS backend
+    """
+    if name not in MDNS_BACKENDS:
+        raise ValueError('invalid mDNS backend: "{}"'.format(name))
+
+    module_name, class_name = MDNS_BACKENDS[name]
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def txt_dict(text_list):
+    """Dictionary of the key=value entries of a TXT record, first
+       occurrence wins and boolean attributes map to None
+    """
+    ret = {}
+    for text in text_list:
+        key, sep, value = text.partition('=')
+        if key and key.lower() not in ret:
+            ret[key.lower()] = value if sep else None
+
+    return ret
+
+
+class MDNSBackend(object):
+    """mDNS discovery backend interface
+
+       Backends are constructed with (root_logger, service_resolved_cb,
+       service_removed_cb, type_filter, protocol, iface), browse every
+       service type in type_filter once started and report services
+       with keyword arguments only:
+
+       - resolved: iface, proto, kind, name, host, address, port,
+         text (list of TXT strings) and txt (dictionary)
+       - removed: iface, proto, kind, name
+    """
+    def start(self):
+        raise NotImplementedError
+
+    def stop(self):
+        raise NotImplementedError
+
+    def join(self, timeout=None):
+        raise NotImplementedError
+
+    def publish(self, name, kind, port, text=None):
+        """Announce a service of our own
+        """
+        raise NotImplementedError
+
+    def unpublish(self, name, kind):
+        raise NotImplementedError
+
+    def get_stats(self):
+        """Discovery counters
+        """
+        return dict(self.stats)
@@ -0,0 +1,762 @@
+import ipaddress
+import logging
+import select
+import socket
+import struct
+import threading
+import time
+from collections import namedtuple
+from aggregate.discover.backend import (MDNSBackend,
+                                        IF_UNSPEC,
+                                        PROTO_INET,
+                                        txt_dict)
+from aggregate.util.thread import StoppableThread
+
+MDNS_GROUP = ('224.0.0.251', 5353)
+MDNS_BUFFER_SIZE = 9000
+
+TYPE_A = 1
+TYPE_PTR = 12
+TYPE_TXT = 16
+TYPE_AAAA = 28
+TYPE_SRV = 33
+TYPE_ANY = 255
+
+CLASS_IN = 1
+CLASS_MASK = 0x7fff
+# cache flush bit of records, unicast response bit of questions
+CACHE_FLUSH = 0x8000
+UNICAST_RESPONSE = 0x8000
+
+FLAG_RESPONSE = 0x8000
+FLAG_AUTHORITATIVE = 0x0400
+
+# RFC 6762 recommended TTLs
+HOST_TTL = 120
+SERVICE_TTL = 4500
+
+# browse queries are repeated with doubling intervals up to this
+MAX_QUERY_INTERVAL = 3600
+RESOLVE_RETRIES = 3
+SERVICE_ENUMERATION = ('_services', '_dns-sd', '_udp', 'local')
+
+DNSRecord = namedtuple('DNSRecord', 'name rtype rclass ttl data')
+DNSMessage = namedtuple('DNSMessage', 'id flags questions answers '
+                        'authorities additionals')
+
+
+class DNSError(Exception):
+    pass
+
+
+def name_key(labels):
+    """Names compare case insensitively
+    """
+    return tuple([label.lower() for label in labels])
+
+
+def type_labels(kind):
+    """'_http._tcp' -> ('_http', '_tcp', 'local')
+    """
+    return tuple(kind.split('.')) + ('local',)
+
+
+def _read_name(data, offset):
+    labels = []
+    end = None
+    jumps = 0
+    while True:
+        if offset >= len(data):
+            raise DNSError('truncated name')
+
+        length = data[offset]
+        if length & 0xc0 == 0xc0:
+            if offset + 1 >= len(data):
+                raise DNSError('truncated name pointer')
+            if end is None:
+                end = offset + 2
+            offset = ((length & 0x3f) << 8) | data[offset+1]
+            jumps += 1
+            if jumps > 32:
+                raise DNSError('name compression loop')
+            continue
+
+        if length & 0xc0:
+            raise DNSError('invalid label type')
+
+        offset += 1
+        if length == 0:
+            break
+        if offset + length > len(data):
+            raise DNSError('truncated label')
+        labels.append(data[offset:offset+length].decode('utf-8', 'replace'))
+        offset += length
+
+    return tuple(labels), offset if end is None else end
+
+
+def _read_rdata(data, offset, rtype, length):
+    end = offset + length
+    if end > len(data):
+        raise DNSError('truncated record data')
+
+    if rtype == TYPE_A and length == 4:
+        return socket.inet_ntoa(data[offset:end])
+    if rtype == TYPE_PTR:
+        return _read_name(data, offset)[0]
+    if rtype == TYPE_SRV and length >= 7:
+        priority, weight, port = struct.unpack_from('!HHH', data, offset)
+        return (priority, weight, port, _read_name(data, offset + 6)[0])
+    if rtype == TYPE_TXT:
+        strings = []
+        pos = offset
+        while pos < end:
+            size = data[pos]
+            strings.append(bytes(data[pos+1:min(pos+1+size, end)]))
+            pos += 1 + size
+        return tuple([string for string in strings if string])
+
+    return bytes(data[offset:end])
+
+
+def parse_message(data):
+    """Decode a DNS message, raises DNSError on malformed input
+    """
+    if len(data) < 12:
+        raise DNSError('truncated header')
+
+    msg_id, flags, qdcount, ancount, nscount, arcount =\
+        struct.unpack_from('!HHHHHH', data, 0)
+    offset = 12
+
+    questions = []
+    for _ in range(qdcount):
+        name, offset = _read_name(data, offset)
+        if offset + 4 > len(data):
+            raise DNSError('truncated question')
+        qtype, qclass = struct.unpack_from('!HH', data, offset)
+        offset += 4
+        questions.append((name, qtype, qclass))
+
+    sections = []
+    for count in (ancount, nscount, arcount):
+        records = []
+        for _ in range(count):
+            name, offset = _read_name(data, offset)
+            if offset + 10 > len(data):
+                raise DNSError('truncated record')
+            rtype, rclass, ttl, length =\
+                struct.unpack_from('!HHIH', data, offset)
+            offset += 10
+            records.append(DNSRecord(name, rtype, rclass, ttl,
+                                     _read_rdata(data, offset,
+                                                 rtype, length)))
+            offset += length
+        sections.append(records)
+
+    return DNSMessage(msg_id, flags, questions, *sections)
+
+
+def _encode_name(labels):
+    ret = []
+    for label in labels:
+        encoded = label.encode('utf-8')
+        if not encoded or len(encoded) > 63:
+            raise DNSError('invalid label: "{}"'.format(label))
+        ret.append(bytes([len(encoded)]) + encoded)
+    ret.append(b'\x00')
+    return b''.join(ret)
+
+
+def _encode_rdata(record):
+    if record.rtype == TYPE_A:
+        return socket.inet_aton(record.data)
+    if record.rtype == TYPE_PTR:
+        return _encode_name(record.data)
+    if record.rtype == TYPE_SRV:
+        priority, weight, port, target = record.data
+        return struct.pack('!HHH', priority, weight, port) +\
+            _encode_name(target)
+    if record.rtype == TYPE_TXT:
+        strings = [string[:255] for string in record.data] or [b'']
+        return b''.join([bytes([len(string)]) + string
+                         for string in strings])
+
+    return record.data
+
+
+def build_message(msg_id=0, flags=0, questions=(), answers=(),
+                  additionals=()):
+    """Encode a DNS message, names are not compressed
+    """
+    ret = [struct.pack('!HHHHHH', msg_id, flags, len(questions),
+                       len(answers), 0, len(additionals))]
+    for name, qtype, qclass in questions:
+        ret.append(_encode_name(name) + struct.pack('!HH', qtype, qclass))
+    for record in list(answers) + list(additionals):
+        rdata = _encode_rdata(record)
+        ret.append(_encode_name(record.name) +
+                   struct.pack('!HHIH', record.rtype, record.rclass,
+                               record.ttl, len(rdata)) + rdata)
+    return b''.join(ret)
+
+
+class MDNSCache(object):
+    """Received records with their expiry, RFC 6762 style
+    """
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        # (name key, type, data) -> [record, received, expires, refreshed]
+        self._records = {}
+        self._by_name = {}
+
+    @staticmethod
+    def _key(record):
+        data = record.data
+        if record.rtype in (TYPE_PTR, TYPE_SRV):
+            data = name_key(data) if record.rtype == TYPE_PTR else\
+                data[:3] + (name_key(data[3]),)
+        return (name_key(record.name), record.rtype, data)
+
+    def add(self, record, now=None):
+        """Store a record, returns True if it was not known
+        """
+        now = self.clock() if now is None else now
+        key = self._key(record)
+        entry = self._records.get(key)
+        if record.ttl == 0:
+            # goodbye, forget about it in one second without asking
+            if entry is not None:
+                entry[2] = min(entry[2], now + 1)
+                entry[3] = True
+            return False
+
+        if record.rclass & CACHE_FLUSH:
+            # unique record, older copies with other data are stale
+            for other in self._by_name.get(key[:2], set()):
+                other_entry = self._records[other]
+                if other != key and now - other_entry[1] > 1:
+                    other_entry[2] = min(other_entry[2], now + 1)
+                    other_entry[3] = True
+
+        self._records[key] = [record, now, now + record.ttl, False]
+        self._by_name.setdefault(key[:2], set()).add(key)
+        return entry is None
+
+    def get(self, labels, rtype, now=None):
+        now = self.clock() if now is None else now
+        ret = []
+        for key in self._by_name.get((name_key(labels), rtype), ()):
+            record, _, expires, _ = self._records[key]
+            if expires > now:
+                ret.append(record)
+        return ret
+
+    def known_answers(self, labels, rtype, now=None):
+        """Records still valid for more than half their TTL, with the
+           remaining TTL, for known answer suppression
+        """
+        now = self.clock() if now is None else now
+        ret = []
+        for key in self._by_name.get((name_key(labels), rtype), ()):
+            record, received, expires, _ = self._records[key]
+            remaining = expires - now
+            if remaining > record.ttl / 2.0:
+                ret.append(record._replace(ttl=int(remaining)))
+        return ret
+
+    def refresh_due(self, now=None):
+        """Records at 80% of their lifetime, each returned once
+        """
+        now = self.clock() if now is None else now
+        ret = []
+        for entry in self._records.values():
+            record, received, expires, refreshed = entry
+            if not refreshed and expires > now and\
+               now - received >= 0.8 * (expires - received):
+                entry[3] = True
+                ret.append(record)
+        return ret
+
+    def next_deadline(self):
+        """Earliest pending refresh or expiry, None without records
+        """
+        deadlines = []
+        for _, received, expires, refreshed in self._records.values():
+            deadlines.append(expires)
+            if not refreshed:
+                deadlines.append(received + 0.8 * (expires - received))
+        return min(deadlines) if deadlines else None
+
+    def expire(self, now=None):
+        """Drop expired records and return them
+        """
+        now = self.clock() if now is None else now
+        ret = []
+        for key, entry in list(self._records.items()):
+            if entry[2] <= now:
+                del self._records[key]
+                names = self._by_name[key[:2]]
+                names.discard(key)
+                if not names:
+                    del self._by_name[key[:2]]
+                ret.append(entry[0])
+        return ret
+
+    def __len__(self):
+        return len(self._records)
+
+
+class NativeMDNSDiscovery(StoppableThread, MDNSBackend):
+    """Multicast DNS querier and responder without avahi or D-Bus
+
+       Browses service types with PTR queries repeated at doubling
+       intervals, carrying known answers so that responders holding
+       the same records stay quiet. Services are resolved from the
+       SRV, TXT and A records of the responses, asking for missing
+       ones, and removed when their PTR record expires or says
+       goodbye. Published services are announced and answered.
+
+       group may be a unicast address standing in for the multicast
+       group, see aggregate.bench.mdns, to run without a network.
+       Only IPv4 is supported.
+    """
+    def __init__(self, root_logger, service_resolved_cb=None,
+                 service_removed_cb=None, type_filter=None,
+                 protocol=PROTO_INET, iface=None, group=MDNS_GROUP,
+                 address=None, hostname=None):
+        super(NativeMDNSDiscovery, self).__init__()
+        self.logger = logging.getLogger('{}.mdns'.format(root_logger))
+        self.resolve_cb = service_resolved_cb
+        self.remove_cb = service_removed_cb
+        self.type_filter = type_filter if type_filter is not None else set()
+        self.iface = IF_UNSPEC if iface is None else iface
+        self.group = tuple(group)
+        self.multicast = ipaddress.ip_address(self.group[0]).is_multicast
+
+        self.address = address
+        self.hostname = hostname
+        self.cache = MDNSCache()
+        self.stats = {'queries_sent': 0, 'responses_sent': 0,
+                      'received': 0, 'malformed': 0,
+                      'suppressed_answers': 0}
+
+        # browsed type key -> [next query, interval]
+        self._browsing = {}
+        # instance key -> [instance labels, next query, tries left]
+        self._resolving = {}
+        # instance key -> reported service keyword arguments
+        self._services = {}
+
+        # published services, touched from other threads
+        self._lock = threading.Lock()
+        self._published = {}
+        self._announcements = []
+        self._sock = None
+        # wakes the loop up for stop() and new announcements
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._wakeup_recv.setblocking(False)
+
+    def stop(self):
+        super(NativeMDNSDiscovery, self).stop()
+        self._wakeup()
+
+    def _wakeup(self):
+        try:
+            self._wakeup_send.send(b'\0')
+        except OSError:
+            pass
+
+    def _drain_wakeup(self):
+        try:
+            while self._wakeup_recv.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+
+    # ----- sockets
+
+    def _local_address(self):
+        if self.address is not None:
+            return self.address
+
+        if not self.multicast:
+            return self.group[0]
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            # no traffic, only picks the outgoing interface address
+            sock.connect(('10.255.255.255', 1))
+            return sock.getsockname()[0]
+        except OSError:
+            return '127.0.0.1'
+        finally:
+            sock.close()
+
+    def _open_socket(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if not self.multicast:
+            # unicast stand-in for the group
+            sock.bind((self.group[0], 0))
+            sock.setblocking(False)
+            return sock
+
+        if hasattr(socket, 'SO_REUSEPORT'):
+            # other mDNS stacks on this host listen as well
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(('', self.group[1]))
+        if self.iface != IF_UNSPEC:
+            mreq = struct.pack('4s4si', socket.inet_aton(self.group[0]),
+                               socket.inet_aton('0.0.0.0'), self.iface)
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, mreq)
+        else:
+            mreq = socket.inet_aton(self.group[0]) +\
+                socket.inet_aton('0.0.0.0')
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 255)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        sock.setblocking(False)
+        return sock
+
+    def _send(self, data, addr=None):
+        sock = self._sock
+        if sock is None:
+            return
+        try:
+            sock.sendto(data, addr or self.group)
+        except OSError as e:
+            self.logger.warning('mDNS send error: {}'.format(e))
+
+    # ----- querier
+
+    def _query(self, questions, known_answers=()):
+        self.stats['queries_sent'] += 1
+        self._send(build_message(questions=questions,
+                                 answers=known_answers))
+
+    def _send_browse_queries(self, now):
+        due = []
+        known = []
+        for kind in list(self.type_filter):
+            key = name_key(type_labels(kind))
+            schedule = self._browsing.setdefault(key, [now, 1])
+            if schedule[0] > now:
+                continue
+
+            due.append((type_labels(kind), TYPE_PTR, CLASS_IN))
+            known.extend(self.cache.known_answers(type_labels(kind),
+                                                  TYPE_PTR, now))
+            schedule[0] = now + schedule[1]
+            schedule[1] = min(schedule[1] * 2, MAX_QUERY_INTERVAL)
+
+        if due:
+            self._query(due, known)
+
+    def _send_resolve_queries(self, now):
+        questions = []
+        for key, entry in list(self._resolving.items()):
+            labels, next_query, tries = entry
+            if next_query > now:
+                continue
+            if tries <= 0:
+                # try again with the next announcement or browse answer
+                del self._resolving[key]
+                continue
+
+            entry[1] = now + 1
+            entry[2] -= 1
+            srv = self.cache.get(labels, TYPE_SRV, now)
+            if not srv:
+                questions.append((labels, TYPE_SRV, CLASS_IN))
+            if not self.cache.get(labels, TYPE_TXT, now):
+                questions.append((labels, TYPE_TXT, CLASS_IN))
+            if srv and not self.cache.get(srv[0].data[3], TYPE_A, now):
+                questions.append((srv[0].data[3], TYPE_A, CLASS_IN))
+
+        if questions:
+            self._query(questions)
+
+    def _send_refresh_queries(self, now):
+        questions = []
+        for record in self.cache.refresh_due(now):
+            if record.rtype == TYPE_PTR and\
+               name_key(record.name) not in self._browsing:
+                continue
+            if record.rtype != TYPE_PTR and\
+               name_key(record.name) not in self._services:
+                continue
+            question = (record.name, record.rtype, CLASS_IN)
+            if question not in questions:
+                questions.append(question)
+
+        if questions:
+            self._query(questions)
+
+    def _browsed_instance(self, record):
+        """Instance labels if record is a PTR of a browsed type
+        """
+        if record.rtype != TYPE_PTR or\
+           name_key(record.name) not in self._browsing:
+            return None
+        return record.data
+
+    def _try_resolve(self, labels, now):
+        key = name_key(labels)
+        srv = self.cache.get(labels, TYPE_SRV, now)
+        txt = self.cache.get(labels, TYPE_TXT, now)
+        if not srv or not txt:
+            return False
+        _, _, port, target = srv[0].data
+        address = self.cache.get(target, TYPE_A, now)
+        if not address:
+            return False
+
+        self._resolving.pop(key, None)
+        if key in self._services:
+            return True
+
+        text = [string.decode('utf-8', 'replace') for string in txt[0].data]
+        service = dict(iface=self.iface,
+                       proto=PROTO_INET,
+                       kind='.'.join(labels[1:-1]),
+                       name=labels[0],
+                       host='.'.join(target),
+                       address=address[0].data,
+                       port=port,
+                       text=text,
+                       txt=txt_dict(text))
+        self._services[key] = service
+        if self.resolve_cb is not None:
+            self.resolve_cb(**service)
+        return True
+
+    def _service_gone(self, labels):
+        key = name_key(labels)
+        self._resolving.pop(key, None)
+        service = self._services.pop(key, None)
+        if service is not None and self.remove_cb is not None:
+            self.remove_cb(iface=service['iface'],
+                           proto=service['proto'],
+                           kind=service['kind'],
+                           name=service['name'])
+
+    def _handle_response(self, message, now):
+        instances = []
+        for record in message.answers + message.additionals:
+            self.cache.add(record, now)
+            labels = self._browsed_instance(record)
+            if labels is not None and record.ttl > 0:
+                instances.append(labels)
+
+        for labels in instances:
+            key = name_key(labels)
+            if key in self._services or self._try_resolve(labels, now):
+                continue
+            if key not in self._resolving:
+                # ask for the missing records right away
+                self._resolving[key] = [labels, now, RESOLVE_RETRIES]
+
+        # responses completing pending resolutions
+        for key, entry in list(self._resolving.items()):
+            self._try_resolve(entry[0], now)
+
+    def _expire(self, now):
+        for record in self.cache.expire(now):
+            labels = self._browsed_instance(record)
+            if labels is None:
+                continue
+            remaining = [name_key(other.data) for other in
+                         self.cache.get(record.name, TYPE_PTR, now)]
+            if name_key(labels) not in remaining:
+                self._service_gone(labels)
+
+    # ----- responder
+
+    def _service_records(self, name, kind, port, text, ttl_scale=1):
+        host = (self.hostname or socket.gethostname().split('.')[0],
+                'local')
+        instance = (name,) + type_labels(kind)
+        text = tuple([string.encode('utf-8') for string in (text or [])])
+        return [DNSRecord(type_labels(kind), TYPE_PTR, CLASS_IN,
+                          SERVICE_TTL * ttl_scale, instance),
+                DNSRecord(instance, TYPE_SRV, CLASS_IN | CACHE_FLUSH,
+                          HOST_TTL * ttl_scale, (0, 0, port, host)),
+                DNSRecord(instance, TYPE_TXT, CLASS_IN | CACHE_FLUSH,
+                          SERVICE_TTL * ttl_scale, text),
+                DNSRecord(host, TYPE_A, CLASS_IN | CACHE_FLUSH,
+                          HOST_TTL * ttl_scale, self._local_address()),
+                DNSRecord(SERVICE_ENUMERATION, TYPE_PTR, CLASS_IN,
+                          SERVICE_TTL * ttl_scale, type_labels(kind))]
+
+    def publish(self, name, kind, port, text=None):
+        records = self._service_records(name, kind, port, text)
+        with self._lock:
+            self._published[(name, kind)] = records
+            # announce twice, one second apart
+            now = time.monotonic()
+            self._announcements.append((now, (name, kind)))
+            self._announcements.append((now + 1, (name, kind)))
+        self._wakeup()
+
+    def unpublish(self, name, kind):
+        with self._lock:
+            records = self._published.pop((name, kind), None)
+        if records is not None:
+            goodbye = [record._replace(ttl=0) for record in records[:3]]
+            self.stats['responses_sent'] += 1
+            self._send(build_message(flags=FLAG_RESPONSE |
+                                     FLAG_AUTHORITATIVE,
+                                     answers=goodbye))
+
+    def _send_announcements(self, now):
+        with self._lock:
+            # services unpublished in the meantime are skipped
+            due = [self._published[key] for when, key
+                   in self._announcements
+                   if when <= now and key in self._published]
+            self._announcements = [(when, key) for when, key
+                                   in self._announcements if when > now]
+
+        for records in due:
+            self.stats['responses_sent'] += 1
+            self._send(build_message(flags=FLAG_RESPONSE |
+                                     FLAG_AUTHORITATIVE,
+                                     answers=records[:4]))
+
+    def _handle_query(self, message, addr):
+        with self._lock:
+            published = [record for records in self._published.values()
+                         for record in records]
+        if not published:
+            return
+
+        known = {}
+        for record in message.answers:
+            known[MDNSCache._key(record)] = record.ttl
+
+        answers = []
+        unicast = False
+        for name, qtype, qclass in message.questions:
+            key = name_key(name)
+            for record in published:
+                if name_key(record.name) != key or\
+                   qtype not in (record.rtype, TYPE_ANY) or\
+                   record in answers:
+                    continue
+                if known.get(MDNSCache._key(record), 0) >= record.ttl / 2.0:
+                    # the querier already knows it
+                    self.stats['suppressed_answers'] += 1
+                    continue
+                answers.append(record)
+                unicast = unicast or bool(qclass & UNICAST_RESPONSE)
+
+        if not answers:
+            return
+
+        # SRV, TXT and address of answered services come along
+        additionals = []
+        for answer in answers:
+            if answer.rtype != TYPE_PTR:
+                continue
+            for record in published:
+                if record not in answers and record not in additionals and\
+                   record.rtype in (TYPE_SRV, TYPE_TXT, TYPE_A) and\
+                   (name_key(record.name) == name_key(answer.data) or
+                    record.rtype == TYPE_A):
+                    additionals.append(record)
+
+        self.stats['responses_sent'] += 1
+        if addr[1] != self.group[1]:
+            # legacy unicast query, answer directly repeating the question
+            self._send(build_message(msg_id=message.id,
+                                     flags=FLAG_RESPONSE |
+                                     FLAG_AUTHORITATIVE,
+                                     questions=message.questions,
+                                     answers=[record._replace(
+                                         rclass=record.rclass & CLASS_MASK,
+                                         ttl=min(record.ttl, 10))
+                                         for record in answers],
+                                     additionals=additionals), addr)
+        else:
+            self._send(build_message(flags=FLAG_RESPONSE |
+                                     FLAG_AUTHORITATIVE,
+                                     answers=answers,
+                                     additionals=additionals),
+                       addr if unicast else None)
+
+    # ----- loop
+
+    def _receive_pending(self, buf, now):
+        while True:
+            try:
+                size, addr = self._sock.recvfrom_into(buf)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                self.logger.warning('mDNS receive error: {}'.format(e))
+                return
+
+            self.stats['received'] += 1
+            try:
+                message = parse_message(memoryview(buf)[:size].tobytes())
+            except (DNSError, struct.error):
+                self.stats['malformed'] += 1
+                continue
+
+            if message.flags & FLAG_RESPONSE:
+                self._handle_response(message, now)
+            else:
+                self._handle_query(message, addr)
+
+    def _next_deadline(self):
+        """When the loop has something to do next, None if it only
+           waits for packets
+        """
+        deadlines = [self.cache.next_deadline()]
+        deadlines.extend([entry[1] for entry in self._resolving.values()])
+        for kind in self.type_filter:
+            schedule = self._browsing.get(name_key(type_labels(kind)))
+            # types not browsed yet are due now
+            deadlines.append(schedule[0] if schedule is not None else 0)
+        with self._lock:
+            deadlines.extend([when for when, _ in self._announcements])
+
+        deadlines = [d for d in deadlines if d is not None]
+        return min(deadlines) if deadlines else None
+
+    def run(self):
+        self._sock = self._open_socket()
+        buf = bytearray(MDNS_BUFFER_SIZE)
+        try:
+            while not self.is_stopped():
+                now = time.monotonic()
+                self._send_announcements(now)
+                self._send_browse_queries(now)
+                self._send_resolve_queries(now)
+                self._send_refresh_queries(now)
+                self._expire(now)
+
+                # sleep until the next query, refresh or expiry, stop()
+                # and publish() wake the loop up
+                deadline = self._next_deadline()
+                timeout = None
+                if deadline is not None:
+                    timeout = max(deadline - time.monotonic(), 0)
+
+                readable, _, _ = select.select([self._sock,
+                                                self._wakeup_recv],
+                                               [], [], timeout)
+                if self._wakeup_recv in readable:
+                    self._drain_wakeup()
+                if self._sock in readable:
+                    self._receive_pending(buf, time.monotonic())
+        finally:
+            with self._lock:
+                published = list(self._published)
+            for name, kind in published:
+                self.unpublish(name, kind)
+            self._sock.close()
+            self._sock = None
+            self._wakeup_recv.close()
+            self._wakeup_send.close()
@@ -0,0 +1,207 @@
+import json
+import logging
+import queue
+import threading
+from urllib.parse import parse_qs
+from aggregate.util.fanout import run_grouped
+
+SUBSCRIPTION_QUEUE_SIZE = 1000
+KEEPALIVE_INTERVAL = 15
+
+
+def format_sse(event):
+    """Encode an event as a server-sent event frame
+    """
+    return 'event: {}\ndata: {}\n\n'.format(event['type'],
+                                            json.dumps(event['data'])).encode()
+
+
+def parse_subscription_query(query_string):
+    """Parse module=, property=module:property and hook= filters,
+       values may be repeated or comma separated
+    """
+    query = parse_qs(query_string)
+
+    def _values(name):
+        ret = []
+        for value in query.get(name, []):
+            ret.extend([v for v in value.split(',') if v])
+        return ret
+
+    properties = []
+    for value in _values('property'):
+        module_name, sep, property_name = value.rpartition(':')
+        if not sep or not module_name:
+            raise ValueError('invalid property filter: "{}"'.format(value))
+        properties.append((module_name, property_name))
+
+    return {'modules': _values('module'),
+            'properties': properties,
+            'hooks': _values('hook')}
+
+
+class Subscription(object):
+    """Event filter plus a bounded queue drained by the transport
+    """
+    def __init__(self, modules=None, properties=None, hooks=None,
+                 notify=None):
+        self.modules = set(modules or [])
+        self.properties = set([tuple(p) for p in properties or []])
+        self.hooks = set(hooks or [])
+        self.queue = queue.Queue(maxsize=SUBSCRIPTION_QUEUE_SIZE)
+        # optional callable used by event loop based transports
+        self.notify = notify
+        self.overflowed = False
+
+    def matches(self, event):
+        data = event['data']
+        if event['type'] == 'hook':
+            return data['hook'] in self.hooks or '*' in self.hooks
+
+        if data['module'] in self.modules:
+            return True
+
+        if event['type'] == 'property':
+            return (data['module'], data['property']) in self.properties
+
+        return False
+
+    def deliver(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # slow consumer, the transport closes the stream
+            self.overflowed = True
+
+        if self.notify is not None:
+            self.notify()
+
+    def get(self, timeout=KEEPALIVE_INTERVAL):
+        """Next event or None on timeout
+        """
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def get_nowait(self):
+        try:
+            return self.queue.get_nowait()
+        except queue.Empty:
+            return None
+
+
+class EventHub(object):
+    """Fans out hook, property and method events to subscriptions
+
+       Property values are diffed on the server side: an event is only
+       published when the value differs from the last one seen.
+       subscriptions_cb is called whenever a subscription is added or
+       removed, so that polling only runs while somebody listens.
+    """
+    def __init__(self, root_logger='ppagg', fanout_executor=None,
+                 subscriptions_cb=None):
+        self.logger = logging.getLogger('{}.events'.format(root_logger))
+        self.fanout_executor = fanout_executor
+        self.subscriptions_cb = subscriptions_cb
+        self._subscriptions = set()
+        self._last_values = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, **kwargs):
+        sub = Subscription(**kwargs)
+        with self._lock:
+            self._subscriptions.add(sub)
+            snapshot = [(key, value)
+                        for key, value in self._last_values.items()
+                        if key in sub.properties or key[0] in sub.modules]
+
+        # start with the current state of everything subscribed
+        for (module_name, property_name), value in snapshot:
+            sub.deliver(self._property_event(module_name,
+                                             property_name,
+                                             value))
+
+        if self.subscriptions_cb is not None:
+            self.subscriptions_cb()
+
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subscriptions.discard(sub)
+
+        if self.subscriptions_cb is not None:
+            self.subscriptions_cb()
+
+    def _publish(self, event):
+        with self._lock:
+            subscriptions = [sub for sub in self._subscriptions
+                             if sub.matches(event)]
+
+        for sub in subscriptions:
+            sub.deliver(event)
+
+    @staticmethod
+    def _property_event(module_name, property_name, value):
+        return {'type': 'property',
+                'data': {'module': module_name,
+                         'property': property_name,
+                         'value': value}}
+
+    def publish_property(self, module_name, property_name, value):
+        """Publish a property value, unchanged values are dropped
+        """
+        key = (module_name, property_name)
+        with self._lock:
+            if key in self._last_values and\
+               self._last_values[key] == value:
+                return False
+            self._last_values[key] = value
+
+        self._publish(self._property_event(module_name, property_name, value))
+        return True
+
+    def publish_method(self, module_name, method_name, kwargs):
+        self._publish({'type': 'method',
+                       'data': {'module': module_name,
+                                'method': method_name,
+                                'args': kwargs}})
+
+    def publish_hook(self, hook_name, kwargs):
+        self._publish({'type': 'hook',
+                       'data': {'hook': hook_name,
+                                'args': kwargs}})
+
+    def forget_module(self, module_name):
+        with self._lock:
+            for key in [key for key in self._last_values
+                        if key[0] == module_name]:
+                del self._last_values[key]
+
+    def known_modules(self):
+        """Modules with property values remembered for diffing
+        """
+        with self._lock:
+            return set([key[0] for key in self._last_values])
+
+    def get_polled_properties(self):
+        with self._lock:
+            keys = set()
+            for sub in self._subscriptions:
+                keys |= sub.properties
+        return sorted(keys)
+
+    def poll(self, read):
+        """Read every subscribed property once and publish changes,
+           read(module_name, property_name) does the actual access
+        """
+        def _read(key):
+            try:
+                self.publish_property(key[0], key[1], read(*key))
+            except Exception as e:
+                self.logger.debug('could not poll {}:{}: {}'
+                                  .format(key[0], key[1], e))
+
+        run_grouped(self.fanout_executor, self.get_polled_properties(),
+                    lambda index, key: key[0], _read)
@@ -1,91 +1,369 @@
-import pyjsonrpc
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
 from aggregate.util.thread import StoppableThread
+from aggregate.util.fanout import run_grouped
+from aggregate.jsonsrv.cmdqueue import (COMMAND_GET,
+                                        COMMAND_SET,
+                                        COMMAND_CALL)
+from aggregate.jsonsrv.metrics import METRICS_CONTENT_TYPE
+from aggregate.events import (format_sse,
+                              parse_subscription_query,
+                              KEEPALIVE_INTERVAL)
 
+BULK_WORKERS = 8
 
-def make_json_server(drv_manager, node_list):
-    """JSON RPC Server factory
+
+def make_json_rpc(drv_manager, node_list, bulk_workers=BULK_WORKERS,
+                  property_cache=None, event_hub=None, command_queues=None,
+                  rpc_metrics=None, introspection_cache=None,
+                  preencoded=False, flap_suppressor=None, discovery=None):
+    """JSON RPC method container factory
+
+       With preencoded set, cached introspection results are returned
+       as PreEncoded objects, which only JsonRpcDispatcher understands.
     """
-    class PeriodicPiAggJsonServer(pyjsonrpc.HttpRequestHandler):
+    # imported on use, the caches and queues of this package do not
+    # depend on it
+    import pyjsonrpc
+
+    class PeriodicPiAggJsonRpc(object):
 
         # set references
         drvman = drv_manager
         nodelist = node_list
+        propcache = property_cache
+        events = event_hub
+        cmdqueue = command_queues
+        metrics = rpc_metrics
+        introspection = introspection_cache
+        flaps = flap_suppressor
+        mdns = discovery
+        return_preencoded = preencoded
 
-        @pyjsonrpc.rpcmethod
-        def list_nodes(self, simple=True):
-            # build serializable node dictionary and return
-            ret = {}
-            for node_name, node in self.nodelist.iteritems():
-                ret[node_name] = node.get_serializable_dict(simple)
+        # bulk property accesses fan out across modules
+        bulk_executor = ThreadPoolExecutor(max_workers=bulk_workers)
+
+        def _device_call(self, module_name, kind, name, call, *args):
+            """Serialize driver accesses per instance
+            """
+            if self.cmdqueue is None:
+                return call(*args)
+
+            return self.cmdqueue.submit(module_name, kind, name, call, *args)
 
+        def _read_property(self, module_name, property_name):
+            return self._device_call(module_name, COMMAND_GET, property_name,
+                                     self.drvman.get_module_property,
+                                     module_name, property_name)
+
+        def _get_property(self, module_name, property_name):
+            if self.propcache is None:
+                value = self._read_property(module_name, property_name)
+            else:
+                value = self.propcache.get(module_name, property_name,
+                                           lambda: self._read_property(module_name,
+                                                                       property_name))
+
+            # every read feeds change notifications
+            if self.events is not None:
+                self.events.publish_property(module_name,
+                                             property_name,
+                                             value)
+            return value
+
+        def _set_property(self, module_name, property_name, value):
+            # queued writes to the same property collapse to the last
+            return self._device_call(module_name, COMMAND_SET, property_name,
+                                     self._write_property,
+                                     module_name, property_name, value)
+
+        def _write_property(self, module_name, property_name, value):
+            try:
+                ret = self.drvman.set_module_property(module_name,
+                                                      property_name,
+                                                      value)
+            finally:
+                if self.propcache is not None:
+                    self.propcache.property_written(module_name,
+                                                    property_name)
+
+            if self.events is not None and ret is not False:
+                self.events.publish_property(module_name,
+                                             property_name,
+                                             value)
             return ret
 
+        def _introspect(self, rpc_name, module_name, build):
+            """Serve results that only change on module load/unload
+            """
+            if self.introspection is None:
+                return build()
+
+            entry = self.introspection.get(rpc_name, module_name, build)
+            if self.return_preencoded:
+                return entry
+            return entry.value
+
+        def _bulk_access(self, items, access):
+            def _call(item):
+                try:
+                    return {'result': access(*item)}
+                except Exception as e:
+                    return {'error': str(e)}
+
+            return run_grouped(self.bulk_executor, items,
+                               lambda index, item: item[0], _call)
+
+        @pyjsonrpc.rpcmethod
+        def list_nodes(self, simple=True, since=None):
+            """All nodes, or only the changes after version since
+            """
+            if since is None:
+                return self.nodelist.serialize(simple)
+
+            return self.nodelist.changes_since(since, simple)
+
         # TEMPORARY
         @pyjsonrpc.rpcmethod
         def reload_all(self):
             self.drvman.call_custom_method('ppagg.reload')
 
+        @pyjsonrpc.rpcmethod
+        def discovery_search(self):
+            """Search for SSDP services now
+            """
+            return self.drvman.call_custom_method('ppagg.discovery_search')
+
         @pyjsonrpc.rpcmethod
         def list_drivers(self):
-            return self.drvman.list_loaded_modules()
+            return self._introspect('list_drivers', None,
+                                    self.drvman.list_loaded_modules)
 
         @pyjsonrpc.rpcmethod
         def module_info(self, module_name):
-            return self.drvman.get_module_info(module_name)
+            return self._introspect('module_info', module_name,
+                                    lambda: self.drvman.get_module_info(module_name))
 
         @pyjsonrpc.rpcmethod
         def module_get_property(self, module_name, property_name):
-            return self.drvman.get_module_property(module_name, property_name)
+            return self._get_property(module_name, property_name)
 
         @pyjsonrpc.rpcmethod
         def module_set_property(self, module_name, property_name, value):
-            return self.drvman.set_module_property(module_name,
-                                                   property_name,
-                                                   value)
+            return self._set_property(module_name, property_name, value)
+
+        @pyjsonrpc.rpcmethod
+        def module_get_properties(self, properties):
+            """Read [module_name, property_name] pairs, concurrently
+               across modules and in order within a module
+            """
+            for item in properties:
+                if len(item) != 2:
+                    raise ValueError('expected [module_name, property_name]')
+
+            return self._bulk_access(properties, self._get_property)
+
+        @pyjsonrpc.rpcmethod
+        def module_set_properties(self, properties):
+            """Write [module_name, property_name, value] triples,
+               concurrently across modules and in order within a module
+            """
+            for item in properties:
+                if len(item) != 3:
+                    raise ValueError('expected [module_name, '
+                                     'property_name, value]')
+
+            return self._bulk_access(properties, self._set_property)
 
         @pyjsonrpc.rpcmethod
         def module_get_property_list(self, module_name):
-            return self.drvman.get_module_property_list(module_name)
+            return self._introspect('module_get_property_list', module_name,
+                                    lambda: self.drvman.get_module_property_list(module_name))
 
         @pyjsonrpc.rpcmethod
         def module_get_method_list(self, module_name):
-            return self.drvman.get_module_method_list(module_name)
+            return self._introspect('module_get_method_list', module_name,
+                                    lambda: self.drvman.get_module_method_list(module_name))
 
         @pyjsonrpc.rpcmethod
         def module_call_method(self, __module_name, __method_name, **kwargs):
-            return self.drvman.call_module_method(__module_name,
-                                                  __method_name,
-                                                  **kwargs)
+            return self._device_call(__module_name, COMMAND_CALL,
+                                     __method_name, self._call_method,
+                                     __module_name, __method_name, kwargs)
+
+        def _call_method(self, module_name, method_name, kwargs):
+            try:
+                return self.drvman.call_module_method(module_name,
+                                                      method_name,
+                                                      **kwargs)
+            finally:
+                if self.propcache is not None:
+                    self.propcache.method_called(module_name, method_name)
+                if self.events is not None:
+                    self.events.publish_method(module_name, method_name,
+                                               kwargs)
+
+        @pyjsonrpc.rpcmethod
+        def cache_stats(self):
+            if self.propcache is None:
+                return None
+
+            return self.propcache.get_stats()
+
+        @pyjsonrpc.rpcmethod
+        def queue_stats(self):
+            if self.cmdqueue is None:
+                return None
+
+            return self.cmdqueue.get_stats()
+
+        @pyjsonrpc.rpcmethod
+        def server_stats(self):
+            """Latency percentiles and error counts per RPC and module
+            """
+            if self.metrics is None:
+                return None
+
+            stats = self.metrics.get_stats()
+            if self.propcache is not None:
+                stats['cache'] = self.propcache.get_stats()
+            if self.cmdqueue is not None:
+                stats['queue'] = self.cmdqueue.get_stats()
+            if self.introspection is not None:
+                stats['introspection'] = self.introspection.get_stats()
+            if self.flaps is not None:
+                stats['flaps'] = self.flaps.get_stats()
+            if self.mdns is not None:
+                stats['discovery'] = self.mdns.get_stats()
+            return stats
 
         @pyjsonrpc.rpcmethod
         def server_interrupt(self, interrupt_key, **kwargs):
+            if self.events is not None:
+                self.events.publish_hook('server_interrupt',
+                                         dict(kwargs,
+                                              interrupt_key=interrupt_key))
             return self.drvman.external_interrupt(interrupt_key, **kwargs)
 
+    if rpc_metrics is not None:
+        rpc_metrics.instrument(PeriodicPiAggJsonRpc)
+
+    return PeriodicPiAggJsonRpc
+
+
+def make_json_server(drv_manager, node_list, property_cache=None,
+                     event_hub=None, command_queues=None, rpc_metrics=None,
+                     introspection_cache=None, flap_suppressor=None,
+                     discovery=None):
+    """JSON RPC Server factory
+    """
+    import pyjsonrpc
+
+    class PeriodicPiAggJsonServer(pyjsonrpc.HttpRequestHandler,
+                                  make_json_rpc(drv_manager, node_list,
+                                                property_cache=property_cache,
+                                                event_hub=event_hub,
+                                                command_queues=command_queues,
+                                                rpc_metrics=rpc_metrics,
+                                                introspection_cache=introspection_cache,
+                                                flap_suppressor=flap_suppressor,
+                                                discovery=discovery)):
+
+        # set when the server stops, ends event streams
+        streams_stopped = threading.Event()
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            if self.metrics is not None and url.path == '/metrics':
+                data = self.metrics.render_text()
+                self.send_response(200)
+                self.send_header('Content-Type', METRICS_CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+                return
+
+            if self.events is None or url.path != '/events':
+                parent_get = getattr(super(PeriodicPiAggJsonServer, self),
+                                     'do_GET', None)
+                if parent_get is None:
+                    self.send_error(404)
+                    return
+                return parent_get()
+
+            try:
+                sub = self.events.subscribe(**parse_subscription_query(url.query))
+            except ValueError as e:
+                self.send_error(400, str(e))
+                return
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            try:
+                while not self.streams_stopped.is_set() and\
+                      not sub.overflowed:
+                    event = sub.get(KEEPALIVE_INTERVAL)
+                    if event is None:
+                        self.wfile.write(b': keepalive\n\n')
+                    else:
+                        self.wfile.write(format_sse(event))
+                    self.wfile.flush()
+            except OSError:
+                pass
+            finally:
+                self.events.unsubscribe(sub)
+
     return PeriodicPiAggJsonServer
 
 
 class PeriodicPiAggController(StoppableThread):
     """Threaded JSON RPC server wrapper class
     """
-    def __init__(self, drv_manager, node_list):
+    def __init__(self, drv_manager, node_list, property_cache=None,
+                 event_hub=None, command_queues=None, rpc_metrics=None,
+                 introspection_cache=None, port=8080, flap_suppressor=None,
+                 discovery=None):
         super(PeriodicPiAggController, self).__init__()
+        self.port = port
         self.drv_manager = drv_manager
         self.node_list = node_list
+        self.property_cache = property_cache
+        self.event_hub = event_hub
+        self.command_queues = command_queues
+        self.rpc_metrics = rpc_metrics
+        self.introspection_cache = introspection_cache
+        self.flap_suppressor = flap_suppressor
+        self.discovery = discovery
         self.http_server = None
+        self.json_server_class = None
 
     def stop(self):
         super(PeriodicPiAggController, self).stop()
+        if self.json_server_class is not None:
+            self.json_server_class.streams_stopped.set()
         self.http_server.shutdown()
 
     def run(self):
+        import pyjsonrpc
 
         def _handle_sigterm(*args):
             self.stop()
 
         # generate class with references
-        json_server_class = make_json_server(self.drv_manager, self.node_list)
-        self.http_server = pyjsonrpc.ThreadingHttpServer(server_address=('', 8080),
-                                                         RequestHandlerClass=json_server_class)
+        self.json_server_class = make_json_server(self.drv_manager,
+                                                  self.node_list,
+                                                  self.property_cache,
+                                                  self.event_hub,
+                                                  self.command_queues,
+                                                  self.rpc_metrics,
+                                                  self.introspection_cache,
+                                                  self.flap_suppressor,
+                                                  self.discovery)
+        self.http_server = pyjsonrpc.ThreadingHttpServer(server_address=('', self.port),
+                                                         RequestHandlerClass=self.json_server_class)
 
         self.http_server.serve_forever()
 
@@ -0,0 +1,192 @@
+import asyncio
+import logging
+import threading
+import time
+from urllib.parse import urlsplit
+from aggregate.events import (format_sse,
+                              parse_subscription_query,
+                              KEEPALIVE_INTERVAL)
+from aggregate.jsonsrv.metrics import (METRICS_CONTENT_TYPE,
+                                       PHASE_QUEUE,
+                                       SERVER_RPC)
+from aggregate.jsonsrv.dispatch import INTROSPECTION_PATH
+from aggregate.jsonsrv.httputil import (HttpRequestError,
+                                        SSE_RESPONSE_HEAD,
+                                        build_http_response,
+                                        build_introspection_response,
+                                        build_rpc_response,
+                                        parse_header_line,
+                                        parse_request_line,
+                                        request_content_length,
+                                        request_keep_alive)
+
+
+async def read_http_request(reader):
+    """Read one HTTP request, returns (method, path, headers, body,
+       keep_alive) or None if the connection was closed
+    """
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+
+    method, path, version =\
+        parse_request_line(request_line.decode('latin-1'))
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if not line:
+            return None
+        line = line.decode('latin-1').strip()
+        if not line:
+            break
+        parse_header_line(line, headers)
+
+    length = request_content_length(headers)
+    body = await reader.readexactly(length) if length else b''
+    return method, path, headers, body, request_keep_alive(version, headers)
+
+
+class AsyncJsonRpcServer(object):
+    """JSON RPC over HTTP/1.1 on an asyncio event loop
+
+       Connections are kept alive and handled by the loop; method calls
+       are handed to an executor since drivers do blocking I/O.
+    """
+    def __init__(self, loop, dispatcher, address='', port=8080,
+                 executor=None, root_logger='ppagg', event_hub=None):
+        self.loop = loop
+        self.dispatcher = dispatcher
+        self.event_hub = event_hub
+        self.address = address
+        self.port = port
+        self.executor = executor
+        self.logger = logging.getLogger('{}.jsonsrv'.format(root_logger))
+
+        self.server = None
+        self._writers = set()
+        self._stopped = threading.Event()
+
+    def start(self):
+        self.loop.call_soon_threadsafe(self._start)
+
+    def _start(self):
+        self.loop.create_task(self._serve())
+
+    async def _serve(self):
+        self.server = await asyncio.start_server(self._handle_connection,
+                                                 host=self.address or None,
+                                                 port=self.port)
+        if self._stopped.is_set():
+            self._stop()
+
+    async def _handle_connection(self, reader, writer):
+        self._writers.add(writer)
+        try:
+            while True:
+                try:
+                    request = await read_http_request(reader)
+                except HttpRequestError as e:
+                    writer.write(build_http_response(e.status,
+                                                     keep_alive=False))
+                    break
+
+                if request is None:
+                    break
+
+                method, path, headers, body, keep_alive = request
+                url = urlsplit(path)
+                metrics = self.dispatcher.metrics
+                if method == 'GET' and url.path == '/events':
+                    await self._stream_events(writer, url.query)
+                    break
+                elif method == 'GET' and url.path == '/metrics' and\
+                        metrics is not None:
+                    writer.write(build_http_response(200,
+                                                     metrics.render_text(),
+                                                     keep_alive,
+                                                     content_type=METRICS_CONTENT_TYPE))
+                elif method == 'GET' and\
+                        url.path.startswith(INTROSPECTION_PATH):
+                    status, data, etag =\
+                        await self.loop.run_in_executor(self.executor,
+                                                        self.dispatcher.handle_introspection,
+                                                        url.path,
+                                                        headers.get('if-none-match'))
+                    writer.write(build_introspection_response(status, data,
+                                                              etag,
+                                                              keep_alive))
+                elif method != 'POST':
+                    writer.write(build_http_response(405,
+                                                     keep_alive=keep_alive))
+                else:
+                    data, etag =\
+                        await self.loop.run_in_executor(self.executor,
+                                                        self._handle_request,
+                                                        body,
+                                                        time.perf_counter())
+                    writer.write(build_rpc_response(data, etag, keep_alive))
+
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError,
+                asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    def _handle_request(self, body, queued_at):
+        # runs on the executor, account the time spent waiting for it
+        if self.dispatcher.metrics is not None:
+            self.dispatcher.metrics.observe(SERVER_RPC, '', PHASE_QUEUE,
+                                            time.perf_counter() - queued_at)
+
+        return self.dispatcher.handle_http(body)
+
+    async def _stream_events(self, writer, query):
+        """Server-sent event stream, the connection is closed when
+           the stream ends
+        """
+        if self.event_hub is None:
+            writer.write(build_http_response(404, keep_alive=False))
+            return
+
+        try:
+            filters = parse_subscription_query(query)
+        except ValueError:
+            writer.write(build_http_response(400, keep_alive=False))
+            return
+
+        wakeup = asyncio.Event()
+        sub = self.event_hub.subscribe(notify=lambda: self.loop.call_soon_threadsafe(wakeup.set),
+                                       **filters)
+        writer.write(SSE_RESPONSE_HEAD)
+        try:
+            while not self._stopped.is_set() and not sub.overflowed:
+                try:
+                    await asyncio.wait_for(wakeup.wait(), KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    writer.write(b': keepalive\n\n')
+                wakeup.clear()
+
+                event = sub.get_nowait()
+                while event is not None:
+                    writer.write(format_sse(event))
+                    event = sub.get_nowait()
+                await writer.drain()
+        finally:
+            self.event_hub.unsubscribe(sub)
+
+    def stop(self):
+        self._stopped.set()
+        self.loop.call_soon_threadsafe(self._stop)
+
+    def _stop(self):
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+
+        for writer in list(self._writers):
+            writer.close()
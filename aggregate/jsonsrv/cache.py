@@ -0,0 +1,177 @@
+import glob
+import json
+import os
+import threading
+import time
+
+
+def load_cache_policies(plugin_root):
+    """Read the module_cache section of every plugin descriptor
+
+       Returns a dictionary keyed by module type. "properties" maps a
+       property name to its TTL in seconds; "methods" maps a method
+       name to the properties it invalidates. Methods that are not
+       listed invalidate every cached property of the instance.
+    """
+    policies = {}
+    for descriptor in glob.glob(os.path.join(plugin_root, '*', '*.json')):
+        try:
+            with open(descriptor, 'r') as f:
+                data = json.load(f)
+            module_type = data['module_desc']['module_type']
+        except (OSError, ValueError, KeyError, TypeError):
+            continue
+
+        cache_section = data.get('module_cache', {})
+        policies[module_type] = {'properties':
+                                 dict(cache_section.get('properties', {})),
+                                 'methods':
+                                 dict(cache_section.get('methods', {}))}
+
+    return policies
+
+
+def module_type_of(module_name):
+    """Instances are named after their module type plus a suffix
+    """
+    return module_name.split('-', 1)[0]
+
+
+class _PendingRead(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+        # invalidated while in flight, the value is not stored
+        self.stale = False
+
+
+class PropertyCache(object):
+    """Read-through cache of module properties
+
+       Concurrent misses on the same property share one driver read;
+       writes and method calls invalidate according to the policies.
+       An invalidation only affects the reads in flight for the
+       properties it drops.
+    """
+    def __init__(self, policies=None, clock=time.monotonic):
+        self.policies = policies or {}
+        self.clock = clock
+        self._entries = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.uncached = 0
+        self.invalidations = 0
+
+    def _policy(self, module_name):
+        return self.policies.get(module_type_of(module_name))
+
+    def get_ttl(self, module_name, property_name):
+        policy = self._policy(module_name)
+        if policy is None:
+            return None
+
+        return policy['properties'].get(property_name)
+
+    def get(self, module_name, property_name, read):
+        """Return a cached value or call read() to refresh it
+        """
+        ttl = self.get_ttl(module_name, property_name)
+        if not ttl:
+            with self._lock:
+                self.uncached += 1
+            return read()
+
+        key = (module_name, property_name)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > self.clock():
+                self.hits += 1
+                return entry[0]
+
+            self.misses += 1
+            pending = self._pending.get(key)
+            owner = pending is None
+            if owner:
+                pending = _PendingRead()
+                self._pending[key] = pending
+
+        if not owner:
+            # somebody is already reading this property
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.value
+
+        try:
+            pending.value = read()
+        except Exception as e:
+            pending.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._pending.get(key) is pending:
+                    del self._pending[key]
+                if pending.error is None and not pending.stale:
+                    self._entries[key] = (pending.value, self.clock() + ttl)
+            pending.done.set()
+
+        return pending.value
+
+    def _drop_pending(self, keys):
+        # caller holds the lock; later readers start a fresh read
+        for key in keys:
+            pending = self._pending.pop(key, None)
+            if pending is not None:
+                pending.stale = True
+
+    def invalidate(self, module_name, property_name=None):
+        """Drop one property or every property of an instance
+        """
+        with self._lock:
+            if property_name is not None:
+                keys = [(module_name, property_name)]
+                pending = keys
+            else:
+                keys = [key for key in self._entries if key[0] == module_name]
+                pending = [key for key in self._pending
+                           if key[0] == module_name]
+
+            self._drop_pending(pending)
+            for key in keys:
+                if self._entries.pop(key, None) is not None:
+                    self.invalidations += 1
+
+    def property_written(self, module_name, property_name):
+        self.invalidate(module_name, property_name)
+
+    def method_called(self, module_name, method_name):
+        policy = self._policy(module_name)
+        if policy is None or method_name not in policy['methods']:
+            self.invalidate(module_name)
+            return
+
+        for property_name in policy['methods'][method_name]:
+            self.invalidate(module_name, property_name)
+
+    def clear(self):
+        with self._lock:
+            self._drop_pending(list(self._pending))
+            self._entries.clear()
+
+    def known_modules(self):
+        """Instances with cached properties
+        """
+        with self._lock:
+            return set([key[0] for key in self._entries])
+
+    def get_stats(self):
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'uncached': self.uncached,
+                    'invalidations': self.invalidations,
+                    'entries': len(self._entries)}
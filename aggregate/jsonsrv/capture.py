@@ -0,0 +1,34 @@
+import json
+import threading
+import time
+
+
+class RequestCapture(object):
+    """Write decoded JSON-RPC requests to a file, one JSON object per
+       line with the offset in seconds from the first request, so that
+       traffic can be replayed by aggbench; an existing capture is
+       overwritten
+    """
+    def __init__(self, path, clock=time.monotonic):
+        self.path = path
+        self.clock = clock
+        self._file = open(path, 'w')
+        self._start = None
+        self._lock = threading.Lock()
+
+    def __call__(self, request):
+        now = self.clock()
+        with self._lock:
+            if self._file is None:
+                return
+            if self._start is None:
+                self._start = now
+            self._file.write(json.dumps({'t': round(now - self._start, 6),
+                                         'request': request}) + '\n')
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,199 @@
+import threading
+import time
+from collections import deque
+
+COMMAND_GET = 'get'
+COMMAND_SET = 'set'
+COMMAND_CALL = 'call'
+
+# seconds a command waits for a busy instance before giving up
+QUEUE_TIMEOUT = 30
+
+
+class CommandQueueTimeout(Exception):
+    pass
+
+
+class _Command(object):
+    def __init__(self, kind, name, call, args):
+        self.kind = kind
+        self.name = name
+        self.call = call
+        self.args = args
+        self.done = False
+        self.value = None
+        self.error = None
+
+
+class _DeviceQueue(object):
+    def __init__(self):
+        self.pending = deque()
+        self.running = False
+        self.cond = threading.Condition()
+        # submitters holding the queue, it is dropped when idle
+        self.users = 0
+
+
+class DeviceCommandQueues(object):
+    """Serialized command execution per module instance
+
+       Driver accesses to the same instance run one at a time in
+       arrival order, each on the thread that submitted it. While
+       waiting, a write to a property replaces an earlier pending write
+       to the same property and a read joins an earlier pending read of
+       the same property, unless a method call or a conflicting access
+       to that property is queued in between. Commands waiting longer
+       than timeout seconds for a busy instance fail with
+       CommandQueueTimeout; queues only exist while in use.
+    """
+    def __init__(self, metrics=None, clock=time.perf_counter,
+                 timeout=QUEUE_TIMEOUT):
+        self.metrics = metrics
+        self.clock = clock
+        self.timeout = timeout
+        self._queues = {}
+        self._lock = threading.Lock()
+
+        self.executed = 0
+        self.coalesced = 0
+        self.shared = 0
+        self.timeouts = 0
+
+    def _acquire_queue(self, module_name):
+        with self._lock:
+            queue = self._queues.get(module_name)
+            if queue is None:
+                queue = self._queues[module_name] = _DeviceQueue()
+            queue.users += 1
+            return queue
+
+    def _release_queue(self, module_name, queue):
+        with self._lock:
+            queue.users -= 1
+            if queue.users == 0:
+                del self._queues[module_name]
+
+    def _wait(self, queue, condition, deadline):
+        # caller holds the queue lock, returns False on timeout
+        while not condition():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            queue.cond.wait(remaining)
+        return True
+
+    @staticmethod
+    def _find_mergeable(queue, kind, name):
+        # caller holds the queue lock
+        if kind == COMMAND_CALL:
+            return None
+
+        for command in reversed(queue.pending):
+            if command.kind == COMMAND_CALL:
+                return None
+            if command.name != name:
+                continue
+            if command.kind == kind:
+                return command
+            # conflicting access to the same property
+            return None
+
+        return None
+
+    def submit(self, module_name, kind, name, call, *args):
+        """Run call(*args) in the instance queue and return its result;
+           kind is one of get, set or call and name is the property or
+           method name
+        """
+        queue = self._acquire_queue(module_name)
+        try:
+            return self._submit(queue, module_name, kind, name, call, args)
+        finally:
+            self._release_queue(module_name, queue)
+
+    def _timed_out(self, module_name):
+        self._count('timeouts')
+        return CommandQueueTimeout('instance "{}" is busy'
+                                   .format(module_name))
+
+    def _submit(self, queue, module_name, kind, name, call, args):
+        submitted = self.clock()
+        deadline = time.monotonic() + self.timeout
+        with queue.cond:
+            command = self._find_mergeable(queue, kind, name)
+            if command is not None:
+                if kind == COMMAND_SET:
+                    # only the last value matters
+                    command.call = call
+                    command.args = args
+                    self._count('coalesced')
+                else:
+                    self._count('shared')
+
+                if not self._wait(queue, lambda: command.done, deadline):
+                    raise self._timed_out(module_name)
+                self._waited(submitted)
+                return self._result(command)
+
+            command = _Command(kind, name, call, args)
+            queue.pending.append(command)
+            if not self._wait(queue,
+                              lambda: not queue.running and
+                              queue.pending[0] is command,
+                              deadline):
+                # give up, along with whoever joined this command
+                queue.pending.remove(command)
+                command.error = self._timed_out(module_name)
+                command.done = True
+                queue.cond.notify_all()
+                raise command.error
+
+            queue.pending.popleft()
+            queue.running = True
+            call = command.call
+            args = command.args
+
+        self._waited(submitted)
+        try:
+            command.value = call(*args)
+        except Exception as e:
+            command.error = e
+        finally:
+            with queue.cond:
+                queue.running = False
+                command.done = True
+                queue.cond.notify_all()
+            self._count('executed')
+
+        return self._result(command)
+
+    def _waited(self, submitted):
+        if self.metrics is not None:
+            self.metrics.add_queue_wait(self.clock() - submitted)
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    @staticmethod
+    def _result(command):
+        if command.error is not None:
+            raise command.error
+        return command.value
+
+    def get_stats(self):
+        with self._lock:
+            queues = list(self._queues.values())
+
+        pending = 0
+        for queue in queues:
+            with queue.cond:
+                pending += len(queue.pending)
+
+        with self._lock:
+            return {'executed': self.executed,
+                    'coalesced': self.coalesced,
+                    'shared': self.shared,
+                    'timeouts': self.timeouts,
+                    'queues': len(queues),
+                    'pending': pending}
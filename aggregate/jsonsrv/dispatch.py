@@ -0,0 +1,261 @@
+import inspect
+import json
+import logging
+import time
+from urllib.parse import unquote
+from aggregate.util.fanout import run_grouped
+from aggregate.jsonsrv.metrics import PHASE_SERIALIZE
+from aggregate.jsonsrv.introspect import (INTROSPECTION_RPCS,
+                                          PreEncoded,
+                                          etag_matches)
+
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+
+INTROSPECTION_PATH = '/introspect/'
+# HTTP status of introspection requests failing with an RPC error
+_INTROSPECTION_STATUS = {METHOD_NOT_FOUND: 404,
+                         INVALID_PARAMS: 400}
+
+
+class JsonRpcError(Exception):
+    """JSON-RPC error with code and optional data
+    """
+    def __init__(self, code, message, data=None):
+        super(JsonRpcError, self).__init__(message)
+        self.code = code
+        self.message = message
+        self.data = data
+
+    def to_dict(self):
+        ret = {'code': self.code, 'message': self.message}
+        if self.data is not None:
+            ret['data'] = self.data
+
+        return ret
+
+
+def make_error_response(error, request_id=None):
+    return {'jsonrpc': '2.0', 'error': error.to_dict(), 'id': request_id}
+
+
+def request_module_name(request):
+    """Module addressed by a module_* request or None
+    """
+    if isinstance(request, dict) and\
+       str(request.get('method', '')).startswith('module_'):
+        params = request.get('params')
+        if isinstance(params, list) and params:
+            module_name = params[0]
+        elif isinstance(params, dict):
+            module_name = params.get('module_name')
+        else:
+            module_name = None
+
+        if isinstance(module_name, str):
+            return module_name
+
+    return None
+
+
+def batch_group_key(index, request):
+    """Group module_* requests by module name, everything else runs
+       on its own
+    """
+    module_name = request_module_name(request)
+    if module_name is not None:
+        return ('module', module_name)
+
+    return ('request', index)
+
+
+class JsonRpcDispatcher(object):
+    """Transport independent JSON-RPC 2.0 dispatcher
+
+       Dispatches to the methods of rpc_object flagged by
+       pyjsonrpc.rpcmethod, so the same method container serves
+       every server front-end.
+    """
+    def __init__(self, rpc_object, root_logger='ppagg', batch_executor=None,
+                 metrics=None, request_log=None):
+        self.rpc_object = rpc_object
+        self.batch_executor = batch_executor
+        self.metrics = metrics
+        # optional callable receiving every decoded request
+        self.request_log = request_log
+        self.logger = logging.getLogger('{}.jsonrpc'.format(root_logger))
+        self.methods = {}
+        for attr_name in dir(rpc_object):
+            if attr_name.startswith('_'):
+                continue
+
+            attr = getattr(rpc_object, attr_name)
+            if callable(attr) and getattr(attr, 'rpcmethod', False):
+                self.methods[attr_name] = attr
+
+    def call_method(self, method_name, params):
+        """Call a method with positional or named parameters
+        """
+        if method_name not in self.methods:
+            raise JsonRpcError(METHOD_NOT_FOUND, 'Method not found',
+                               method_name)
+
+        method = self.methods[method_name]
+        if params is None:
+            args, kwargs = [], {}
+        elif isinstance(params, list):
+            args, kwargs = params, {}
+        elif isinstance(params, dict):
+            args, kwargs = [], params
+        else:
+            raise JsonRpcError(INVALID_PARAMS, 'Invalid params')
+
+        try:
+            inspect.signature(method).bind(*args, **kwargs)
+        except TypeError as e:
+            raise JsonRpcError(INVALID_PARAMS, 'Invalid params', str(e))
+
+        try:
+            return method(*args, **kwargs)
+        except JsonRpcError:
+            raise
+        except Exception as e:
+            self.logger.exception('error while calling "{}"'
+                                  .format(method_name))
+            raise JsonRpcError(INTERNAL_ERROR, 'Internal error', str(e))
+
+    def call(self, request):
+        """Process one decoded request, returns the response dictionary
+           or None for notifications
+        """
+        if not isinstance(request, dict) or\
+           not isinstance(request.get('method'), str):
+            return make_error_response(JsonRpcError(INVALID_REQUEST,
+                                                    'Invalid Request'))
+
+        is_notification = 'id' not in request
+        request_id = request.get('id')
+        try:
+            result = self.call_method(request['method'],
+                                      request.get('params'))
+        except JsonRpcError as e:
+            if is_notification:
+                return None
+            return make_error_response(e, request_id)
+
+        if is_notification:
+            return None
+
+        return {'jsonrpc': '2.0', 'result': result, 'id': request_id}
+
+    def _call_encoded(self, request):
+        """Process one request, returns the encoded response or None
+           and the entity tag of pre-encoded results
+        """
+        response = self.call(request)
+        if response is None:
+            return None, None
+
+        result = response.get('result')
+        etag = result.etag if isinstance(result, PreEncoded) else None
+
+        # only known methods get a series
+        method_name = request.get('method')\
+            if isinstance(request, dict) else None
+        if self.metrics is None or not isinstance(method_name, str) or\
+           method_name not in self.methods:
+            return self._encode_one(response), etag
+
+        start = time.perf_counter()
+        data = self._encode_one(response)
+        self.metrics.observe(method_name,
+                             request_module_name(request) or '',
+                             PHASE_SERIALIZE,
+                             time.perf_counter() - start)
+        return data, etag
+
+    def handle_http(self, data):
+        """Process raw request data, returns the encoded response or
+           None plus the entity tag of a pre-encoded result
+        """
+        try:
+            request = json.loads(data.decode('utf-8'))
+        except ValueError:
+            response = make_error_response(JsonRpcError(PARSE_ERROR,
+                                                        'Parse error'))
+            return self.encode(response), None
+
+        if self.request_log is not None:
+            self.request_log(request)
+
+        if isinstance(request, list) and not request:
+            response = make_error_response(JsonRpcError(INVALID_REQUEST,
+                                                        'Invalid Request'))
+            return self.encode(response), None
+
+        # responses are encoded as they complete so that serialization
+        # is accounted to each call
+        if isinstance(request, list):
+            responses = run_grouped(self.batch_executor, request,
+                                    batch_group_key,
+                                    lambda item: self._call_encoded(item)[0])
+            responses = [data for data in responses if data is not None]
+            if not responses:
+                return None, None
+            return '[{}]'.format(','.join(responses)).encode('utf-8'), None
+
+        data, etag = self._call_encoded(request)
+        if data is None:
+            return None, None
+
+        return data.encode('utf-8'), etag
+
+    def handle_introspection(self, path, if_none_match=None):
+        """Serve GET /introspect/<rpc>[/<module name>], returns (HTTP
+           status, body, entity tag); the status is 304 without a body
+           when the result still matches if_none_match
+        """
+        params = [unquote(part)
+                  for part in path[len(INTROSPECTION_PATH):].split('/')]
+        rpc_name = params.pop(0)
+        try:
+            if rpc_name not in INTROSPECTION_RPCS:
+                raise JsonRpcError(METHOD_NOT_FOUND, 'Method not found',
+                                   rpc_name)
+            result = self.call_method(rpc_name, params)
+        except JsonRpcError as e:
+            body = json.dumps({'error': e.to_dict()}).encode('utf-8')
+            return _INTROSPECTION_STATUS.get(e.code, 500), body, None
+
+        if not isinstance(result, PreEncoded):
+            result = PreEncoded(result)
+
+        if etag_matches(result.etag, if_none_match):
+            return 304, b'', result.etag
+
+        return 200, result.encoded.encode('utf-8'), result.etag
+
+    def _encode_one(self, response):
+        result = response.get('result')
+        if isinstance(result, PreEncoded):
+            return '{{"jsonrpc": "2.0", "result": {}, "id": {}}}'\
+                .format(result.encoded, json.dumps(response['id']))
+
+        try:
+            return json.dumps(response)
+        except (TypeError, ValueError) as e:
+            # result is not serializable
+            error = JsonRpcError(INTERNAL_ERROR, 'Internal error', str(e))
+            return json.dumps(make_error_response(error, response.get('id')))
+
+    def encode(self, response):
+        if isinstance(response, list):
+            data = '[{}]'.format(','.join([self._encode_one(item)
+                                           for item in response]))
+        else:
+            data = self._encode_one(response)
+
+        return data.encode('utf-8')
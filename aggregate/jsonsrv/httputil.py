@@ -0,0 +1,118 @@
+MAX_BODY_SIZE = 1024*1024
+MAX_HEAD_SIZE = 64*1024
+
+STATUS_REASONS = {200: 'OK',
+                  204: 'No Content',
+                  304: 'Not Modified',
+                  400: 'Bad Request',
+                  404: 'Not Found',
+                  405: 'Method Not Allowed',
+                  413: 'Payload Too Large',
+                  500: 'Internal Server Error',
+                  503: 'Service Unavailable'}
+
+
+class HttpRequestError(Exception):
+    """Malformed HTTP request
+    """
+    def __init__(self, status):
+        super(HttpRequestError, self).__init__(STATUS_REASONS[status])
+        self.status = status
+
+
+def parse_request_line(line):
+    """Returns (method, path, version)
+    """
+    try:
+        method, path, version = line.split()
+    except ValueError:
+        raise HttpRequestError(400)
+
+    return method, path, version
+
+
+def parse_header_line(line, headers):
+    name, sep, value = line.partition(':')
+    if not sep:
+        raise HttpRequestError(400)
+    headers[name.strip().lower()] = value.strip()
+
+
+def parse_request_head(head):
+    """Parse request line and headers, returns (method, path, version,
+       headers)
+    """
+    lines = head.split('\r\n')
+    method, path, version = parse_request_line(lines[0])
+    headers = {}
+    for line in lines[1:]:
+        if line.strip():
+            parse_header_line(line, headers)
+
+    return method, path, version, headers
+
+
+def request_keep_alive(version, headers):
+    connection = headers.get('connection', '').lower()
+    if version == 'HTTP/1.1':
+        return connection != 'close'
+
+    return connection == 'keep-alive'
+
+
+def request_content_length(headers):
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise HttpRequestError(400)
+
+    if length < 0:
+        raise HttpRequestError(400)
+    if length > MAX_BODY_SIZE:
+        raise HttpRequestError(413)
+
+    return length
+
+
+def build_http_response(status, body=b'', keep_alive=True,
+                        content_type='application/json', extra_headers=None):
+    head = ['HTTP/1.1 {} {}'.format(status, STATUS_REASONS[status]),
+            'Content-Type: {}'.format(content_type),
+            'Content-Length: {}'.format(len(body)),
+            'Connection: {}'.format('keep-alive' if keep_alive else 'close')]
+    if extra_headers:
+        head.extend(['{}: {}'.format(name, value)
+                     for name, value in extra_headers.items()])
+
+    return ('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body
+
+
+def build_rpc_response(data, etag, keep_alive=True):
+    """HTTP response for the return value of
+       JsonRpcDispatcher.handle_http
+
+       POST responses are never conditional, clients revalidate
+       introspection results with GET /introspect/ and the ETag passed
+       along here.
+    """
+    extra_headers = {'ETag': etag} if etag is not None else None
+    if data is None:
+        return build_http_response(204, keep_alive=keep_alive)
+
+    return build_http_response(200, data, keep_alive,
+                               extra_headers=extra_headers)
+
+
+def build_introspection_response(status, body, etag, keep_alive=True):
+    """HTTP response for the return value of
+       JsonRpcDispatcher.handle_introspection
+    """
+    extra_headers = {'ETag': etag} if etag is not None else None
+    return build_http_response(status, body, keep_alive,
+                               extra_headers=extra_headers)
+
+
+SSE_RESPONSE_HEAD = (b'HTTP/1.1 200 OK\r\n'
+                     b'Content-Type: text/event-stream\r\n'
+                     b'Cache-Control: no-cache\r\n'
+                     b'Connection: close\r\n\r\n')
@@ -0,0 +1,78 @@
+import hashlib
+import json
+import threading
+
+# RPCs served by IntrospectionCache, also reachable with
+# GET /introspect/<rpc>[/<module name>] for conditional requests
+INTROSPECTION_RPCS = ('list_drivers', 'module_info',
+                      'module_get_property_list', 'module_get_method_list')
+
+
+def etag_matches(etag, if_none_match):
+    """Whether an If-None-Match header value matches an entity tag
+    """
+    if etag is None or not if_none_match:
+        return False
+
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or etag in tags or 'W/{}'.format(etag) in tags
+
+
+class PreEncoded(object):
+    """RPC result with its JSON encoding and entity tag
+    """
+    __slots__ = ('value', 'encoded', 'etag')
+
+    def __init__(self, value):
+        self.value = value
+        self.encoded = json.dumps(value)
+        self.etag = '"{}"'.format(hashlib.sha1(self.encoded.encode('utf-8'))
+                                  .hexdigest()[:20])
+
+
+class IntrospectionCache(object):
+    """Pre-encoded results of RPCs that only change when modules are
+       loaded or unloaded
+
+       Entries are keyed by (rpc name, module name); the aggregator
+       invalidates them whenever drivers may have been loaded or
+       unloaded.
+    """
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._generation = 0
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, rpc_name, module_name, build):
+        """Cached entry or a new one built from build()
+        """
+        key = (rpc_name, module_name)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self.hits += 1
+                return entry
+            self.misses += 1
+            generation = self._generation
+
+        entry = PreEncoded(build())
+        with self._lock:
+            # drop results that raced with an invalidation
+            if generation == self._generation:
+                self._entries[key] = entry
+
+        return entry
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def get_stats(self):
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'entries': len(self._entries)}
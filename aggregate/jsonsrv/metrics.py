@@ -0,0 +1,211 @@
+import bisect
+import functools
+import inspect
+import threading
+import time
+
+# upper bounds in seconds, the last bucket is unbounded
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUANTILES = (0.5, 0.95, 0.99)
+# label combinations kept before modules are lumped together
+MAX_SERIES = 2048
+
+PHASE_QUEUE = 'queue'
+PHASE_DRIVER = 'driver'
+PHASE_SERIALIZE = 'serialize'
+
+OTHER_MODULE = '<other>'
+# label of the time requests wait for a server worker
+SERVER_RPC = '<server>'
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4'
+
+
+def _escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"')\
+        .replace('\n', '\\n')
+
+
+class Histogram(object):
+    """Fixed bucket histogram
+    """
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """Estimate a quantile by interpolating inside its bucket
+        """
+        if not self.count:
+            return None
+
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[index-1] if index else 0.0
+                if index == len(self.buckets):
+                    return self.max
+                upper = min(self.buckets[index], self.max)
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+
+        return self.max
+
+
+class _CallTimer(object):
+    def __init__(self):
+        self.queued = 0.0
+
+
+class RpcMetrics(object):
+    """Latency histograms of JSON-RPC methods
+
+       Series are labeled by RPC name, module instance and phase:
+       queue is the time spent waiting for the instance command
+       queue, driver the rest of the method call and serialize the
+       response encoding. Time spent by requests waiting for a server
+       worker is recorded as the queue phase of SERVER_RPC.
+    """
+    def __init__(self, clock=time.perf_counter, max_series=MAX_SERIES):
+        self.clock = clock
+        self.max_series = max_series
+        self._histograms = {}
+        self._errors = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def observe(self, rpc_name, module_name, phase, seconds):
+        with self._lock:
+            key = (rpc_name, module_name, phase)
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                if len(self._histograms) >= self.max_series:
+                    key = (rpc_name, OTHER_MODULE, phase)
+                    histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def error(self, rpc_name, module_name):
+        with self._lock:
+            key = (rpc_name, module_name)
+            if key not in self._errors and\
+               len(self._errors) >= self.max_series:
+                key = (rpc_name, OTHER_MODULE)
+            self._errors[key] = self._errors.get(key, 0) + 1
+
+    def add_queue_wait(self, seconds):
+        """Account queue wait to the RPC running on this thread
+        """
+        timer = getattr(self._local, 'timer', None)
+        if timer is not None:
+            timer.queued += seconds
+
+    def timed(self, rpc_name, func):
+        """Wrap a RPC method, the module label is taken from its first
+           parameter if it is a module name
+        """
+        params = list(inspect.signature(func).parameters)[1:]
+        module_param = None
+        if params and params[0].endswith('module_name'):
+            module_param = params[0]
+
+        @functools.wraps(func)
+        def _timed(rpc_object, *args, **kwargs):
+            if module_param is None:
+                module_name = ''
+            elif args:
+                module_name = args[0]
+            else:
+                module_name = kwargs.get(module_param, '')
+            if not isinstance(module_name, str):
+                module_name = OTHER_MODULE
+
+            timer = _CallTimer()
+            outer_timer = getattr(self._local, 'timer', None)
+            self._local.timer = timer
+            start = self.clock()
+            try:
+                return func(rpc_object, *args, **kwargs)
+            except Exception:
+                self.error(rpc_name, module_name)
+                raise
+            finally:
+                elapsed = self.clock() - start
+                self._local.timer = outer_timer
+                self.observe(rpc_name, module_name, PHASE_QUEUE,
+                             timer.queued)
+                self.observe(rpc_name, module_name, PHASE_DRIVER,
+                             max(elapsed - timer.queued, 0.0))
+
+        return _timed
+
+    def instrument(self, rpc_class):
+        """Time every pyjsonrpc.rpcmethod of a method container class
+        """
+        for attr_name, attr in list(vars(rpc_class).items()):
+            if callable(attr) and getattr(attr, 'rpcmethod', False):
+                setattr(rpc_class, attr_name, self.timed(attr_name, attr))
+
+        return rpc_class
+
+    def get_stats(self):
+        with self._lock:
+            series = []
+            for (rpc_name, module_name, phase), histogram\
+                    in sorted(self._histograms.items()):
+                entry = {'rpc': rpc_name,
+                         'module': module_name,
+                         'phase': phase,
+                         'count': histogram.count,
+                         'sum': histogram.sum,
+                         'max': histogram.max}
+                for q in QUANTILES:
+                    entry['p{}'.format(int(q*100))] = histogram.quantile(q)
+                series.append(entry)
+
+            errors = [{'rpc': rpc_name, 'module': module_name,
+                       'count': count}
+                      for (rpc_name, module_name), count
+                      in sorted(self._errors.items())]
+
+        return {'latency': series, 'errors': errors}
+
+    def render_text(self):
+        """Plain text metrics, one sample per line
+        """
+        stats = self.get_stats()
+        lines = ['# TYPE ppagg_rpc_seconds summary']
+        for entry in stats['latency']:
+            labels = 'rpc="{}",module="{}",phase="{}"'\
+                .format(_escape_label(entry['rpc']),
+                        _escape_label(entry['module']),
+                        entry['phase'])
+            for q in QUANTILES:
+                lines.append('ppagg_rpc_seconds{{{},quantile="{}"}} {:.6f}'
+                             .format(labels, q,
+                                     entry['p{}'.format(int(q*100))]))
+            lines.append('ppagg_rpc_seconds_sum{{{}}} {:.6f}'
+                         .format(labels, entry['sum']))
+            lines.append('ppagg_rpc_seconds_count{{{}}} {}'
+                         .format(labels, entry['count']))
+
+        lines.append('# TYPE ppagg_rpc_errors_total counter')
+        for entry in stats['errors']:
+            lines.append('ppagg_rpc_errors_total{{rpc="{}",module="{}"}} {}'
+                         .format(_escape_label(entry['rpc']),
+                                 _escape_label(entry['module']),
+                                 entry['count']))
+
+        return ('\n'.join(lines) + '\n').encode('utf-8')
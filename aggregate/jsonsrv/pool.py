@@ -0,0 +1,395 @@
+import json
+import logging
+import queue
+import selectors
+import socket
+import threading
+import time
+from urllib.parse import urlsplit
+from aggregate.util.thread import StoppableThread
+from aggregate.events import (format_sse,
+                              parse_subscription_query,
+                              KEEPALIVE_INTERVAL)
+from aggregate.jsonsrv.metrics import (METRICS_CONTENT_TYPE,
+                                       PHASE_QUEUE,
+                                       SERVER_RPC)
+from aggregate.jsonsrv.dispatch import INTROSPECTION_PATH
+from aggregate.jsonsrv.httputil import (HttpRequestError,
+                                        MAX_HEAD_SIZE,
+                                        SSE_RESPONSE_HEAD,
+                                        build_http_response,
+                                        build_introspection_response,
+                                        build_rpc_response,
+                                        parse_request_head,
+                                        request_content_length,
+                                        request_keep_alive)
+
+RECV_SIZE = 65536
+SERVER_BUSY = -32000
+
+_BUSY_RESPONSE =\
+    build_http_response(503,
+                        json.dumps({'jsonrpc': '2.0',
+                                    'error': {'code': SERVER_BUSY,
+                                              'message': 'Server busy'},
+                                    'id': None}).encode(),
+                        keep_alive=False)
+
+
+class _Connection(object):
+    """Client connection with its own receive buffer, so pipelined
+       requests survive between workers
+    """
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+        self.buffer = bytearray()
+        self.last_active = time.monotonic()
+        self.queued_at = None
+
+    def _fill(self):
+        data = self.sock.recv(RECV_SIZE)
+        if not data:
+            raise ConnectionError('connection closed by peer')
+        self.buffer += data
+
+    def read_request(self):
+        """Read one request, returns (method, path, headers, body,
+           keep_alive) or None if the peer closed an idle connection
+        """
+        while True:
+            end = self.buffer.find(b'\r\n\r\n')
+            if end >= 0:
+                break
+            if len(self.buffer) > MAX_HEAD_SIZE:
+                raise HttpRequestError(400)
+            try:
+                self._fill()
+            except ConnectionError:
+                if self.buffer:
+                    raise
+                return None
+
+        head = bytes(self.buffer[:end]).decode('latin-1')
+        del self.buffer[:end+4]
+        method, path, version, headers = parse_request_head(head)
+
+        length = request_content_length(headers)
+        while len(self.buffer) < length:
+            self._fill()
+        body = bytes(self.buffer[:length])
+        del self.buffer[:length]
+
+        return method, path, headers, body, request_keep_alive(version,
+                                                               headers)
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class PooledJsonRpcServer(StoppableThread):
+    """JSON RPC over HTTP/1.1 served by a fixed pool of workers
+
+       Idle keep-alive connections are parked in a selector and only
+       occupy a worker while a request is being processed. Ready
+       requests wait in a bounded queue; when it is full the client
+       gets an immediate "busy" error. stop() stops accepting, lets the
+       workers finish what is queued and then closes every connection.
+    """
+    def __init__(self, dispatcher, address='', port=8080, workers=8,
+                 queue_size=64, max_connections=256, max_streams=32,
+                 keepalive_timeout=30, request_timeout=10,
+                 event_hub=None, root_logger='ppagg'):
+        super(PooledJsonRpcServer, self).__init__()
+        self.dispatcher = dispatcher
+        self.address = address
+        self.port = port
+        self.keepalive_timeout = keepalive_timeout
+        self.request_timeout = request_timeout
+        self.max_connections = max_connections
+        self.event_hub = event_hub
+        self.logger = logging.getLogger('{}.jsonsrv'.format(root_logger))
+
+        self.requests = queue.Queue(maxsize=queue_size)
+        self.workers = [threading.Thread(target=self._worker)
+                        for _ in range(workers)]
+        self._streams = threading.BoundedSemaphore(max_streams)
+
+        self._selector = selectors.DefaultSelector()
+        self._parked = set()
+        self._returned = queue.SimpleQueue()
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._wakeup_recv.setblocking(False)
+        self._open_connections = 0
+        self._lock = threading.Lock()
+
+        # statistics
+        self.served = 0
+        self.rejected = 0
+
+    def stop(self):
+        super(PooledJsonRpcServer, self).stop()
+        self._wakeup()
+
+    def _wakeup(self):
+        try:
+            self._wakeup_send.send(b'\0')
+        except OSError:
+            pass
+
+    def get_stats(self):
+        with self._lock:
+            return {'workers': len(self.workers),
+                    'queued': self.requests.qsize(),
+                    'connections': self._open_connections,
+                    'served': self.served,
+                    'rejected': self.rejected}
+
+    def run(self):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((self.address, self.port))
+        listener.listen(128)
+        listener.setblocking(False)
+
+        self._selector.register(listener, selectors.EVENT_READ)
+        self._selector.register(self._wakeup_recv, selectors.EVENT_READ)
+
+        for worker in self.workers:
+            worker.start()
+
+        while not self.is_stopped():
+            for key, _ in self._selector.select(timeout=1):
+                if key.fileobj is listener:
+                    self._accept(listener)
+                elif key.fileobj is self._wakeup_recv:
+                    self._drain_wakeup()
+                else:
+                    self._unpark(key.data)
+                    self._dispatch(key.data)
+
+            self._collect_returned()
+            self._expire_idle()
+
+        # graceful drain: no new connections, finish queued requests
+        self._selector.unregister(listener)
+        listener.close()
+        for conn in list(self._parked):
+            self._unpark(conn)
+            self._close(conn)
+
+        for _ in self.workers:
+            self.requests.put(None)
+        for worker in self.workers:
+            worker.join()
+
+        self._collect_returned()
+        self._selector.close()
+        self._wakeup_recv.close()
+        self._wakeup_send.close()
+
+    def _accept(self, listener):
+        while True:
+            try:
+                sock, address = listener.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+
+            sock.setblocking(True)
+            sock.settimeout(self.request_timeout)
+            conn = _Connection(sock, address)
+            with self._lock:
+                over_limit = self._open_connections >= self.max_connections
+                if not over_limit:
+                    self._open_connections += 1
+
+            if over_limit:
+                self._reject(conn, count_open=False)
+                continue
+
+            self._park(conn)
+
+    def _drain_wakeup(self):
+        try:
+            while self._wakeup_recv.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+
+    def _park(self, conn):
+        conn.last_active = time.monotonic()
+        self._parked.add(conn)
+        self._selector.register(conn.sock, selectors.EVENT_READ, conn)
+
+    def _unpark(self, conn):
+        self._parked.discard(conn)
+        self._selector.unregister(conn.sock)
+
+    def _dispatch(self, conn):
+        conn.queued_at = time.perf_counter()
+        try:
+            self.requests.put_nowait(conn)
+        except queue.Full:
+            self._reject(conn)
+
+    def _reject(self, conn, count_open=True):
+        with self._lock:
+            self.rejected += 1
+        try:
+            conn.sock.sendall(_BUSY_RESPONSE)
+        except OSError:
+            pass
+
+        if count_open:
+            self._close(conn)
+        else:
+            conn.close()
+
+    def _close(self, conn):
+        conn.close()
+        with self._lock:
+            self._open_connections -= 1
+
+    def _collect_returned(self):
+        while True:
+            try:
+                conn = self._returned.get_nowait()
+            except queue.Empty:
+                return
+
+            if self.is_stopped():
+                self._close(conn)
+            elif conn.buffer:
+                # pipelined request already received
+                self._dispatch(conn)
+            else:
+                self._park(conn)
+
+    def _expire_idle(self):
+        deadline = time.monotonic() - self.keepalive_timeout
+        for conn in [conn for conn in self._parked
+                     if conn.last_active < deadline]:
+            self._unpark(conn)
+            self._close(conn)
+
+    def _worker(self):
+        while True:
+            conn = self.requests.get()
+            if conn is None:
+                return
+
+            if self.dispatcher.metrics is not None:
+                self.dispatcher.metrics.observe(SERVER_RPC, '', PHASE_QUEUE,
+                                                time.perf_counter() -
+                                                conn.queued_at)
+
+            try:
+                keep_alive = self._serve_request(conn)
+            except Exception:
+                self.logger.exception('error while serving request')
+                keep_alive = False
+
+            if keep_alive is None:
+                # handed over to an event stream
+                continue
+
+            if keep_alive and not self.is_stopped():
+                self._returned.put(conn)
+                self._wakeup()
+            else:
+                self._close(conn)
+
+    def _serve_request(self, conn):
+        """Serve one request, returns whether the connection is kept,
+           or None if it was handed over
+        """
+        try:
+            request = conn.read_request()
+        except HttpRequestError as e:
+            self._send(conn, build_http_response(e.status, keep_alive=False))
+            return False
+        except OSError:
+            return False
+
+        if request is None:
+            return False
+
+        method, path, headers, body, keep_alive = request
+        url = urlsplit(path)
+        if method == 'GET' and url.path == '/events':
+            return self._start_stream(conn, url.query)
+
+        metrics = self.dispatcher.metrics
+        if method == 'GET' and url.path == '/metrics' and metrics is not None:
+            response = build_http_response(200, metrics.render_text(),
+                                           keep_alive,
+                                           content_type=METRICS_CONTENT_TYPE)
+        elif method == 'GET' and url.path.startswith(INTROSPECTION_PATH):
+            status, data, etag =\
+                self.dispatcher.handle_introspection(url.path,
+                                                     headers.get('if-none-match'))
+            response = build_introspection_response(status, data, etag,
+                                                    keep_alive)
+        elif method != 'POST':
+            response = build_http_response(405, keep_alive=keep_alive)
+        else:
+            data, etag = self.dispatcher.handle_http(body)
+            response = build_rpc_response(data, etag, keep_alive)
+
+        with self._lock:
+            self.served += 1
+
+        if not self._send(conn, response):
+            return False
+
+        return keep_alive
+
+    def _send(self, conn, data):
+        try:
+            conn.sock.sendall(data)
+        except OSError:
+            return False
+
+        return True
+
+    def _start_stream(self, conn, query):
+        if self.event_hub is None:
+            self._send(conn, build_http_response(404, keep_alive=False))
+            return False
+
+        try:
+            filters = parse_subscription_query(query)
+        except ValueError:
+            self._send(conn, build_http_response(400, keep_alive=False))
+            return False
+
+        # event streams are long lived, keep them off the worker pool
+        if not self._streams.acquire(blocking=False):
+            self._reject(conn)
+            return None
+
+        stream = threading.Thread(target=self._stream_events,
+                                  args=(conn, filters))
+        stream.daemon = True
+        stream.start()
+        return None
+
+    def _stream_events(self, conn, filters):
+        sub = self.event_hub.subscribe(**filters)
+        try:
+            conn.sock.sendall(SSE_RESPONSE_HEAD)
+            while not self.is_stopped() and not sub.overflowed:
+                event = sub.get(KEEPALIVE_INTERVAL)
+                if event is None:
+                    conn.sock.sendall(b': keepalive\n\n')
+                else:
+                    conn.sock.sendall(format_sse(event))
+        except OSError:
+            pass
+        finally:
+            self.event_hub.unsubscribe(sub)
+            self._streams.release()
+            self._close(conn)
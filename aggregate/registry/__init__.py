@@ -0,0 +1,96 @@
+import json
+import logging
+import os
+import threading
+
+REGISTRY_VERSION = 1
+
+
+class DeviceRegistry(object):
+    """Persistent snapshot of discovered devices
+
+       Entries are grouped by kind (mdns, ssdp, ppnode, ...) and keyed
+       by a string; values must be JSON serializable. The snapshot is
+       rewritten atomically on save.
+    """
+    def __init__(self, path, root_logger='ppagg'):
+        self.path = path
+        self.logger = logging.getLogger('{}.registry'.format(root_logger))
+        self.entries = {}
+        self.dirty = False
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Load snapshot from disk, a missing or damaged file yields
+           an empty registry
+        """
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            self.logger.warning('could not read registry "{}": {}'
+                                .format(self.path, e))
+            return
+
+        if not isinstance(data, dict) or\
+           data.get('version') != REGISTRY_VERSION:
+            self.logger.warning('discarding incompatible registry "{}"'
+                                .format(self.path))
+            return
+
+        with self._lock:
+            self.entries = data.get('entries', {})
+            self.dirty = False
+
+        self.logger.info('loaded {} registry entries'
+                         .format(sum([len(e)
+                                      for e in self.entries.values()])))
+
+    def save(self):
+        """Write snapshot if anything changed since the last save
+        """
+        with self._lock:
+            if not self.dirty:
+                return
+            data = json.dumps({'version': REGISTRY_VERSION,
+                               'entries': self.entries},
+                              separators=(',', ':'))
+            self.dirty = False
+
+        tmp_path = '{}.tmp'.format(self.path)
+        try:
+            with open(tmp_path, 'w') as f:
+                f.write(data)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            self.logger.warning('could not write registry "{}": {}'
+                                .format(self.path, e))
+            with self._lock:
+                self.dirty = True
+
+    def get(self, kind, key):
+        with self._lock:
+            return self.entries.get(kind, {}).get(key)
+
+    def items(self, kind):
+        with self._lock:
+            return list(self.entries.get(kind, {}).items())
+
+    def put(self, kind, key, value):
+        with self._lock:
+            kind_entries = self.entries.setdefault(kind, {})
+            if kind_entries.get(key) == value:
+                return False
+            kind_entries[key] = value
+            self.dirty = True
+            return True
+
+    def remove(self, kind, key):
+        with self._lock:
+            if key not in self.entries.get(kind, {}):
+                return False
+            del self.entries[kind][key]
+            self.dirty = True
+            return True
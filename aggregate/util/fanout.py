@@ -0,0 +1,34 @@
+from collections import OrderedDict
+
+
+def run_grouped(executor, items, group_key, call):
+    """Run call(item) for every item, concurrently across groups and in
+       order within each group; returns the results in item order
+
+       group_key(index, item) selects the group of an item. call must
+       not raise, errors are expected to be part of its return value.
+       The first group runs in the calling thread.
+    """
+    groups = OrderedDict()
+    for index, item in enumerate(items):
+        groups.setdefault(group_key(index, item), []).append(index)
+
+    results = [None]*len(items)
+
+    def _run_group(indices):
+        for index in indices:
+            results[index] = call(items[index])
+
+    group_list = list(groups.values())
+    if executor is None or len(group_list) < 2:
+        for indices in group_list:
+            _run_group(indices)
+        return results
+
+    futures = [executor.submit(_run_group, indices)
+               for indices in group_list[1:]]
+    _run_group(group_list[0])
+    for future in futures:
+        future.result()
+
+    return results
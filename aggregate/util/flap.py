@@ -0,0 +1,149 @@
+import logging
+import threading
+import time
+from collections import deque
+
+# seconds a removed service has to come back before its driver unloads
+REMOVAL_GRACE = 15
+# services that came back within this many seconds count as flapping
+FLAP_WINDOW = 300
+# the grace period doubles per recent flap, up to this factor
+MAX_GRACE_FACTOR = 8
+
+
+class FlapSuppressor(object):
+    """Grace period between discovery removals and driver unloads
+
+       Removals are held back for a grace period; a service that comes
+       back in the meantime with the same address keeps its driver
+       instance and the removal is dropped. Services that keep flapping
+       get a longer grace period each time they come back, until they
+       stay up for a whole flap window.
+    """
+    def __init__(self, scheduler, grace=REMOVAL_GRACE,
+                 flap_window=FLAP_WINDOW, max_factor=MAX_GRACE_FACTOR,
+                 root_logger='ppagg', clock=time.monotonic):
+        self.scheduler = scheduler
+        self.grace = grace
+        self.flap_window = flap_window
+        self.max_factor = max_factor
+        self.clock = clock
+        self.logger = logging.getLogger('{}.flap'.format(root_logger))
+
+        # key -> (job id, commit callback, service)
+        self._pending = {}
+        # key -> times the service came back during its grace period
+        self._flaps = {}
+        self._lock = threading.Lock()
+
+        self.suppressed = 0
+        self.committed = 0
+        self.moved = 0
+
+    def _recent_flaps(self, key, now):
+        # caller holds the lock
+        flaps = self._flaps.get(key)
+        if flaps is None:
+            return 0
+
+        while flaps and now - flaps[0] > self.flap_window:
+            flaps.popleft()
+        if not flaps:
+            del self._flaps[key]
+            return 0
+
+        return len(flaps)
+
+    def _grace_period(self, key, now):
+        # caller holds the lock
+        factor = min(2 ** self._recent_flaps(key, now), self.max_factor)
+        return self.grace * factor
+
+    def removed(self, key, commit, service=None):
+        """Hold back a removal, commit is called when the grace period
+           ends without the service coming back
+        """
+        if self.grace <= 0:
+            with self._lock:
+                self.committed += 1
+            commit()
+            return
+
+        with self._lock:
+            # a repeated removal does not extend the grace period
+            if key in self._pending:
+                return
+
+            grace = self._grace_period(key, self.clock())
+            job_id = self.scheduler.schedule_oneshot(grace, self._expired,
+                                                     key=key)
+            self._pending[key] = (job_id, commit, service)
+
+        self.logger.debug('removal of {} held back for {} s'
+                          .format(key, grace))
+
+    def returned(self, key, service, fields=()):
+        """A service was discovered again, returns True if its removal
+           was pending and got dropped. If any of fields changed, the
+           removal is committed right away and False is returned.
+        """
+        with self._lock:
+            entry = self._pending.pop(key, None)
+            if entry is None:
+                return False
+
+            job_id, commit, known = entry
+            self.scheduler.cancel(job_id)
+            moved = known is not None and\
+                any([known.get(field) != service.get(field)
+                     for field in fields])
+            if moved:
+                self.moved += 1
+                self.committed += 1
+            else:
+                self.suppressed += 1
+                self._flaps.setdefault(key, deque()).append(self.clock())
+
+        if moved:
+            self.logger.debug('{} came back elsewhere, removing'.format(key))
+            commit()
+            return False
+
+        self.logger.info('{} came back, keeping its driver'.format(key))
+        return True
+
+    def _expired(self, key):
+        with self._lock:
+            entry = self._pending.pop(key, None)
+            if entry is None:
+                return
+            self.committed += 1
+
+        entry[1]()
+
+    def flush(self):
+        """Commit every pending removal now
+        """
+        with self._lock:
+            pending = list(self._pending.values())
+            self._pending.clear()
+            self.committed += len(pending)
+
+        for job_id, commit, _ in pending:
+            self.scheduler.cancel(job_id)
+            commit()
+
+    def get_stats(self):
+        with self._lock:
+            now = self.clock()
+            flapping = {}
+            for key in list(self._flaps):
+                count = self._recent_flaps(key, now)
+                if count:
+                    flapping[key] = count
+
+            return {'suppressed': self.suppressed,
+                    'committed': self.committed,
+                    'moved': self.moved,
+                    'pending': len(self._pending),
+                    'flapping': flapping}
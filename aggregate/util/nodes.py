@@ -0,0 +1,130 @@
+import copy
+import threading
+from collections import deque
+
+MAX_CHANGES = 4096
+
+
+class NodeTable(object):
+    """Active node table with a monotonically increasing version
+
+       Every add, change and removal bumps the version; serialized
+       node dictionaries are cached until the node changes, so that
+       clients can fetch only what changed since a version they saw.
+       The last max_changes changes are kept in version order.
+    """
+    def __init__(self, max_changes=MAX_CHANGES):
+        self.version = 0
+        self._nodes = {}
+        self._added = {}
+        self._changes = deque()
+        self._serialized = {}
+        self._max_changes = max_changes
+        # oldest version from which changes are still known
+        self._horizon = 0
+        self._lock = threading.Lock()
+
+    def __contains__(self, node_name):
+        return node_name in self._nodes
+
+    def __getitem__(self, node_name):
+        return self._nodes[node_name]
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def keys(self):
+        return list(self._nodes.keys())
+
+    def items(self):
+        return list(self._nodes.items())
+
+    def add(self, node_name, node):
+        with self._lock:
+            self.version += 1
+            self._nodes[node_name] = node
+            self._added[node_name] = self.version
+            self._log_change(node_name)
+
+    def touch(self, node_name):
+        """Mark a node as changed
+        """
+        with self._lock:
+            if node_name not in self._nodes:
+                return False
+            self.version += 1
+            self._log_change(node_name)
+            return True
+
+    def remove(self, node_name):
+        with self._lock:
+            if node_name not in self._nodes:
+                return False
+            self.version += 1
+            del self._nodes[node_name]
+            del self._added[node_name]
+            self._log_change(node_name)
+            return True
+
+    def _log_change(self, node_name):
+        # caller holds the lock and has bumped the version
+        self._serialized.pop((node_name, True), None)
+        self._serialized.pop((node_name, False), None)
+        self._changes.append((self.version, node_name))
+        while len(self._changes) > self._max_changes:
+            self._horizon, _ = self._changes.popleft()
+
+    def _get_serialized(self, node_name, simple):
+        # caller holds the lock
+        key = (node_name, simple)
+        if key not in self._serialized:
+            # detached from the node's own service and driver tables
+            self._serialized[key] =\
+                copy.deepcopy(self._nodes[node_name]
+                              .get_serializable_dict(simple))
+        return self._serialized[key]
+
+    def serialize(self, simple=True):
+        """Serializable dictionary of every node
+        """
+        with self._lock:
+            return dict([(node_name, self._get_serialized(node_name, simple))
+                         for node_name in self._nodes])
+
+    def changes_since(self, version, simple=True):
+        """Nodes added, changed and removed after version; if changes
+           that old are no longer known the full table is returned
+           with "full" set
+        """
+        with self._lock:
+            full = version < self._horizon or version > self.version
+            added = {}
+            changed = {}
+            removed = []
+            if full:
+                for node_name in self._nodes:
+                    added[node_name] = self._get_serialized(node_name, simple)
+            else:
+                # walk back through the changes made after version only
+                seen = set()
+                for change_version, node_name in reversed(self._changes):
+                    if change_version <= version:
+                        break
+                    if node_name in seen:
+                        continue
+                    seen.add(node_name)
+                    if node_name not in self._nodes:
+                        removed.append(node_name)
+                    elif self._added[node_name] > version:
+                        added[node_name] =\
+                            self._get_serialized(node_name, simple)
+                    else:
+                        changed[node_name] =\
+                            self._get_serialized(node_name, simple)
+                removed.reverse()
+
+            return {'version': self.version,
+                    'full': full,
+                    'added': added,
+                    'changed': changed,
+                    'removed': removed}
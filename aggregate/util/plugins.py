@@ -0,0 +1,144 @@
+import hashlib
+import importlib
+import inspect
+import os
+import sys
+
+
+def fingerprint_plugin(plugin_dir):
+    """Content hash of every file in a plugin package
+    """
+    digest = hashlib.sha1()
+    for root, dirs, files in os.walk(plugin_dir):
+        dirs[:] = sorted([d for d in dirs if d != '__pycache__'])
+        for file_name in sorted(files):
+            if file_name.endswith(('.pyc', '.pyo')):
+                continue
+            file_path = os.path.join(root, file_name)
+            digest.update(os.path.relpath(file_path, plugin_dir).encode())
+            with open(file_path, 'rb') as f:
+                digest.update(f.read())
+
+    return digest.hexdigest()
+
+
+def fingerprint_plugins(plugin_root):
+    """Fingerprint every plugin package under plugin_root
+    """
+    ret = {}
+    for name in sorted(os.listdir(plugin_root)):
+        plugin_dir = os.path.join(plugin_root, name)
+        if os.path.isfile(os.path.join(plugin_dir, '__init__.py')):
+            ret[name] = fingerprint_plugin(plugin_dir)
+
+    return ret
+
+
+def purge_plugin_modules(plugin_root, plugin_names):
+    """Drop every imported module that lives inside the given plugins
+       so that the next import executes the current code
+    """
+    plugin_dirs = [os.path.join(os.path.abspath(plugin_root), name) + os.sep
+                   for name in plugin_names]
+    purged = []
+    for mod_name, module in list(sys.modules.items()):
+        mod_file = getattr(module, '__file__', None)
+        if mod_file is None:
+            continue
+        mod_file = os.path.abspath(mod_file)
+        if any([mod_file.startswith(d) for d in plugin_dirs]):
+            del sys.modules[mod_name]
+            purged.append(mod_name)
+
+    importlib.invalidate_caches()
+    return purged
+
+
+def plugin_of_file(plugin_root, file_name):
+    """Name of the plugin package a file belongs to, None if it is not
+       inside plugin_root
+    """
+    plugin_root = os.path.abspath(plugin_root) + os.sep
+    file_name = os.path.abspath(file_name)
+    if not file_name.startswith(plugin_root):
+        return None
+
+    parts = os.path.relpath(file_name, plugin_root).split(os.sep)
+    return parts[0] if len(parts) > 1 else None
+
+
+def plugin_of(obj, plugin_root):
+    """Name of the plugin package defining a class, None if unknown
+    """
+    try:
+        return plugin_of_file(plugin_root, inspect.getfile(obj))
+    except TypeError:
+        return None
+
+
+def calling_plugin(plugin_root):
+    """Name of the innermost plugin package on the call stack, None if
+       the call does not come from a plugin
+    """
+    frame = sys._getframe(1)
+    while frame is not None:
+        name = plugin_of_file(plugin_root, frame.f_code.co_filename)
+        if name is not None:
+            return name
+        frame = frame.f_back
+
+    return None
+
+
+def plugin_instances(drvman, plugin_root, plugin_names):
+    """Ids of the loaded driver instances whose class comes from one
+       of the given plugins
+    """
+    return [instance_id for instance_id, instance
+            in list(drvman.loaded_modules.items())
+            if plugin_of(type(instance), plugin_root) in plugin_names]
+
+
+def forget_plugins(drvman, plugin_root, plugin_names):
+    """Drop the driver classes of the given plugins from the module
+       manager
+    """
+    for driver_name, driver_class in list(drvman.found_modules.items()):
+        if plugin_of(driver_class, plugin_root) in plugin_names:
+            del drvman.found_modules[driver_name]
+
+
+def discover_plugin(drvman, plugin_package, plugin_root, plugin_name):
+    """Import one plugin package and register its driver class, like
+       ModuleManager.discover_modules does for every plugin
+    """
+    module = importlib.import_module('{}.{}'.format(plugin_package,
+                                                    plugin_name))
+    driver_class =\
+        module.discover_module(modman=drvman,
+                               plugin_path=os.path.join(plugin_root,
+                                                        plugin_name))
+    drvman.found_modules[driver_class._module_desc.arg_name] = driver_class
+    return driver_class
+
+
+class PluginWatcher(object):
+    """Tracks plugin package contents between reloads
+    """
+    def __init__(self, plugin_package):
+        package = importlib.import_module(plugin_package)
+        self.plugin_package = plugin_package
+        self.plugin_root = os.path.dirname(os.path.abspath(package.__file__))
+        self.fingerprints = fingerprint_plugins(self.plugin_root)
+
+    def scan(self):
+        """Rescan plugins, returns (added, changed, removed) name sets
+        """
+        current = fingerprint_plugins(self.plugin_root)
+        added = set(current) - set(self.fingerprints)
+        removed = set(self.fingerprints) - set(current)
+        changed = set([name for name in set(current) & set(self.fingerprints)
+                       if current[name] != self.fingerprints[name]])
+        self.fingerprints = current
+
+        return added, changed, removed
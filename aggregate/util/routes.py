@@ -0,0 +1,193 @@
+import itertools
+import threading
+
+# criteria plugins may declare per discovery hook:
+# name -> (service field, exact match or prefix match)
+ROUTE_CRITERIA = {'ppagg.ssdp_discovered': {'st': ('ST', False),
+                                            'usn_prefix': ('USN', True)},
+                  'ppagg.node_discovered': {'kind': ('kind', False),
+                                            'name_prefix': ('name', True)}}
+
+# service field identifying the instance to remove per removal hook
+REMOVAL_KEYS = {'ppagg.ssdp_removed': 'USN',
+                'ppagg.node_removed': 'name'}
+
+
+class DiscoveryRouteError(Exception):
+    pass
+
+
+class _FieldIndex(object):
+    """Route ids by exact value or by prefix of one service field
+    """
+    def __init__(self):
+        self.exact = {}
+        self.prefixes = {}
+        self.prefix_lengths = set()
+
+    def add(self, value, prefix, route_id):
+        if prefix:
+            self.prefixes.setdefault(value, []).append(route_id)
+            self.prefix_lengths.add(len(value))
+        else:
+            self.exact.setdefault(value, []).append(route_id)
+
+    def lookup(self, value):
+        ret = list(self.exact.get(value, []))
+        for length in self.prefix_lengths:
+            ret.extend(self.prefixes.get(value[:length], []))
+        return ret
+
+    def discard(self, route_ids):
+        for table in (self.exact, self.prefixes):
+            for value in list(table):
+                table[value] = [route_id for route_id in table[value]
+                                if route_id not in route_ids]
+                if not table[value]:
+                    del table[value]
+        self.prefix_lengths = set([len(value) for value in self.prefixes])
+
+
+class DiscoveryRoutes(object):
+    """Index of the discovery criteria plugins declare
+
+       Every route gets a hook of its own, so a discovery event only
+       reaches the plugins whose criteria match instead of every
+       callback attached to the shared hook. Removal hooks are keyed
+       by USN or mDNS name so only the affected instance is called, and
+       are dropped once the instances attached to them are unloaded.
+       Routes remember the plugin that added them, so that they can be
+       retired when it is reloaded.
+    """
+    def __init__(self):
+        # route id -> (hook, checks, owner), None once retired
+        self._routes = []
+        self._indexes = {}
+        # (hook, key) -> (routed hook, owner, attached instances)
+        self._removal_hooks = {}
+        # removal hooks are never reused, old callbacks may be attached
+        self._removal_ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def add_route(self, hook_name, owner=None, **criteria):
+        """Register criteria for a discovery hook, returns the name of
+           the hook to attach to
+        """
+        if hook_name not in ROUTE_CRITERIA:
+            raise DiscoveryRouteError('cannot route hook "{}"'
+                                      .format(hook_name))
+
+        if not criteria:
+            raise DiscoveryRouteError('no criteria given')
+
+        allowed = ROUTE_CRITERIA[hook_name]
+        for name in criteria:
+            if name not in allowed:
+                raise DiscoveryRouteError('invalid criterion for "{}": "{}"'
+                                          .format(hook_name, name))
+
+        with self._lock:
+            route_id = len(self._routes)
+            routed_hook = '{}#{}'.format(hook_name, route_id)
+            checks = []
+            for name, value in criteria.items():
+                field, prefix = allowed[name]
+                checks.append((field, value, prefix))
+                self._indexes.setdefault((hook_name, field),
+                                         _FieldIndex()).add(value, prefix,
+                                                            route_id)
+            self._routes.append((routed_hook, checks, owner))
+
+        return routed_hook
+
+    def add_removal_route(self, hook_name, key, owner=None, instance=None):
+        """Returns (name of the removal hook for key, whether it is new)
+        """
+        if hook_name not in REMOVAL_KEYS:
+            raise DiscoveryRouteError('cannot route hook "{}"'
+                                      .format(hook_name))
+
+        with self._lock:
+            entry = self._removal_hooks.get((hook_name, key))
+            new = entry is None
+            if new:
+                routed_hook = '{}[{}]#{}'.format(hook_name, key,
+                                                 next(self._removal_ids))
+                entry = (routed_hook, owner, set())
+                self._removal_hooks[(hook_name, key)] = entry
+            if instance is not None:
+                entry[2].add(instance)
+            return entry[0], new
+
+    def forget_instances(self, loaded):
+        """Drop the removal hooks whose instances are all unloaded,
+           returns their names
+        """
+        with self._lock:
+            hooks = []
+            for removal_key, (routed_hook, owner, instances) in\
+                    list(self._removal_hooks.items()):
+                if instances and not instances & set(loaded):
+                    hooks.append(routed_hook)
+                    del self._removal_hooks[removal_key]
+
+        return hooks
+
+    def retire(self, owners):
+        """Drop the routes added by the given plugins, returns the names
+           of their hooks, which are not triggered anymore
+        """
+        with self._lock:
+            retired = set()
+            hooks = []
+            for route_id, route in enumerate(self._routes):
+                if route is not None and route[2] in owners:
+                    retired.add(route_id)
+                    hooks.append(route[0])
+                    self._routes[route_id] = None
+            for index in self._indexes.values():
+                index.discard(retired)
+
+            for removal_key, (routed_hook, owner, _) in\
+                    list(self._removal_hooks.items()):
+                if owner in owners:
+                    hooks.append(routed_hook)
+                    del self._removal_hooks[removal_key]
+
+        return hooks
+
+    @staticmethod
+    def _check(service, checks):
+        for field, value, prefix in checks:
+            actual = service.get(field)
+            if not isinstance(actual, str):
+                return False
+            if (prefix and not actual.startswith(value)) or\
+               (not prefix and actual != value):
+                return False
+        return True
+
+    def match(self, hook_name, service, owners=None):
+        """Names of the routed hooks to trigger for an event, only of
+           routes added by owners if given
+        """
+        with self._lock:
+            if hook_name in REMOVAL_KEYS:
+                key = service.get(REMOVAL_KEYS[hook_name])
+                entry = self._removal_hooks.get((hook_name, key))
+                if entry is None or\
+                   (owners is not None and entry[1] not in owners):
+                    return []
+                return [entry[0]]
+
+            candidates = set()
+            for field, _ in ROUTE_CRITERIA.get(hook_name, {}).values():
+                index = self._indexes.get((hook_name, field))
+                value = service.get(field)
+                if index is not None and isinstance(value, str):
+                    candidates.update(index.lookup(value))
+
+            routes = [self._routes[route_id] for route_id in sorted(candidates)]
+            return [route[0] for route in routes
+                    if (owners is None or route[2] in owners) and
+                    self._check(service, route[1])]
@@ -0,0 +1,151 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+
+class TickScheduler(object):
+    """Deadline scheduler for module ticks
+
+       Jobs are kept in a heap ordered by deadline; the run loop sleeps
+       until the earliest deadline (or indefinitely when nothing is
+       scheduled) and is woken up whenever the schedule changes.
+    """
+    def __init__(self, root_logger='ppagg', clock=time.monotonic):
+        self.clock = clock
+        self.logger = logging.getLogger('{}.sched'.format(root_logger))
+
+        self._heap = []
+        self._jobs = {}
+        self._job_ids = itertools.count(1)
+        self._cond = threading.Condition()
+        self._stopped = False
+
+        # optional callable notified when the earliest deadline changes,
+        # used by loops that drive the scheduler externally
+        self.wakeup_cb = None
+
+    def _push(self, job_id, deadline):
+        # caller holds the lock
+        job = self._jobs[job_id]
+        job['deadline'] = deadline
+        heapq.heappush(self._heap, (deadline, job_id))
+        if self._heap[0][1] == job_id:
+            self._cond.notify()
+            if self.wakeup_cb is not None:
+                self.wakeup_cb()
+
+    def _add_job(self, delay, interval, callback, kwargs):
+        if delay < 0:
+            raise ValueError('negative delay')
+
+        with self._cond:
+            job_id = next(self._job_ids)
+            self._jobs[job_id] = {'callback': callback,
+                                  'interval': interval,
+                                  'kwargs': kwargs,
+                                  'deadline': None}
+            self._push(job_id, self.clock() + delay)
+
+        return job_id
+
+    def schedule_periodic(self, interval, callback, **kwargs):
+        """Call callback every interval seconds, returns a job id
+        """
+        if interval <= 0:
+            raise ValueError('interval must be positive')
+
+        return self._add_job(interval, interval, callback, kwargs)
+
+    def schedule_oneshot(self, delay, callback, **kwargs):
+        """Call callback once after delay seconds, returns a job id
+        """
+        return self._add_job(delay, None, callback, kwargs)
+
+    def cancel(self, job_id):
+        """Cancel a job, stale heap entries are discarded lazily
+        """
+        with self._cond:
+            if job_id not in self._jobs:
+                return False
+
+            del self._jobs[job_id]
+            return True
+
+    def next_deadline(self):
+        """Earliest pending deadline or None if idle
+        """
+        with self._cond:
+            self._discard_stale()
+            if not self._heap:
+                return None
+            return self._heap[0][0]
+
+    def _discard_stale(self):
+        # caller holds the lock
+        while self._heap:
+            deadline, job_id = self._heap[0]
+            job = self._jobs.get(job_id)
+            if job is not None and job['deadline'] == deadline:
+                break
+            heapq.heappop(self._heap)
+
+    def run_pending(self):
+        """Run every job that is due, returns delay until next deadline
+           or None if there is nothing scheduled
+        """
+        while True:
+            with self._cond:
+                self._discard_stale()
+                if not self._heap:
+                    return None
+
+                now = self.clock()
+                deadline, job_id = self._heap[0]
+                if deadline > now:
+                    return deadline - now
+
+                heapq.heappop(self._heap)
+                job = self._jobs[job_id]
+                if job['interval'] is None:
+                    del self._jobs[job_id]
+                else:
+                    # skip missed periods instead of bursting to catch up
+                    next_deadline = deadline + job['interval']
+                    if next_deadline <= now:
+                        next_deadline = now + job['interval']
+                    self._push(job_id, next_deadline)
+
+            try:
+                job['callback'](**job['kwargs'])
+            except Exception:
+                self.logger.exception('error in scheduled job {}'
+                                      .format(job_id))
+
+    def run(self):
+        """Run jobs until stopped, sleeping until the next deadline
+        """
+        while True:
+            self.run_pending()
+            with self._cond:
+                if self._stopped:
+                    return
+
+                # re-check under the lock, a job may have been added
+                self._discard_stale()
+                if self._heap:
+                    delay = max(self._heap[0][0] - self.clock(), 0)
+                else:
+                    delay = None
+
+                if delay is None or delay > 0:
+                    self._cond.wait(delay)
+
+                if self._stopped:
+                    return
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
@@ -0,0 +1,74 @@
+import re
+
+SSDP_RESPONSE = 'response'
+SSDP_NOTIFY = 'notify'
+SSDP_SEARCH = 'search'
+
+# headers SSDP discovery looks at, every spelling maps to the same key
+KNOWN_HEADERS = ('ST', 'NT', 'NTS', 'USN', 'LOCATION', 'CACHE-CONTROL',
+                 'SERVER', 'EXT', 'DATE', 'HOST', 'MAN', 'MX',
+                 'BOOTID.UPNP.ORG', 'CONFIGID.UPNP.ORG')
+
+_HEADER_KEYS = {}
+for _name in KNOWN_HEADERS:
+    for _spelling in (_name, _name.lower(), _name.title()):
+        _HEADER_KEYS[_spelling.encode()] = _name
+
+_START_LINES = ((b'NOTIFY * ', SSDP_NOTIFY),
+                (b'M-SEARCH * ', SSDP_SEARCH))
+
+# one header per line, lines that do not match are skipped
+_HEADER_REGEX = re.compile(rb'^[ \t]*([A-Za-z0-9_.\-]+)[ \t]*:([^\r\n]*)',
+                           re.MULTILINE)
+_STATUS_REGEX = re.compile(rb'HTTP/[0-9.]+ [0-9]{3}')
+
+
+def _start_line_kind(data, end):
+    if _STATUS_REGEX.match(data, 0, end):
+        return SSDP_RESPONSE
+
+    for prefix, kind in _START_LINES:
+        if data.startswith(prefix, 0, end):
+            return kind
+
+    return None
+
+
+def _headers_end(data, start, end):
+    """Offset of the blank line ending the headers, or end
+    """
+    ret = end
+    for terminator in (b'\n\r\n', b'\n\n'):
+        pos = data.find(terminator, start, ret)
+        if pos >= 0:
+            ret = pos + 1
+    return ret
+
+
+def parse_ssdp_message(data, length=None):
+    """Parse an SSDP datagram in place, returns (kind, headers) or
+       (None, None) for anything that is not SSDP
+
+       Works on bytes or directly on a reusable bytearray receive buffer
+       holding length bytes, the datagram is never copied. Both CRLF and
+       bare LF line endings are accepted; header lines that cannot be
+       parsed are skipped.
+    """
+    end = len(data) if length is None else min(length, len(data))
+
+    eol = data.find(b'\n', 0, end)
+    if eol < 0:
+        eol = end
+    kind = _start_line_kind(data, eol)
+    if kind is None:
+        return None, None
+
+    headers = {}
+    for name, value in _HEADER_REGEX.findall(data, eol,
+                                             _headers_end(data, eol, end)):
+        key = _HEADER_KEYS.get(name)
+        if key is None:
+            key = name.decode('ascii').upper()
+        headers[key] = value.strip().decode('utf-8', 'replace')
+
+    return kind, headers
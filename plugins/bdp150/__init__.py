@@ -63,8 +63,13 @@ class BDP150Driver(Module):
     def __init__(self, **kwargs):
         super(BDP150Driver, self).__init__(**kwargs)
 
-        # attach to ssdp remove hook
-        self.interrupt_handler(attach_custom_hook=['ppagg.ssdp_removed',
+        # attach to the ssdp remove hook of this device only
+        removed_hook =\
+            self.interrupt_handler(call_custom_method=['ppagg.add_removal_route',
+                                                       ['ppagg.ssdp_removed',
+                                                        kwargs['USN'],
+                                                        self._registered_id]])
+        self.interrupt_handler(attach_custom_hook=[removed_hook,
                                                    [self._ssdp_removed,
                                                     MMHookAct.UNLOAD_MODULE,
                                                     self._registered_id]])
@@ -173,8 +178,13 @@ def discover_module(**kwargs):
                                         host_port=1900,
                                         service_type='urn:pioneer-co-jp:device:PioControlServer:1')
 
-    # attach to discovery hook
-    kwargs['modman'].attach_custom_hook('ppagg.ssdp_discovered',
+    # attach to discovery of Pioneer players only
+    discovered_hook =\
+        kwargs['modman'].call_custom_method('ppagg.add_discovery_route',
+                                            hook_name='ppagg.ssdp_discovered',
+                                            st='urn:pioneer-co-jp:device:'
+                                            'PioControlServer:1')
+    kwargs['modman'].attach_custom_hook(discovered_hook,
                                         BDP150Driver.new_ssdp_service,
                                         MMHookAct.LOAD_MODULE,
                                         BDP150DriverProxy)
@@ -1,9 +1,11 @@
 from viscum.plugin import (Module,
                            ModuleArgument,
                            ModuleCapabilities)
-from periodicpy.irtools.lirc import LircClient
+from aggregate.util.lazy import lazy_import
 import os.path
 
+lirc = lazy_import('periodicpy.irtools.lirc')
+
 _MODULE_VERSION = '0.1'
 _MODULE_DESCRIPTOR = 'lircd.json'
 
@@ -26,8 +28,8 @@ class LircdDriver(Module):
         super(LircdDriver, self).__init__(**kwargs)
 
         # create lirc client instance
-        self.lirc_handler = LircClient(self._loaded_kwargs['server_address'],
-                                       self._loaded_kwargs['server_port'])
+        self.lirc_handler = lirc.LircClient(self._loaded_kwargs['server_address'],
+                                            self._loaded_kwargs['server_port'])
 
         # automap methods
         self._automap_methods()
@@ -1,11 +1,15 @@
 from viscum.plugin import (Module,
                            ModuleArgument,
                            ModuleCapabilities)
-from viscum.hook import ModuleManagerHookActions as MMHookAct
-from mpd import MPDClient, CommandError
+from aggregate.util.lazy import lazy_import
 import socket
 import os.path
 
+mpd = lazy_import('mpd')
+
+# seconds between periodic calls
+MPD_TICK_INTERVAL = 30
+
 
 class MPDClientDriverLoadError(Exception):
     """Driver load error exception
@@ -25,7 +29,7 @@ class MPDClientDriver(Module):
     def __init__(self, **kwargs):
         super(MPDClientDriver, self).__init__(**kwargs)
 
-        self.cli = MPDClient()
+        self.cli = mpd.MPDClient()
 
         # try to connect
         try:
@@ -37,18 +41,19 @@ class MPDClientDriver(Module):
         if 'password' in kwargs:
             try:
                 self.cli.password(kwargs['password'])
-            except CommandError:
+            except mpd.CommandError:
                 raise MPDClientDriverLoadError('error while trying '
                                                'to input password')
 
         # disconnect
         self.cli.disconnect()
 
-        # attach callbacks
-        self.interrupt_handler(attach_manager_hook=['modman.tick',
-                                                    [self._periodic_call,
-                                                     MMHookAct.NO_ACTION,
-                                                     self._registered_id]])
+        # periodic calls on an interval of their own, cancelled by the
+        # aggregator when this instance unloads
+        self.interrupt_handler(call_custom_method=['ppagg.schedule_tick',
+                                                   [MPD_TICK_INTERVAL,
+                                                    self._periodic_call,
+                                                    self._registered_id]])
 
         self._automap_properties()
         self._automap_methods()
@@ -79,8 +84,8 @@ class MPDClientDriver(Module):
 
         return inner
 
-    def _periodic_call(self, **kwargs):
-        """Attached to module manager tick, send idle command?
+    def _periodic_call(self):
+        """Scheduled every MPD_TICK_INTERVAL seconds, send idle command?
         """
         pass
 
@@ -42,25 +42,34 @@ class PPNodeDriver(Module):
         self.node = PeriodicPiNode(m.group(1),
                                    [kwargs['address'],
                                     kwargs['port']])
-        self.node.register_basic_information()
 
-        # get available drivers
-        driver_list = self.interrupt_handler('get_available_drivers')
-        self.node.register_services(driver_list, self.interrupt_handler)
-
-        # get plugin information, build structures
-        self.node.register_node_plugins()
+        # use scan results from the registry if available, refresh later
+        cached_state =\
+            self.interrupt_handler(call_custom_method=['ppagg.registry_get',
+                                                       ['ppnode',
+                                                        m.group(1)]])
+        restored = (cached_state is not None and
+                    self.node.restore_scan_state(cached_state,
+                                                 self.interrupt_handler))
+        if not restored:
+            self.node.register_basic_information()
 
         # connect properties, methods
         self._automap_properties()
         self._automap_methods()
 
-        # attach to custom aggregator hooks
-        self.interrupt_handler(attach_custom_hook=['ppagg.node_removed',
+        # attach to the node_removed hook of this node only
+        removed_hook =\
+            self.interrupt_handler(call_custom_method=['ppagg.add_removal_route',
+                                                       ['ppagg.node_removed',
+                                                        kwargs['name'],
+                                                        self._registered_id]])
+        self.interrupt_handler(attach_custom_hook=[removed_hook,
                                                    [self._node_removed,
                                                     MMHookAct.UNLOAD_MODULE,
                                                     self._registered_id]])
 
+        # attach to custom aggregator hooks
         self.interrupt_handler(attach_custom_hook=['ppagg.agg_started',
                                                    [self._agg_started,
                                                     MMHookAct.NO_ACTION,
@@ -76,11 +85,18 @@ class PPNodeDriver(Module):
                                                           .format(m.group(1)),
                                                           self._node_interrupt_handler])
 
-        # add to active
+        # add to active as soon as basic information is in
         self.interrupt_handler(call_custom_method=['ppagg.add_node',
                                                    [m.group(1),
                                                     [self.node]]])
 
+        # services, drivers and plugin structures come in the background
+        driver_list = self.interrupt_handler('get_available_drivers')
+        self.node.start_onboarding(driver_list, self.interrupt_handler,
+                                   refresh=restored,
+                                   changed_cb=self._node_changed,
+                                   done_cb=self._onboarding_done)
+
         # done
         self.interrupt_handler(log_info='new Periodic Pi node: {}'
                                .format(m.group(1)))
@@ -104,11 +120,45 @@ class PPNodeDriver(Module):
                                             method_name,
                                             method_args)
 
+    def _get_connection_stats(self):
+        """Request counters and connection reuse towards the node
+        """
+        return self.node.get_connection_stats()
+
+    def _get_structure_cache_stats(self):
+        """Plugin structure fetches saved by the shared cache
+        """
+        return self.node.get_structure_cache_stats()
+
     def _inspect_plugin(self, instance_name):
         """Gets the structure of a plugin
         """
         return self.node.get_node_plugin_structure(instance_name)
 
+    def _store_scan_state(self):
+        """Save scan results for warm starts
+        """
+        self.interrupt_handler(call_custom_method=['ppagg.registry_put',
+                                                   ['ppnode',
+                                                    self._get_node_element(),
+                                                    self.node.get_scan_state()]])
+
+    def _node_changed(self):
+        """A plugin structure came in
+        """
+        self.interrupt_handler(call_custom_method=['ppagg.touch_node',
+                                                   [self._get_node_element()]])
+
+    def _onboarding_done(self, success):
+        """Onboarding callback, keep scan results for warm starts
+        """
+        if not success:
+            self.interrupt_handler(log_warning='could not scan node {}'
+                                   .format(self._get_node_element()))
+            return
+
+        self._store_scan_state()
+
     def _node_removed(self, **kwargs):
         """mDNS removal callback
         """
@@ -120,6 +170,7 @@ class PPNodeDriver(Module):
         if m.group(1) == self._get_node_element():
             # got removed
             self.node.unregister_services(self.interrupt_handler)
+            self.node.close_connections()
             self.interrupt_handler(call_custom_method=['ppagg.del_node',
                                                        [self._get_node_element()]])
             return True
@@ -163,7 +214,12 @@ def discover_module(**kwargs):
             Module.build_module_structure_from_file(os.path.join(kwargs['plugin_path'],
                                                                  'ppnode.json'))
     try:
-        kwargs['modman'].attach_custom_hook('ppagg.node_discovered',
+        # attach to discovery of PeriodicPi nodes only
+        discovered_hook =\
+            kwargs['modman'].call_custom_method('ppagg.add_discovery_route',
+                                                hook_name='ppagg.node_discovered',
+                                                name_prefix='PeriodicPi node [')
+        kwargs['modman'].attach_custom_hook(discovered_hook,
                                             PPNodeDriver.new_node_detected,
                                             MMHookAct.LOAD_MODULE,
                                             PPNodeDriver)
@@ -171,6 +227,8 @@ def discover_module(**kwargs):
         # TODO: find a better way to do this
         load_plugin_component(kwargs['plugin_path'],
                               'scan')
+        load_plugin_component(kwargs['plugin_path'],
+                              'structures')
         load_plugin_component(kwargs['plugin_path'],
                               'node')
     except HookNotAvailableError:
@@ -1,13 +1,23 @@
 from aggregate.util.misc import NodeAddress
+from aggregate.util.fanout import run_grouped
 from scan import (scan_new_node,
                   scan_node_services,
                   scan_node_modules,
-                  retrieve_json_data,
                   post_json_data,
-                  NodeScanError)
+                  node_sessions,
+                  NodeScanError,
+                  NODE_POOL_SIZE)
+from structures import structure_cache
+from concurrent.futures import ThreadPoolExecutor
 import logging
+import threading
 from viscum.plugin.exception import ModuleAlreadyLoadedError
 
+# node requests and sub-driver loads of every onboarding node, loads
+# are serialized by the aggregator
+NODE_ONBOARDING_WORKERS = 8
+onboarding_executor = ThreadPoolExecutor(max_workers=NODE_ONBOARDING_WORKERS)
+
 
 class NodeElementError(Exception):
     pass
@@ -23,6 +33,9 @@ class PeriodicPiNode(object):
         self.service_drivers = {}
         self.node_plugins = {}
         self.node_plugin_structure = {}
+        # plugin kind -> content hash of its structure
+        self.node_plugin_hashes = {}
+        self.basic_information = {}
 
         self.logger = logging.getLogger('ppagg.node-{}'.format(node_element))
 
@@ -30,6 +43,11 @@ class PeriodicPiNode(object):
         self.agg_port = 80
         self.agg_address = ''
 
+        # onboarding fills plugins and drivers in from other threads
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+        self._onboarding = None
+
     def agg_startup(self, **kwargs):
         self.agg_running = True
         self.agg_port = kwargs['agg_port']
@@ -42,18 +60,21 @@ class PeriodicPiNode(object):
         return self.element
 
     def get_node_plugins(self):
-        return self.node_plugins
+        with self._lock:
+            return dict(self.node_plugins)
 
     def get_node_plugin_structure(self, inst_name):
-        return self.node_plugin_structure[self.node_plugins[inst_name]]
+        with self._lock:
+            return self.node_plugin_structure[self.node_plugins[inst_name]]
 
     def call_plugin_method(self, instance_name, method_name, method_args):
         # do some verification
 
-        if instance_name not in self.node_plugins:
-            return None  # plugin not loaded
+        with self._lock:
+            if instance_name not in self.node_plugins:
+                return None  # plugin not loaded (or structure not in yet)
 
-        module_methods = self.node_plugin_structure[self.node_plugins[instance_name]]['module_methods']
+            module_methods = self.node_plugin_structure[self.node_plugins[instance_name]]['module_methods']
         if method_name not in module_methods:
             return None  # method does not exist
 
@@ -61,16 +82,16 @@ class PeriodicPiNode(object):
             if arg not in module_methods[method_name]['method_args']:
                 return None  # invalid argument
 
-        for arg_name, arg in module_methods[method_name]['method_args'].iteritems():
+        for arg_name, arg in module_methods[method_name]['method_args'].items():
             if arg['arg_required'] == True and arg_name not in method_args:
                 return None  # missing required argument
 
         # bottle not linking nested dictionaries, undo method_args dictionary
         arg_pairs = []
-        for arg_name, arg in method_args.iteritems():
+        for arg_name, arg in method_args.items():
             arg_pairs.append('{}={}'.format(arg_name, arg))
 
-        # call (post)
+        # call (post), over a kept-alive connection to the node
         try:
             ret = post_json_data(self.addr, 'plugins/{}/{}'
                                  .format(instance_name, method_name),
@@ -78,6 +99,17 @@ class PeriodicPiNode(object):
         except NodeScanError:
             return None  # error while calling
 
+        return ret
+
+    def get_connection_stats(self):
+        return node_sessions.get_stats(self.addr)
+
+    def get_structure_cache_stats(self):
+        return structure_cache.get_stats()
+
+    def close_connections(self):
+        node_sessions.close(self.addr)
+
     def get_serializable_dict(self, simple=True):
         ret = {}
 
@@ -92,93 +124,271 @@ class PeriodicPiNode(object):
         return ret
 
     def register_basic_information(self):
+        self._set_basic_information(scan_new_node(self.addr))
 
-        scan_result = scan_new_node(self.addr)
-
+    def _set_basic_information(self, scan_result):
         if scan_result['node_element'] != self.element:
             raise NodeElementError('error while getting node information')
 
         self.__dict__.update(scan_result)
+        self.basic_information = scan_result
 
         self.scanned = True
 
-    def register_node_plugins(self):
-
-        scan_result = scan_node_modules(self.addr)
-
-        # dump json data, analyze
-        self.node_plugin_structure = {}
-        self.node_plugins = dict(scan_result)
-
-        # only retrieve each kind once
-        node_plugin_types = set(scan_result.values())
-
-        for kind in node_plugin_types:
-            self.node_plugin_structure[kind] =\
-                retrieve_json_data(self.addr,
-                                   'plugins/{}/structure'
-                                   .format(kind))
-
-            self.logger.debug('discovered node-side plugin class: {}'
-                              .format(kind))
+    def get_scan_state(self):
+        """Scan results in a form that can be stored in the registry
+        """
+        with self._lock:
+            return {'address': list(self.addr),
+                    'basic_information': self.basic_information,
+                    'node_plugins': dict(self.node_plugins),
+                    # structures are stored once, by the structure cache
+                    'node_plugin_hashes': dict(self.node_plugin_hashes)}
+
+    def restore_scan_state(self, state, driver_manager=None):
+        """Restore previously stored scan results, returns False if
+           they do not belong to this node or structures are missing
+        """
+        if state.get('address') != list(self.addr):
+            return False
+
+        basic_information = state['basic_information']
+        if basic_information.get('node_element') != self.element:
+            return False
+
+        hashes = {}
+        structures = {}
+        if 'node_plugin_hashes' in state:
+            for kind, digest in state['node_plugin_hashes'].items():
+                structure = structure_cache.lookup(digest, driver_manager)
+                if structure is None:
+                    return False
+                hashes[kind] = digest
+                structures[kind] = structure
+        else:
+            # stored before structures were shared
+            for kind, structure in state['node_plugin_structure'].items():
+                hashes[kind], structures[kind] =\
+                    structure_cache.intern(structure, driver_manager)
+
+        self.__dict__.update(basic_information)
+        self.basic_information = basic_information
+        self.node_plugins = state['node_plugins']
+        self.node_plugin_structure = structures
+        self.node_plugin_hashes = hashes
+        self.scanned = True
 
-    def register_services(self, available_drivers, driver_manager):
+        return True
 
+    def register_aggregator(self, driver_manager):
+        """Have the node send its interrupts to us
+        """
         self.agg_running = True
         agg_addr = driver_manager(call_custom_method=['ppagg.get_addr', []])
         self.agg_address = agg_addr['address']
         self.agg_port = agg_addr['port']
         # attach interrupt on node side
-        status = post_json_data(self.addr,
-                                'control/agg/register',
-                                {'agg_addr': self.agg_address,
-                                 'agg_port': self.agg_port,
-                                 'handler_name': '{}pp.inthandler'
-                                 .format(self.element),
-                                 'handler_path': 'server_interrupt'})
-
-        scan_result = scan_node_services(self.addr)
-        self.scanned_services = dict(scan_result)
-
-        for service in scan_result['services']:
+        return post_json_data(self.addr,
+                              'control/agg/register',
+                              {'agg_addr': self.agg_address,
+                               'agg_port': self.agg_port,
+                               'handler_name': '{}pp.inthandler'
+                               .format(self.element),
+                               'handler_path': 'server_interrupt'})
+
+    @staticmethod
+    def _capture(call):
+        try:
+            return call(), None
+        except Exception as e:
+            return None, e
+
+    def _fan_out(self, calls, group_key):
+        """Run calls concurrently, returns (result, exception) pairs
+        """
+        return run_grouped(onboarding_executor, calls, group_key,
+                           self._capture)
+
+    def start_onboarding(self, available_drivers, driver_manager,
+                         refresh=False, changed_cb=None, done_cb=None):
+        """Run the onboarding pipeline on a thread of its own
+        """
+        def _run():
+            try:
+                self.onboard(available_drivers, driver_manager,
+                             refresh, changed_cb)
+            except Exception as e:
+                self.logger.warning('onboarding failed: {}'.format(e))
+                if done_cb is not None:
+                    done_cb(False)
+                return
+
+            if done_cb is not None:
+                done_cb(True)
+
+        self._onboarding = threading.Thread(target=_run,
+                                            name='ppnode-{}'
+                                            .format(self.element))
+        self._onboarding.daemon = True
+        self._onboarding.start()
+
+    def onboard(self, available_drivers, driver_manager, refresh=False,
+                changed_cb=None):
+        """Register with the node, load drivers for its services and get
+           its plugin structures
+
+           Independent requests are issued concurrently. Then the
+           service drivers are loaded one after the other while plugin
+           structures are fetched concurrently. Plugins show up as their
+           structure comes in, changed_cb is called every time. With
+           refresh set, basic information is fetched again.
+        """
+        calls = [lambda: self.register_aggregator(driver_manager),
+                 lambda: scan_node_services(self.addr),
+                 lambda: scan_node_modules(self.addr)]
+        if refresh:
+            calls.append(lambda: scan_new_node(self.addr))
+
+        results = self._fan_out(calls, lambda index, call: index)
+        for _, error in results:
+            if error is not None:
+                raise error
+
+        if refresh:
+            self._set_basic_information(results[3][0])
+        services = results[1][0]
+        node_plugins = dict(results[2][0])
+        self.scanned_services = dict(services)
+
+        # only retrieve each kind once
+        kinds = sorted(set(node_plugins.values()))
+        enabled = []
+        for service in services['services']:
             self.logger.debug('discovered service "{}"'
                               .format(service['service_name']))
             if service['enabled'] is False:
                 self.logger.debug('service "{}" is disabled'
                                   .format(service['service_name']))
                 continue
-
-            loaded_mod_id = None
-            if service['service_name'] in available_drivers:
-                # do stuff!
-                self.logger.debug('driver for "{}" is available'
-                                  .format(service['service_name']))
-                try:
-                    loaded_mod_id =\
-                        driver_manager(load_module=[service['service_name'],
-                                                    {'instance_suffix': self.element,
-                                                     'server_address': self.addr.address,
-                                                     'server_port': int(service['port']),
-                                                     'attached_node': self.element}])
-                except ModuleAlreadyLoadedError:
-                    pass
-                except TypeError:
-                    # load without address (not needed)?
-                    try:
-                        loaded_mod_id =\
-                            driver_manager(load_module=[service['service_name'],
-                                                        {'instance_suffix': self.element,
-                                                         'attached_node': self.element}])
-                    except Exception:
-                        # give up
-                        raise
-
-            else:
-                self.logger.warn('no driver available for service {}'
-                                 .format(service['service_name']))
-
-            # save module information
-            self.service_drivers[service['service_name']] = loaded_mod_id
+            enabled.append(service)
+
+        def _load(service):
+            return lambda: self._load_service(service, available_drivers,
+                                              driver_manager)
+
+        def _fetch(kind):
+            return lambda: self._fetch_structure(kind, node_plugins,
+                                                 driver_manager, changed_cb)
+
+        def _group(index, call):
+            # loading constructs the driver (and does its I/O) under the
+            # aggregator's module manager lock, so loads cannot overlap
+            # each other; run them in order next to the structure
+            # fetches, which share the node's keep-alive connections
+            if index < len(enabled):
+                return ('load', 0)
+            return ('fetch', index % NODE_POOL_SIZE)
+
+        results = self._fan_out([_load(service) for service in enabled] +
+                                [_fetch(kind) for kind in kinds], _group)
+
+        for service, (_, error) in zip(enabled, results):
+            if error is not None:
+                self.logger.warning('could not load driver for "{}": {}'
+                                    .format(service['service_name'], error))
+
+        for kind, (_, error) in zip(kinds, results[len(enabled):]):
+            if error is not None:
+                self.logger.warning('could not get structure of "{}": {}'
+                                    .format(kind, error))
+
+        # forget plugins that went away since the last scan
+        with self._lock:
+            self.node_plugin_structure =\
+                dict([(kind, structure) for kind, structure
+                      in self.node_plugin_structure.items()
+                      if kind in kinds])
+            self.node_plugin_hashes =\
+                dict([(kind, digest) for kind, digest
+                      in self.node_plugin_hashes.items()
+                      if kind in self.node_plugin_structure])
+            self.node_plugins =\
+                dict([(instance, kind) for instance, kind
+                      in node_plugins.items()
+                      if kind in self.node_plugin_structure])
+
+        if changed_cb is not None:
+            changed_cb()
+
+    def _fetch_structure(self, kind, node_plugins, driver_manager,
+                         changed_cb):
+        # shared with every node serving the same plugin version
+        digest, structure = structure_cache.get(self.addr, kind,
+                                                driver_manager)
+        with self._lock:
+            self.node_plugin_structure[kind] = structure
+            self.node_plugin_hashes[kind] = digest
+            for instance, instance_kind in node_plugins.items():
+                if instance_kind == kind:
+                    self.node_plugins[instance] = kind
+
+        self.logger.debug('discovered node-side plugin class: {}'
+                          .format(kind))
+        if changed_cb is not None:
+            changed_cb()
+
+    @staticmethod
+    def _load_driver(driver_manager, module_name, kwargs):
+        # through the aggregator, which serializes module manager changes
+        return driver_manager(call_custom_method=['ppagg.load_driver',
+                                                  [module_name, kwargs]])
+
+    @staticmethod
+    def _unload_driver(driver_manager, instance_name):
+        driver_manager(call_custom_method=['ppagg.unload_driver',
+                                           [instance_name]])
+
+    def _load_service(self, service, available_drivers, driver_manager):
+        if self._cancelled.is_set():
+            return None
+
+        loaded_mod_id = None
+        if service['service_name'] in available_drivers:
+            # do stuff!
+            self.logger.debug('driver for "{}" is available'
+                              .format(service['service_name']))
+            try:
+                loaded_mod_id =\
+                    self._load_driver(driver_manager,
+                                      service['service_name'],
+                                      {'instance_suffix': self.element,
+                                       'server_address': self.addr.address,
+                                       'server_port': int(service['port']),
+                                       'attached_node': self.element})
+            except ModuleAlreadyLoadedError:
+                pass
+            except TypeError:
+                # load without address (not needed)?
+                loaded_mod_id =\
+                    self._load_driver(driver_manager,
+                                      service['service_name'],
+                                      {'instance_suffix': self.element,
+                                       'attached_node': self.element})
+
+        else:
+            self.logger.warn('no driver available for service {}'
+                             .format(service['service_name']))
+
+        # save module information, unless the node went away meanwhile
+        with self._lock:
+            cancelled = self._cancelled.is_set()
+            if not cancelled:
+                self.service_drivers[service['service_name']] = loaded_mod_id
+
+        if cancelled and loaded_mod_id is not None:
+            self._unload_driver(driver_manager, loaded_mod_id)
+
+        return loaded_mod_id
 
     def handler_int(self, **kwargs):
         self.logger.debug('received interrupt from module handler: {}'
@@ -186,9 +396,16 @@ class PeriodicPiNode(object):
 
     def unregister_services(self, driver_manager):
         self.logger.debug('module was removed, start unloading modules')
-        for loaded_module in self.service_drivers.values():
+        # drivers still loading unload themselves
+        with self._lock:
+            self._cancelled.set()
+            loaded_modules = list(self.service_drivers.values())
+
+        for loaded_module in loaded_modules:
+            if loaded_module is None:
+                continue
             try:
-                driver_manager(unload_module=[loaded_module])
+                self._unload_driver(driver_manager, loaded_module)
             except Exception as e:
                 self.logger.warn('could not unload instance "{}": {}'
-                                 .format(loaded_module, e.message))
+                                 .format(loaded_module, e))
@@ -1,19 +1,169 @@
-import requests
 from aggregate.util.misc import get_full_node_address
+from aggregate.util.lazy import lazy_import
+import threading
+import time
+
+requests = lazy_import('requests')
 
 NODE_INFO_PATH = 'status/node'
 NODE_SERVICES_PATH = 'status/services'
 NODE_PLUGINS_PATH = 'status/active_plugins'
 
+# a hung node must not block its callers forever
+NODE_CONNECT_TIMEOUT = 3.05
+NODE_READ_TIMEOUT = 10
+# connection failures are retried, requests that reached the node are
+# retried once and only when idempotent
+NODE_RETRIES = 2
+NODE_RETRY_BACKOFF = 0.2
+# keep-alive connections per node
+NODE_POOL_SIZE = 4
+
 
 class NodeScanError(Exception):
     pass
 
 
+class NodeSessionPool(object):
+    """Keep-alive HTTP sessions, one per node
+
+       Scans and plugin calls to a node reuse warm connections instead
+       of connecting for every request.
+    """
+    def __init__(self, connect_timeout=NODE_CONNECT_TIMEOUT,
+                 read_timeout=NODE_READ_TIMEOUT, retries=NODE_RETRIES,
+                 pool_size=NODE_POOL_SIZE):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.pool_size = pool_size
+
+        # (address, port) -> (session, adapter)
+        self._sessions = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def configure(self, connect_timeout=None, read_timeout=None,
+                  retries=None, pool_size=None):
+        """Change timeouts and retries, retries and pool size apply to
+           sessions created afterwards
+        """
+        if connect_timeout is not None:
+            self.connect_timeout = connect_timeout
+        if read_timeout is not None:
+            self.read_timeout = read_timeout
+        if retries is not None:
+            self.retries = retries
+        if pool_size is not None:
+            self.pool_size = pool_size
+
+    def _new_session(self):
+        retry = requests.adapters.Retry(total=self.retries,
+                                        connect=self.retries,
+                                        read=min(self.retries, 1),
+                                        status=0,
+                                        backoff_factor=NODE_RETRY_BACKOFF,
+                                        raise_on_status=False)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                                pool_maxsize=self.pool_size,
+                                                max_retries=retry)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        return session, adapter
+
+    def _get_session(self, node_address):
+        key = (node_address.address, node_address.port)
+        with self._lock:
+            if key not in self._sessions:
+                self._sessions[key] = self._new_session()
+                self._stats.setdefault(key, {'requests': 0,
+                                             'errors': 0,
+                                             'timeouts': 0,
+                                             'elapsed': 0.0})
+            return self._sessions[key][0], self._stats[key]
+
+    def request(self, method, node_address, path, **kwargs):
+        session, stats = self._get_session(node_address)
+        start = time.monotonic()
+        outcome = None
+        try:
+            return session.request(method,
+                                   get_full_node_address(node_address)+path,
+                                   timeout=(self.connect_timeout,
+                                            self.read_timeout),
+                                   **kwargs)
+        except requests.exceptions.RequestException as e:
+            # retried read timeouts come wrapped in connection errors
+            reason = getattr(e.args[0] if e.args else None, 'reason', None)
+            if isinstance(e, requests.exceptions.Timeout) or\
+               isinstance(reason, requests.adapters.ReadTimeoutError):
+                outcome = 'timeouts'
+                raise NodeScanError('timeout while connecting to node: {}'
+                                    .format(e))
+            outcome = 'errors'
+            raise NodeScanError('error while connecting to node: {}'
+                                .format(e))
+        finally:
+            with self._lock:
+                stats['requests'] += 1
+                stats['elapsed'] += time.monotonic() - start
+                if outcome is not None:
+                    stats[outcome] += 1
+
+    def close(self, node_address):
+        """Drop the connections to a node
+        """
+        key = (node_address.address, node_address.port)
+        with self._lock:
+            entry = self._sessions.pop(key, None)
+            self._stats.pop(key, None)
+        if entry is not None:
+            entry[0].close()
+
+    @staticmethod
+    def _pool_stats(adapter):
+        connections = 0
+        pooled_requests = 0
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            connections += pool.num_connections
+            pooled_requests += pool.num_requests
+
+        return {'connections_opened': connections,
+                'connections_reused': max(pooled_requests - connections, 0)}
+
+    def get_stats(self, node_address=None):
+        """Request counters and connection reuse, of one node or all
+           nodes keyed by "address:port"
+        """
+        with self._lock:
+            entries = [(key, self._sessions[key][1], dict(self._stats[key]))
+                       for key in self._sessions
+                       if node_address is None or
+                       key == (node_address.address, node_address.port)]
+
+        ret = {}
+        for key, adapter, stats in entries:
+            stats.update(self._pool_stats(adapter))
+            ret['{}:{}'.format(*key)] = stats
+
+        if node_address is not None:
+            return ret.popitem()[1] if ret else None
+
+        return ret
+
+
+# shared by every node driver in the process
+node_sessions = NodeSessionPool()
+
+
 def retrieve_json_data(node_address, path):
 
     # simple data retrieval
-    r = requests.get(get_full_node_address(node_address)+path)
+    r = node_sessions.request('GET', node_address, path)
 
     if r.ok is False:
         raise NodeScanError('error while connecting to node')
@@ -27,8 +177,8 @@ def retrieve_json_data(node_address, path):
 def post_json_data(node_address, path, data):
 
     headers = {'content-type': 'application/json', 'Accept': 'text/plain'}
-    r = requests.post(get_full_node_address(node_address)+path,
-                      data=data, headers=headers)
+    r = node_sessions.request('POST', node_address, path,
+                              data=data, headers=headers)
 
     if r.ok is False:
         raise NodeScanError('error while connecting to node')
@@ -39,6 +189,27 @@ def post_json_data(node_address, path, data):
         raise NodeScanError('malformed response from node')
 
 
+def retrieve_json_if_changed(node_address, path, etags=()):
+    """Conditional retrieval, returns (ETag, data) where data is None
+       if the node answered that one of etags is still current
+    """
+    headers = {}
+    if etags:
+        headers['If-None-Match'] = ', '.join(etags)
+    r = node_sessions.request('GET', node_address, path, headers=headers)
+
+    if r.status_code == 304:
+        return r.headers.get('ETag'), None
+
+    if r.ok is False:
+        raise NodeScanError('error while connecting to node')
+
+    try:
+        return r.headers.get('ETag'), r.json()
+    except Exception:
+        raise NodeScanError('malformed response from node')
+
+
 def scan_new_node(node_address):
     return retrieve_json_data(node_address, NODE_INFO_PATH)
 
@@ -49,8 +220,3 @@ def scan_node_services(node_address):
 
 def scan_node_modules(node_address):
     return retrieve_json_data(node_address, NODE_PLUGINS_PATH)
-
-
-def get_module_structure(node_address, module):
-    return retrieve_json_data(node_address, 'plugins/{}/structure'
-                              .format(module))
@@ -0,0 +1,215 @@
+from scan import retrieve_json_if_changed
+import hashlib
+import json
+import threading
+
+# registry kinds: content hash -> structure, plugin kind -> ETags seen,
+# node element -> scan state
+STRUCTURES_KIND = 'ppnode.structures'
+ETAGS_KIND = 'ppnode.structure_etags'
+SCAN_STATE_KIND = 'ppnode'
+# validators remembered (and sent) per plugin kind, newest first
+MAX_ETAGS_PER_KIND = 8
+# nodes wait this long for another node's first fetch of a kind
+FIRST_FETCH_WAIT = 30
+
+
+def structure_hash(structure):
+    """Content hash of a plugin structure
+    """
+    data = json.dumps(structure, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+class StructureCache(object):
+    """Plugin structures shared by every node in the process
+
+       Structures are stored once per content hash and every node
+       serving the same plugin version refers to the same object, which
+       must not be modified. Requests carry the ETags already seen for
+       a kind so nodes only send structures we do not have; the first
+       fetch of a kind is done by one node while the others wait.
+       Structures and ETags persist in the aggregator's registry, a
+       structure is deleted once no ETag and no stored node scan refers
+       to it anymore.
+    """
+    def __init__(self):
+        self._structures = {}
+        # plugin kind -> [(etag, hash), ...], newest first
+        self._etags = {}
+        self._loaded_kinds = set()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+        self.fetched = 0
+        self.not_modified = 0
+        self.deduplicated = 0
+        self.collected = 0
+
+    @staticmethod
+    def _registry_get(driver_manager, kind, key):
+        return driver_manager(call_custom_method=['ppagg.registry_get',
+                                                  [kind, key]])
+
+    @staticmethod
+    def _registry_put(driver_manager, kind, key, value):
+        driver_manager(call_custom_method=['ppagg.registry_put',
+                                           [kind, key, value]])
+
+    @staticmethod
+    def _registry_remove(driver_manager, kind, key):
+        driver_manager(call_custom_method=['ppagg.registry_remove',
+                                           [kind, key]])
+
+    @staticmethod
+    def _registry_items(driver_manager, kind):
+        return driver_manager(call_custom_method=['ppagg.registry_items',
+                                                  [kind]]) or []
+
+    def intern(self, structure, driver_manager=None):
+        """Returns (hash, shared copy) of a structure
+        """
+        digest = structure_hash(structure)
+        with self._lock:
+            shared = self._structures.setdefault(digest, structure)
+
+        if shared is structure and driver_manager is not None:
+            self._registry_put(driver_manager, STRUCTURES_KIND, digest,
+                               structure)
+
+        return digest, shared
+
+    def lookup(self, digest, driver_manager=None):
+        """Structure with a content hash, None if unknown
+        """
+        with self._lock:
+            if digest in self._structures:
+                return self._structures[digest]
+
+        if driver_manager is None:
+            return None
+
+        stored = self._registry_get(driver_manager, STRUCTURES_KIND, digest)
+        if stored is None or structure_hash(stored) != digest:
+            return None
+
+        return self.intern(stored)[1]
+
+    def _known_etags(self, kind, driver_manager):
+        with self._lock:
+            if kind in self._loaded_kinds:
+                return list(self._etags.get(kind, []))
+
+        stored = self._registry_get(driver_manager, ETAGS_KIND, kind) or []
+        with self._lock:
+            if kind not in self._loaded_kinds:
+                self._loaded_kinds.add(kind)
+                known = self._etags.setdefault(kind, [])
+                for etag, digest in stored:
+                    if etag not in dict(known):
+                        known.append((etag, digest))
+            return list(self._etags[kind])
+
+    def _remember_etag(self, kind, etag, digest, driver_manager):
+        with self._lock:
+            known = self._etags.setdefault(kind, [])
+            if known and known[0] == (etag, digest):
+                return
+            previous = set([entry[1] for entry in known])
+            known[:] = [(etag, digest)] +\
+                [entry for entry in known
+                 if entry[0] != etag][:MAX_ETAGS_PER_KIND-1]
+            stored = [list(entry) for entry in known]
+            dropped = previous - set([entry[1] for entry in known])
+
+        self._registry_put(driver_manager, ETAGS_KIND, kind, stored)
+        if dropped:
+            self._collect(dropped, driver_manager)
+
+    def _collect(self, digests, driver_manager):
+        """Delete the structures among digests that no ETag and no
+           stored node scan refers to
+        """
+        referenced = set()
+        for _, etags in self._registry_items(driver_manager, ETAGS_KIND):
+            referenced.update([entry[1] for entry in etags])
+        for _, state in self._registry_items(driver_manager,
+                                             SCAN_STATE_KIND):
+            referenced.update(state.get('node_plugin_hashes', {}).values())
+
+        with self._lock:
+            for known in self._etags.values():
+                referenced.update([entry[1] for entry in known])
+            garbage = [digest for digest in digests
+                       if digest not in referenced]
+            # nodes keep the objects they use, only sharing stops
+            for digest in garbage:
+                self._structures.pop(digest, None)
+            self.collected += len(garbage)
+
+        for digest in garbage:
+            self._registry_remove(driver_manager, STRUCTURES_KIND, digest)
+
+    def get(self, node_address, kind, driver_manager):
+        """Returns (hash, structure) of a plugin kind served by a node
+        """
+        etags = self._known_etags(kind, driver_manager)
+
+        # one node fetches a kind nobody has seen, the others revalidate
+        leader = False
+        with self._lock:
+            event = self._inflight.get(kind)
+            if event is None and not etags:
+                self._inflight[kind] = threading.Event()
+                leader = True
+        if event is not None:
+            event.wait(FIRST_FETCH_WAIT)
+            etags = self._known_etags(kind, driver_manager)
+
+        try:
+            return self._fetch(node_address, kind, etags, driver_manager)
+        finally:
+            if leader:
+                with self._lock:
+                    self._inflight.pop(kind).set()
+
+    def _fetch(self, node_address, kind, etags, driver_manager):
+        path = 'plugins/{}/structure'.format(kind)
+        etag, data = retrieve_json_if_changed(node_address, path,
+                                              [entry[0] for entry in etags])
+        if data is None:
+            known = dict(etags)
+            if etag is None and len(etags) == 1:
+                etag = etags[0][0]
+            digest = known.get(etag)
+            structure = self.lookup(digest, driver_manager)\
+                if digest is not None else None
+            if structure is not None:
+                with self._lock:
+                    self.not_modified += 1
+                return digest, structure
+
+            # cannot tell which version the node has, fetch it all
+            etag, data = retrieve_json_if_changed(node_address, path)
+
+        digest, structure = self.intern(data, driver_manager)
+        with self._lock:
+            self.fetched += 1
+            if structure is not data:
+                self.deduplicated += 1
+        if etag is not None:
+            self._remember_etag(kind, etag, digest, driver_manager)
+
+        return digest, structure
+
+    def get_stats(self):
+        with self._lock:
+            return {'structures': len(self._structures),
+                    'fetched': self.fetched,
+                    'not_modified': self.not_modified,
+                    'deduplicated': self.deduplicated,
+                    'collected': self.collected}
+
+
+# shared by every node driver in the process
+structure_cache = StructureCache()
@@ -2,11 +2,13 @@ from viscum.plugin import (Module,
                            ModuleArgument,
                            ModuleCapabilities)
 from viscum.hook import ModuleManagerHookActions as MMHookAct
-import requests
-import xmltodict
+from aggregate.util.lazy import lazy_import
 import re
 import os.path
 
+requests = lazy_import('requests')
+xmltodict = lazy_import('xmltodict')
+
 MODULE_VERSION = '0.1'
 
 ROKU_TV_SSDP_REGEX = re.compile(r'uuid:roku:ecp:([0-9A-Za-z]+)')
@@ -35,8 +37,13 @@ class RokuTVDriver(Module):
     def __init__(self, **kwargs):
         super(RokuTVDriver, self).__init__(**kwargs)
 
-        # attach to ssdp remove hook
-        self.interrupt_handler(attach_custom_hook=['ppagg.ssdp_removed',
+        # attach to the ssdp remove hook of this device only
+        removed_hook =\
+            self.interrupt_handler(call_custom_method=['ppagg.add_removal_route',
+                                                       ['ppagg.ssdp_removed',
+                                                        kwargs['USN'],
+                                                        self._registered_id]])
+        self.interrupt_handler(attach_custom_hook=[removed_hook,
                                                    [self._ssdp_removed,
                                                     MMHookAct.UNLOAD_MODULE,
                                                     self._registered_id]])
@@ -151,8 +158,12 @@ def discover_module(**kwargs):
                                         host_port=1900,
                                         service_type='roku:ecp')
 
-    # attach to discovery hook
-    kwargs['modman'].attach_custom_hook('ppagg.ssdp_discovered',
+    # attach to discovery of Roku devices only
+    discovered_hook =\
+        kwargs['modman'].call_custom_method('ppagg.add_discovery_route',
+                                            hook_name='ppagg.ssdp_discovered',
+                                            usn_prefix='uuid:roku:ecp:')
+    kwargs['modman'].attach_custom_hook(discovered_hook,
                                         RokuTVDriver.new_ssdp_service,
                                         MMHookAct.LOAD_MODULE,
                                         RokuTVDriverProxy)
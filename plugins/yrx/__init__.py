@@ -3,10 +3,12 @@ from viscum.plugin import (Module,
                            ModuleCapabilities)
 from viscum.exception import HookNotAvailableError
 from viscum.hook import ModuleManagerHookActions as MMHookAct
+from aggregate.util.lazy import lazy_import
 import re
-import rxv
 import os.path
 
+rxv = lazy_import('rxv')
+
 YAMAHARX_REGEX = re.compile(r'^RX-A1020 ([0-9]+)')
 
 _ACTIVE_RECEIVER_LIST = []
@@ -41,8 +43,13 @@ class YRXNodeDriver(Module):
         self.interrupt_handler(log_info='new RX-A1020 receiver with id: {}'
                                .format(self.identifier))
 
-        # attach node_removed hook
-        self.interrupt_handler(attach_custom_hook=['ppagg.node_removed',
+        # attach to the node_removed hook of this node only
+        removed_hook =\
+            self.interrupt_handler(call_custom_method=['ppagg.add_removal_route',
+                                                       ['ppagg.node_removed',
+                                                        kwargs['name'],
+                                                        self._registered_id]])
+        self.interrupt_handler(attach_custom_hook=[removed_hook,
                                                    [self._node_removed,
                                                     MMHookAct.UNLOAD_MODULE,
                                                     self._registered_id]])
@@ -189,7 +196,12 @@ def discover_module(**kwargs):
                                                                  'yrx.json'))
 
     try:
-        kwargs['modman'].attach_custom_hook('ppagg.node_discovered',
+        # attach to discovery of RX-A1020 receivers only
+        discovered_hook =\
+            kwargs['modman'].call_custom_method('ppagg.add_discovery_route',
+                                                hook_name='ppagg.node_discovered',
+                                                name_prefix='RX-A1020 ')
+        kwargs['modman'].attach_custom_hook(discovered_hook,
                                             YRXNodeDriver.new_node_detected,
                                             MMHookAct.LOAD_MODULE,
                                             YRXNodeDriver)
@@ -13,5 +13,5 @@ setup(
     author="Bruno Morais",
     author_email="brunosmmm@gmail.com",
     description="Aggregate network services concentrator",
-    scripts=['aggsrv'],
+    scripts=['aggsrv', 'aggbench'],
     )
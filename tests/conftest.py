@@ -0,0 +1,19 @@
+import pytest
+
+
+class FakeClock(object):
+    """Clock advanced by hand, injected as clock= into timed components
+    """
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
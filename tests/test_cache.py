@@ -0,0 +1,165 @@
+import threading
+import pytest
+from aggregate.jsonsrv.cache import PropertyCache
+
+POLICIES = {'tv': {'properties': {'volume': 5, 'power': 10},
+                   'methods': {'mute': ['volume']}}}
+
+
+class Device(object):
+    def __init__(self):
+        self.reads = 0
+        self.volume = 1
+
+    def read(self):
+        self.reads += 1
+        return self.volume
+
+
+@pytest.fixture
+def cache(clock):
+    return PropertyCache(POLICIES, clock=clock)
+
+
+def test_hit_until_ttl_expires(cache, clock):
+    device = Device()
+    assert cache.get('tv-1', 'volume', device.read) == 1
+    device.volume = 2
+
+    clock.advance(4.9)
+    assert cache.get('tv-1', 'volume', device.read) == 1
+    assert device.reads == 1
+
+    clock.advance(0.2)
+    assert cache.get('tv-1', 'volume', device.read) == 2
+    assert device.reads == 2
+
+
+def test_properties_without_ttl_are_not_cached(cache):
+    device = Device()
+    cache.get('tv-1', 'input', device.read)
+    cache.get('tv-1', 'input', device.read)
+    cache.get('radio-1', 'volume', device.read)
+    assert device.reads == 3
+    assert cache.get_stats()['uncached'] == 3
+
+
+def test_write_invalidates_property(cache):
+    device = Device()
+    cache.get('tv-1', 'volume', device.read)
+    cache.get('tv-1', 'power', device.read)
+
+    cache.property_written('tv-1', 'volume')
+    cache.get('tv-1', 'volume', device.read)
+    cache.get('tv-1', 'power', device.read)
+    assert device.reads == 3
+
+
+def test_method_invalidation(cache):
+    device = Device()
+    cache.get('tv-1', 'volume', device.read)
+    cache.get('tv-1', 'power', device.read)
+
+    # listed methods drop their properties only
+    cache.method_called('tv-1', 'mute')
+    assert cache.get_stats()['entries'] == 1
+
+    # anything else drops the whole instance
+    cache.method_called('tv-1', 'reboot')
+    assert cache.get_stats()['entries'] == 0
+
+
+def test_instances_are_separate(cache):
+    device = Device()
+    cache.get('tv-1', 'volume', device.read)
+    cache.get('tv-2', 'volume', device.read)
+    cache.invalidate('tv-2')
+    cache.get('tv-1', 'volume', device.read)
+    assert device.reads == 2
+
+
+def test_read_racing_an_invalidation_is_not_stored(cache):
+    device = Device()
+
+    def _read():
+        # a write lands while the driver read is in flight
+        cache.property_written('tv-1', 'volume')
+        return device.read()
+
+    cache.get('tv-1', 'volume', _read)
+    cache.get('tv-1', 'volume', device.read)
+    assert device.reads == 2
+
+
+def test_invalidation_keeps_unrelated_reads_in_flight(cache):
+    device = Device()
+
+    def _read():
+        cache.property_written('tv-1', 'power')
+        cache.invalidate('tv-2')
+        return device.read()
+
+    cache.get('tv-1', 'volume', _read)
+    cache.get('tv-1', 'volume', device.read)
+    assert device.reads == 1
+
+
+def test_instance_invalidation_drops_its_reads_in_flight(cache):
+    device = Device()
+
+    def _read():
+        cache.invalidate('tv-1')
+        return device.read()
+
+    cache.get('tv-1', 'power', _read)
+    cache.get('tv-1', 'power', device.read)
+    assert device.reads == 2
+
+
+def test_known_modules(cache):
+    device = Device()
+    cache.get('tv-1', 'volume', device.read)
+    cache.get('tv-2', 'power', device.read)
+    assert cache.known_modules() == set(['tv-1', 'tv-2'])
+
+    # what the aggregator does for unloaded instances
+    cache.invalidate('tv-1')
+    assert cache.known_modules() == set(['tv-2'])
+
+
+def test_concurrent_misses_share_one_read(cache):
+    started = threading.Event()
+    release = threading.Event()
+    reads = []
+
+    def _read():
+        reads.append(True)
+        started.set()
+        release.wait(5)
+        return 7
+
+    results = []
+    owner = threading.Thread(target=lambda: results.append(
+        cache.get('tv-1', 'volume', _read)))
+    owner.start()
+    started.wait(5)
+    waiter = threading.Thread(target=lambda: results.append(
+        cache.get('tv-1', 'volume', _read)))
+    waiter.start()
+    release.set()
+    owner.join(5)
+    waiter.join(5)
+
+    assert results == [7, 7]
+    assert len(reads) == 1
+
+
+def test_failed_read_is_not_cached(cache):
+    device = Device()
+
+    def _fail():
+        raise IOError('device gone')
+
+    with pytest.raises(IOError):
+        cache.get('tv-1', 'volume', _fail)
+    assert cache.get('tv-1', 'volume', device.read) == 1
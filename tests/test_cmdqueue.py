@@ -0,0 +1,167 @@
+import threading
+import time
+import pytest
+from aggregate.jsonsrv.cmdqueue import (COMMAND_CALL,
+                                        COMMAND_GET,
+                                        COMMAND_SET,
+                                        CommandQueueTimeout,
+                                        DeviceCommandQueues)
+
+
+class Metrics(object):
+    def __init__(self):
+        self.waits = []
+
+    def add_queue_wait(self, seconds):
+        self.waits.append(seconds)
+
+
+class Device(object):
+    """Records driver calls, the first one blocks until released
+    """
+    def __init__(self):
+        self.calls = []
+        self.busy = threading.Event()
+        self.release = threading.Event()
+
+    def block(self):
+        self.busy.set()
+        self.release.wait(5)
+        return 'blocked'
+
+    def call(self, label):
+        self.calls.append(label)
+        return label
+
+
+def _queued(queues):
+    # commands waiting in the queue or merged into one
+    stats = queues.get_stats()
+    return stats['pending'] + stats['coalesced'] + stats['shared']
+
+
+def _submit_in_order(queues, device, commands):
+    """Hold the instance busy, queue commands one after the other and
+       run them, returns the results in submission order
+    """
+    results = [None] * len(commands)
+    blocker = threading.Thread(target=queues.submit,
+                               args=('tv-1', COMMAND_CALL, 'block',
+                                     device.block))
+    blocker.start()
+    device.busy.wait(5)
+
+    threads = []
+    for index, (kind, name, label) in enumerate(commands):
+        def _run(index=index, kind=kind, name=name, label=label):
+            results[index] = queues.submit('tv-1', kind, name,
+                                           device.call, label)
+        thread = threading.Thread(target=_run)
+        thread.start()
+        threads.append(thread)
+        deadline = time.monotonic() + 5
+        while _queued(queues) <= index:
+            assert time.monotonic() < deadline
+            time.sleep(0.001)
+
+    device.release.set()
+    for thread in [blocker] + threads:
+        thread.join(5)
+    return results
+
+
+@pytest.fixture
+def queues(clock):
+    return DeviceCommandQueues(clock=clock)
+
+
+def test_pending_writes_coalesce(queues):
+    device = Device()
+    results = _submit_in_order(queues, device,
+                               [(COMMAND_SET, 'volume', 'v1'),
+                                (COMMAND_SET, 'volume', 'v2'),
+                                (COMMAND_SET, 'volume', 'v3')])
+
+    # only the last value is written, every writer gets its result
+    assert device.calls == ['v3']
+    assert results == ['v3', 'v3', 'v3']
+    assert queues.get_stats()['coalesced'] == 2
+
+
+def test_pending_reads_are_shared(queues):
+    device = Device()
+    results = _submit_in_order(queues, device,
+                               [(COMMAND_GET, 'volume', 'r1'),
+                                (COMMAND_GET, 'volume', 'r2')])
+
+    assert device.calls == ['r1']
+    assert results == ['r1', 'r1']
+    assert queues.get_stats()['shared'] == 1
+
+
+def test_method_calls_are_barriers(queues):
+    device = Device()
+    _submit_in_order(queues, device,
+                     [(COMMAND_SET, 'volume', 'v1'),
+                      (COMMAND_CALL, 'mute', 'mute'),
+                      (COMMAND_SET, 'volume', 'v2')])
+
+    assert device.calls == ['v1', 'mute', 'v2']
+
+
+def test_conflicting_access_is_not_merged(queues):
+    device = Device()
+    _submit_in_order(queues, device,
+                     [(COMMAND_SET, 'volume', 'v1'),
+                      (COMMAND_GET, 'volume', 'r1'),
+                      (COMMAND_SET, 'volume', 'v2'),
+                      (COMMAND_SET, 'power', 'p1')])
+
+    assert device.calls == ['v1', 'r1', 'v2', 'p1']
+
+
+def test_errors_reach_the_caller(queues):
+    def _fail():
+        raise IOError('device gone')
+
+    with pytest.raises(IOError):
+        queues.submit('tv-1', COMMAND_CALL, 'fail', _fail)
+    assert queues.get_stats()['executed'] == 1
+
+
+def test_wait_times_use_the_clock(clock):
+    metrics = Metrics()
+    queues = DeviceCommandQueues(metrics=metrics, clock=clock)
+
+    def _slow():
+        clock.advance(2)
+
+    queues.submit('tv-1', COMMAND_CALL, 'slow', _slow)
+    assert metrics.waits == [0]
+
+
+def test_busy_instance_times_out(clock):
+    queues = DeviceCommandQueues(clock=clock, timeout=0.05)
+    device = Device()
+    blocker = threading.Thread(target=queues.submit,
+                               args=('tv-1', COMMAND_CALL, 'block',
+                                     device.block))
+    blocker.start()
+    device.busy.wait(5)
+
+    with pytest.raises(CommandQueueTimeout):
+        queues.submit('tv-1', COMMAND_GET, 'volume', device.call, 'r1')
+
+    device.release.set()
+    blocker.join(5)
+    assert device.calls == []
+    assert queues.get_stats()['timeouts'] == 1
+
+
+def test_idle_queues_are_dropped(queues):
+    device = Device()
+    for index in range(10):
+        queues.submit('tv-{}'.format(index), COMMAND_GET, 'volume',
+                      device.call, index)
+
+    assert queues.get_stats()['queues'] == 0
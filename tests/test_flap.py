@@ -0,0 +1,118 @@
+import pytest
+from aggregate.util.flap import FlapSuppressor
+from aggregate.util.sched import TickScheduler
+
+
+@pytest.fixture
+def scheduler(clock):
+    return TickScheduler(clock=clock)
+
+
+@pytest.fixture
+def flaps(scheduler, clock):
+    return FlapSuppressor(scheduler, grace=10, flap_window=100,
+                          max_factor=4, clock=clock)
+
+
+def _run(scheduler, clock, now):
+    clock.now = now
+    scheduler.run_pending()
+
+
+def test_removal_commits_after_grace(flaps, scheduler, clock):
+    commits = []
+    flaps.removed('svc', lambda: commits.append('svc'))
+
+    _run(scheduler, clock, 9.9)
+    assert commits == []
+    _run(scheduler, clock, 10)
+    assert commits == ['svc']
+    assert flaps.get_stats()['committed'] == 1
+
+
+def test_return_within_grace_keeps_driver(flaps, scheduler, clock):
+    commits = []
+    flaps.removed('svc', lambda: commits.append('svc'),
+                  {'address': '10.0.0.1'})
+    clock.now = 5
+    assert flaps.returned('svc', {'address': '10.0.0.1'}, ('address',))
+
+    _run(scheduler, clock, 50)
+    assert commits == []
+    stats = flaps.get_stats()
+    assert stats['suppressed'] == 1
+    assert stats['pending'] == 0
+
+
+def test_moved_service_commits_right_away(flaps, clock):
+    commits = []
+    flaps.removed('svc', lambda: commits.append('svc'),
+                  {'address': '10.0.0.1'})
+    assert not flaps.returned('svc', {'address': '10.0.0.2'}, ('address',))
+    assert commits == ['svc']
+    assert flaps.get_stats()['moved'] == 1
+
+
+def test_unknown_return_is_not_suppressed(flaps):
+    assert not flaps.returned('svc', {})
+
+
+def test_repeated_removal_keeps_first_deadline(flaps, scheduler, clock):
+    commits = []
+    flaps.removed('svc', lambda: commits.append(1))
+    clock.now = 8
+    flaps.removed('svc', lambda: commits.append(2))
+
+    _run(scheduler, clock, 10)
+    assert commits == [1]
+
+
+def test_grace_doubles_per_recent_flap(flaps, scheduler, clock):
+    commits = []
+
+    def _flap(now):
+        clock.now = now
+        flaps.removed('svc', lambda: commits.append(clock.now))
+        assert flaps.returned('svc', {})
+
+    _flap(0)
+    _flap(1)
+    # two recent flaps, grace is capped at four times the base
+    clock.now = 2
+    flaps.removed('svc', lambda: commits.append(clock.now))
+    _run(scheduler, clock, 41.9)
+    assert commits == []
+    _run(scheduler, clock, 42)
+    assert commits == [42]
+    assert flaps.get_stats()['flapping'] == {'svc': 2}
+
+
+def test_flaps_are_forgotten_after_window(flaps, scheduler, clock):
+    commits = []
+    flaps.removed('svc', lambda: None)
+    flaps.returned('svc', {})
+
+    clock.now = 101
+    assert flaps.get_stats()['flapping'] == {}
+    flaps.removed('svc', lambda: commits.append(clock.now))
+    _run(scheduler, clock, 111)
+    assert commits == [111]
+
+
+def test_flush_commits_pending(flaps, scheduler, clock):
+    commits = []
+    flaps.removed('a', lambda: commits.append('a'))
+    flaps.removed('b', lambda: commits.append('b'))
+    flaps.flush()
+    assert sorted(commits) == ['a', 'b']
+
+    _run(scheduler, clock, 100)
+    assert len(commits) == 2
+    assert scheduler.next_deadline() is None
+
+
+def test_no_grace_commits_immediately(scheduler, clock):
+    commits = []
+    flaps = FlapSuppressor(scheduler, grace=0, clock=clock)
+    flaps.removed('svc', lambda: commits.append('svc'))
+    assert commits == ['svc']
@@ -0,0 +1,89 @@
+import json
+from aggregate.jsonsrv.dispatch import JsonRpcDispatcher
+from aggregate.jsonsrv.introspect import IntrospectionCache, etag_matches
+
+
+def rpcmethod(method):
+    method.rpcmethod = True
+    return method
+
+
+class Methods(object):
+    def __init__(self):
+        self.cache = IntrospectionCache()
+        self.drivers = ['tv-1']
+        self.builds = 0
+
+    def _build(self):
+        self.builds += 1
+        return list(self.drivers)
+
+    @rpcmethod
+    def list_drivers(self):
+        return self.cache.get('list_drivers', None, self._build)
+
+    @rpcmethod
+    def module_info(self, module_name):
+        return {'name': module_name}
+
+    @rpcmethod
+    def reload_all(self):
+        return True
+
+
+def test_etag_matches():
+    assert etag_matches('"a"', '"a"')
+    assert etag_matches('"a"', '"b", "a"')
+    assert etag_matches('"a"', 'W/"a"')
+    assert etag_matches('"a"', '*')
+    assert not etag_matches('"a"', '"b"')
+    assert not etag_matches('"a"', None)
+    assert not etag_matches(None, '*')
+
+
+def test_conditional_introspection():
+    methods = Methods()
+    dispatcher = JsonRpcDispatcher(methods)
+
+    status, body, etag = dispatcher.handle_introspection(
+        '/introspect/list_drivers')
+    assert status == 200
+    assert json.loads(body.decode('utf-8')) == ['tv-1']
+
+    status, body, same_etag = dispatcher.handle_introspection(
+        '/introspect/list_drivers', etag)
+    assert (status, body, same_etag) == (304, b'', etag)
+    assert methods.builds == 1
+
+    # a driver was loaded
+    methods.drivers.append('tv-2')
+    methods.cache.invalidate()
+    status, body, new_etag = dispatcher.handle_introspection(
+        '/introspect/list_drivers', etag)
+    assert status == 200
+    assert new_etag != etag
+
+
+def test_introspection_parameters_and_errors():
+    dispatcher = JsonRpcDispatcher(Methods())
+
+    status, body, etag = dispatcher.handle_introspection(
+        '/introspect/module_info/tv%201')
+    assert status == 200
+    assert json.loads(body.decode('utf-8')) == {'name': 'tv 1'}
+    assert etag is not None
+
+    # only introspection RPCs are reachable with GET
+    assert dispatcher.handle_introspection('/introspect/reload_all')[0] ==\
+        404
+    assert dispatcher.handle_introspection('/introspect/module_info')[0] ==\
+        400
+
+
+def test_post_is_never_conditional():
+    dispatcher = JsonRpcDispatcher(Methods(), root_logger='test')
+    request = json.dumps({'jsonrpc': '2.0', 'method': 'list_drivers',
+                          'id': 1}).encode('utf-8')
+    data, etag = dispatcher.handle_http(request)
+    assert json.loads(data.decode('utf-8'))['result'] == ['tv-1']
+    assert etag is not None
@@ -0,0 +1,84 @@
+import struct
+import pytest
+from aggregate.discover.mdns import (CLASS_IN,
+                                     FLAG_RESPONSE,
+                                     TYPE_PTR,
+                                     TYPE_SRV,
+                                     DNSError,
+                                     DNSRecord,
+                                     MDNSCache,
+                                     build_message,
+                                     parse_message,
+                                     type_labels)
+
+INSTANCE = ('living room',) + type_labels('_http._tcp')
+PTR = DNSRecord(type_labels('_http._tcp'), TYPE_PTR, CLASS_IN, 4500, INSTANCE)
+
+
+def _compressed_response():
+    # answer name at offset 12, PTR data points back into it
+    header = struct.pack('!HHHHHH', 0, FLAG_RESPONSE, 0, 2, 0, 0)
+    name = b'\x05_http\x04_tcp\x05local\x00'
+    ptr_data = b'\x0bliving room\xc0\x0c'
+    ptr = name + struct.pack('!HHIH', TYPE_PTR, CLASS_IN, 4500,
+                             len(ptr_data)) + ptr_data
+    # SRV owned by the instance name inside the PTR data
+    instance_offset = 12 + len(name) + 10
+    srv_data = struct.pack('!HHH', 0, 0, 8080) + b'\x04host\xc0\x17'
+    srv = struct.pack('!H', 0xc000 | instance_offset) +\
+        struct.pack('!HHIH', TYPE_SRV, CLASS_IN, 120, len(srv_data)) +\
+        srv_data
+    return header + ptr + srv
+
+
+def test_round_trip():
+    message = parse_message(build_message(flags=FLAG_RESPONSE,
+                                          answers=[PTR]))
+    assert message.answers == [PTR]
+
+
+def test_name_compression():
+    message = parse_message(_compressed_response())
+    ptr, srv = message.answers
+    assert ptr.name == type_labels('_http._tcp')
+    assert ptr.data == INSTANCE
+    assert srv.name == INSTANCE
+    assert srv.data == (0, 0, 8080, ('host', 'local'))
+
+
+def test_compression_loop():
+    data = struct.pack('!HHHHHH', 0, 0, 1, 0, 0, 0) + b'\xc0\x0c' +\
+        struct.pack('!HH', TYPE_PTR, CLASS_IN)
+    with pytest.raises(DNSError):
+        parse_message(data)
+
+
+@pytest.mark.parametrize('data', [_compressed_response(),
+                                  build_message(flags=FLAG_RESPONSE,
+                                                answers=[PTR])])
+def test_truncated(data):
+    for size in range(len(data)):
+        with pytest.raises(DNSError):
+            parse_message(data[:size])
+
+
+def test_goodbye_expires_in_one_second(clock):
+    cache = MDNSCache(clock=clock)
+    assert cache.add(PTR)
+    assert cache.next_deadline() == 0.8 * PTR.ttl
+
+    clock.advance(10)
+    assert not cache.add(PTR._replace(ttl=0))
+    assert cache.get(PTR.name, TYPE_PTR) == [PTR]
+    assert cache.next_deadline() == 11
+
+    clock.advance(1)
+    assert cache.expire() == [PTR]
+    assert len(cache) == 0
+    assert cache.next_deadline() is None
+
+
+def test_goodbye_for_unknown_record(clock):
+    cache = MDNSCache(clock=clock)
+    assert not cache.add(PTR._replace(ttl=0))
+    assert len(cache) == 0
@@ -0,0 +1,77 @@
+from aggregate.util.nodes import NodeTable
+
+
+class FakeNode(object):
+    def __init__(self, services):
+        self.scanned_services = services
+
+    def get_serializable_dict(self, simple=True):
+        ret = {'node_descr': 'node'}
+        if simple is False:
+            ret['scanned_services'] = self.scanned_services
+        return ret
+
+
+def test_changes_since_version():
+    table = NodeTable()
+    table.add('a', FakeNode({}))
+    table.add('b', FakeNode({}))
+    seen = table.version
+    table.add('c', FakeNode({}))
+    table.touch('a')
+    table.touch('a')
+    table.remove('b')
+
+    changes = table.changes_since(seen)
+    assert changes['version'] == table.version
+    assert not changes['full']
+    assert list(changes['added']) == ['c']
+    assert list(changes['changed']) == ['a']
+    assert changes['removed'] == ['b']
+
+    assert table.changes_since(table.version) == {'version': table.version,
+                                                  'full': False,
+                                                  'added': {},
+                                                  'changed': {},
+                                                  'removed': []}
+
+
+def test_readded_node_is_not_removed():
+    table = NodeTable()
+    table.add('a', FakeNode({}))
+    seen = table.version
+    table.remove('a')
+    table.add('a', FakeNode({}))
+
+    changes = table.changes_since(seen)
+    assert list(changes['added']) == ['a']
+    assert changes['removed'] == []
+
+
+def test_full_table_past_the_horizon():
+    table = NodeTable(max_changes=2)
+    table.add('a', FakeNode({}))
+    table.add('b', FakeNode({}))
+    table.remove('a')
+    table.add('c', FakeNode({}))
+
+    changes = table.changes_since(1)
+    assert changes['full']
+    assert sorted(changes['added']) == ['b', 'c']
+    assert changes['removed'] == []
+
+    changes = table.changes_since(2)
+    assert not changes['full']
+    assert list(changes['added']) == ['c']
+    assert changes['removed'] == ['a']
+
+
+def test_serialized_copy_is_detached():
+    services = {'services': [{'service_name': 'mpd'}]}
+    table = NodeTable()
+    table.add('a', FakeNode(services))
+
+    serialized = table.serialize(simple=False)
+    services['services'].append({'service_name': 'lircd'})
+    assert serialized['a']['scanned_services'] ==\
+        {'services': [{'service_name': 'mpd'}]}
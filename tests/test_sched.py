@@ -0,0 +1,95 @@
+import pytest
+from aggregate.util.sched import TickScheduler
+
+
+@pytest.fixture
+def scheduler(clock):
+    return TickScheduler(clock=clock)
+
+
+def test_jobs_run_in_deadline_order(scheduler, clock):
+    calls = []
+    scheduler.schedule_oneshot(3, lambda: calls.append('c'))
+    scheduler.schedule_oneshot(1, lambda: calls.append('a'))
+    scheduler.schedule_oneshot(2, lambda: calls.append('b'))
+
+    assert scheduler.run_pending() == 1
+    assert calls == []
+
+    clock.now = 5
+    assert scheduler.run_pending() is None
+    assert calls == ['a', 'b', 'c']
+
+
+def test_periodic_job_skips_missed_periods(scheduler, clock):
+    calls = []
+    scheduler.schedule_periodic(1, lambda: calls.append(clock.now))
+
+    clock.now = 1
+    assert scheduler.run_pending() == 1
+    # late by several periods, runs once and is rescheduled from now
+    clock.now = 4.5
+    assert scheduler.run_pending() == 1
+    assert calls == [1, 4.5]
+    assert scheduler.next_deadline() == 5.5
+
+
+def test_cancel(scheduler, clock):
+    calls = []
+    job_id = scheduler.schedule_periodic(1, lambda: calls.append('x'))
+    scheduler.schedule_oneshot(2, lambda: calls.append('y'))
+
+    assert scheduler.cancel(job_id)
+    assert not scheduler.cancel(job_id)
+    assert scheduler.next_deadline() == 2
+
+    clock.now = 10
+    scheduler.run_pending()
+    assert calls == ['y']
+    assert scheduler.next_deadline() is None
+
+
+def test_job_can_cancel_itself(scheduler, clock):
+    calls = []
+
+    def _job():
+        calls.append(clock.now)
+        scheduler.cancel(job_id)
+
+    job_id = scheduler.schedule_periodic(1, _job)
+    clock.now = 3
+    scheduler.run_pending()
+    clock.now = 6
+    scheduler.run_pending()
+    assert calls == [3]
+
+
+def test_kwargs_and_errors(scheduler, clock):
+    calls = []
+
+    def _fail():
+        raise RuntimeError('boom')
+
+    scheduler.schedule_oneshot(1, _fail)
+    scheduler.schedule_oneshot(2, lambda value: calls.append(value),
+                               value=42)
+    clock.now = 2
+    scheduler.run_pending()
+    assert calls == [42]
+
+
+def test_wakeup_only_for_earlier_deadlines(scheduler):
+    wakeups = []
+    scheduler.wakeup_cb = lambda: wakeups.append(True)
+
+    scheduler.schedule_oneshot(5, lambda: None)
+    scheduler.schedule_oneshot(10, lambda: None)
+    scheduler.schedule_oneshot(1, lambda: None)
+    assert len(wakeups) == 2
+
+
+def test_invalid_delays(scheduler):
+    with pytest.raises(ValueError):
+        scheduler.schedule_oneshot(-1, lambda: None)
+    with pytest.raises(ValueError):
+        scheduler.schedule_periodic(0, lambda: None)
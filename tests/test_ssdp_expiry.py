@@ -0,0 +1,114 @@
+import pytest
+from aggregate.discover import SSDPDiscoveryBase
+
+
+class Discovery(SSDPDiscoveryBase):
+    def __init__(self, clock):
+        self.discovered = []
+        self.removed = []
+        super(Discovery, self).__init__('test', interval=3,
+                                        removal_interval=10,
+                                        service_discovered_cb=self._found,
+                                        service_removed_cb=self._gone,
+                                        clock=clock)
+        self.add_discovery_type('239.255.255.250', 1900, 'roku:ecp')
+
+    def _found(self, **service):
+        self.discovered.append(service['USN'])
+
+    def _gone(self, **service):
+        self.removed.append(service['USN'])
+
+
+def _response(usn, max_age=None, st='roku:ecp'):
+    service = {'ST': st, 'USN': usn}
+    if max_age is not None:
+        service['CACHE-CONTROL'] = 'max-age={}'.format(max_age)
+    return service
+
+
+@pytest.fixture
+def discovery(clock):
+    return Discovery(clock)
+
+
+def test_services_expire_at_their_deadline(discovery, clock):
+    discovery._service_seen(_response('uuid:a', max_age=60))
+    discovery._service_seen(_response('uuid:b', max_age=10))
+    assert discovery.discovered == ['uuid:a', 'uuid:b']
+    assert discovery.next_expiry() == 10
+
+    clock.now = 9.9
+    assert discovery._expire_services() == 10
+    assert discovery.removed == []
+
+    clock.now = 10
+    assert discovery._expire_services() == 60
+    assert discovery.removed == ['uuid:b']
+    assert list(discovery.known_services) == ['uuid:a']
+
+
+def test_sighting_pushes_the_deadline(discovery, clock):
+    discovery._service_seen(_response('uuid:a', max_age=10))
+    clock.now = 8
+    discovery._service_seen(_response('uuid:a', max_age=10))
+
+    clock.now = 12
+    assert discovery._expire_services() == 18
+    assert discovery.removed == []
+
+    clock.now = 18
+    assert discovery._expire_services() is None
+    assert discovery.removed == ['uuid:a']
+    # seen once, the second sighting is not a new discovery
+    assert discovery.discovered == ['uuid:a']
+
+
+def test_lifetime_without_max_age(discovery, clock):
+    # searched every 3 s, gone after 10 missed searches
+    discovery._service_seen(_response('uuid:a'))
+    assert discovery.next_expiry() == 30
+
+    discovery.listening = True
+    discovery._service_seen(_response('uuid:b'))
+    assert discovery.next_expiry() == 30
+    clock.now = 30
+    assert discovery._expire_services() == 1800
+
+
+def test_byebye_drops_the_deadline(discovery, clock):
+    discovery._service_seen(_response('uuid:a', max_age=10))
+    discovery._service_gone('uuid:a')
+    assert discovery.removed == ['uuid:a']
+    assert discovery.next_expiry() is None
+
+    clock.now = 20
+    discovery._expire_services()
+    assert discovery.removed == ['uuid:a']
+
+
+def test_unwanted_responses_are_ignored(discovery):
+    discovery._service_seen(_response('uuid:a', st='other'))
+    discovery._service_seen({'ST': 'roku:ecp'})
+    discovery._service_seen(None)
+    assert discovery.discovered == []
+    assert discovery.next_expiry() is None
+
+
+def test_outdated_heap_entries_are_compacted(discovery, clock):
+    for _ in range(200):
+        discovery._service_seen(_response('uuid:a', max_age=10))
+    assert len(discovery._expiry_heap) <= 4 + 64
+
+    clock.now = 10
+    discovery._expire_services()
+    assert discovery.removed == ['uuid:a']
+
+
+def test_restored_services_expire(discovery, clock):
+    discovery.restore_services([_response('uuid:a', max_age=5)])
+    assert discovery.next_expiry() == 5
+
+    clock.now = 5
+    discovery._expire_services()
+    assert discovery.removed == ['uuid:a']